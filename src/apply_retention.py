@@ -0,0 +1,19 @@
+import argparse
+from data_management.retention import RetentionEngine
+from data_management.storage import DataStorage
+
+def main():
+    parser = argparse.ArgumentParser(description='Reclaim space: expire or downsample old audio, '
+                                                 'link duplicate files and archive small JSON artifacts')
+    parser.add_argument('--budget', type=float, default=60.0, help='Seconds to spend before stopping (resumes next run)')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be reclaimed without changing anything')
+    args = parser.parse_args()
+
+    storage = DataStorage()
+    engine = RetentionEngine(storage, dry_run=args.dry_run)
+    engine.run(args.budget)
+    print(engine.report())
+    storage.close()
+
+if __name__ == "__main__":
+    main()
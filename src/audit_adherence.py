@@ -0,0 +1,26 @@
+import argparse
+import time
+from pathlib import Path
+from data_management.storage import DataStorage
+from post_interaction.adherence_audit import AdherenceAudit
+from protocols.protocol_manager import ProtocolManager
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit stored interactions against the current protocols (no LLM calls)')
+    parser.add_argument('--output', type=str, default='data/processed/audit', help='Directory for the adherence tables')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    protocol_manager = ProtocolManager()
+    result = AdherenceAudit(protocol_manager.snapshot()).run(DataStorage().iter_interactions(), Path(args.output))
+    elapsed = time.perf_counter() - started
+
+    print(f"Audited {len(result['sessions'])} sessions against protocols {result['protocol_version']} in {elapsed:.2f}s")
+    for row in result['groups']:
+        trimester = f" ({row['trimester']} trimester)" if row['trimester'] else ""
+        print(f"  {row['protocol']}{trimester}: {row['sessions']} sessions, "
+              f"mean adherence {row['mean_adherence']:.0%}, fully adherent {row['fully_adherent_rate']:.0%}")
+    print(f"Tables written to {args.output}")
+
+if __name__ == "__main__":
+    main()
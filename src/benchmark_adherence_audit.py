@@ -0,0 +1,50 @@
+import random
+import tempfile
+import time
+from pathlib import Path
+from post_interaction.adherence_audit import AdherenceAudit
+from protocols.protocol_manager import ProtocolManager
+
+CONDITIONS = ["prenatal", "communicable", "non-communicable", None]
+TRIMESTERS = ["first", "second", "third", None]
+RECORDED = ["BP 120/80", "presyon", "timbang", "65 kilos", "fundal height", "FHR 140", "ihi test",
+            "temperatura", "pulso", "hemoglobin", "MUAC", "respiratory rate", "swelling check"]
+TOPICS = ["nutrition", "danger signs", "exercise", "birth plan", "breastfeeding", "hygiene", "smoking"]
+READINGS = ["BP 120 over 80", "BP 185/125", "temperature 38.5 degrees", "temp 36.8 °C",
+            "pulse 130", "pulso 72", "breaths 9", "paghinga 16"]
+
+def synthetic_sessions(count, seed=0):
+    """Stored-interaction metadata shaped like DataStorage output, with and without context."""
+    rng = random.Random(seed)
+    for i in range(count):
+        transcript = "\n".join(f"[00:{j:02d}] BHW: {r}" for j, r in enumerate(rng.sample(READINGS, 3)))
+        context = None
+        if rng.random() < 0.9:
+            context = {
+                'condition_type': rng.choice(CONDITIONS),
+                'trimester': rng.choice(TRIMESTERS),
+                'measurements': rng.sample(RECORDED, rng.randint(0, 8)),
+                'covered_topics': rng.sample(TOPICS, rng.randint(0, 4)),
+            }
+        yield {'timestamp': f"session_{i:06d}", 'transcript': transcript, 'guidance': {}, 'context': context}
+
+def benchmark_audit(sizes=(1000, 10000, 50000)):
+    compiled = ProtocolManager().snapshot()
+    print(f"Adherence audit, protocols {compiled.version}")
+    print("-" * 70)
+    with tempfile.TemporaryDirectory() as output_dir:
+        for count in sizes:
+            sessions = list(synthetic_sessions(count))
+            audit = AdherenceAudit(compiled)
+            started = time.perf_counter()
+            facts = audit.load(sessions)
+            loaded = time.perf_counter()
+            results = audit.evaluate(facts)
+            evaluated = time.perf_counter()
+            audit.run(sessions, Path(output_dir))
+            total = time.perf_counter() - evaluated
+            print(f"{count:>6} sessions: load {loaded - started:6.2f}s  evaluate {(evaluated - loaded) * 1000:7.1f} ms  "
+                  f"full run incl. CSV {total:6.2f}s  ({results['fully_adherent'].mean():.0%} fully adherent)")
+
+if __name__ == "__main__":
+    benchmark_audit()
@@ -0,0 +1,61 @@
+import tempfile
+import time
+import wave
+from pathlib import Path
+import numpy as np
+from voice_processing.audio_capture import AudioRingBuffer, BLOCK, DROP_OLDEST, FileSource
+
+RATE = 16000
+CHUNK_FRAMES = 1024
+FRAME_BYTES = 4  # float32 mono
+
+def write_test_wav(path, seconds):
+    """A 16-bit mono test tone."""
+    t = np.arange(seconds * RATE) / RATE
+    samples = (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype('<i2')
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(RATE)
+        f.writeframes(samples.tobytes())
+
+def consume(ring, speed, stall_every, stall_seconds):
+    """A consumer that periodically stalls (a slow guidance or storage step), in audio-time seconds."""
+    received = bytearray()
+    next_stall = stall_every
+    for frame in ring.frames(CHUNK_FRAMES * FRAME_BYTES, timeout=1.0):
+        received += frame
+        if len(received) / FRAME_BYTES / RATE >= next_stall:
+            time.sleep(stall_seconds / speed)
+            next_stall += stall_every
+    return bytes(received)
+
+def run(label, path, seconds, capacity_seconds, policy, speed, stall_every=2.0, stall_seconds=0.8):
+    source = FileSource(path, speed=speed, chunk_frames=CHUNK_FRAMES)
+    expected = b"".join(source._chunks())
+    ring = AudioRingBuffer(int(capacity_seconds * RATE) * FRAME_BYTES, policy, frame_bytes=FRAME_BYTES)
+    started = time.perf_counter()
+    source.start(ring)
+    received = consume(ring, speed or 8.0, stall_every, stall_seconds)
+    elapsed = time.perf_counter() - started
+    source.stop()
+    intact = received == expected
+    print(f"  {label:<40} {ring.overruns:4d} overruns, {ring.dropped_bytes / FRAME_BYTES / RATE:6.2f}s dropped, "
+          f"{ring.underruns:3d} underruns, peak backlog {ring.max_fill / FRAME_BYTES / RATE:5.2f}s, "
+          f"{len(received) / FRAME_BYTES / RATE:6.1f}s received{' (intact)' if intact else ''}, {elapsed:.2f}s")
+    assert len(received) + ring.dropped_bytes == len(expected)
+
+def benchmark_audio_capture(seconds=60, speed=8.0):
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "session.wav"
+        write_test_wav(path, seconds)
+        print(f"{seconds}s file at {speed:.0f}x real time, consumer stalls 0.8s every 2s of audio")
+        # PortAudio's own buffering under a blocking read is a few buffers deep
+        run("blocking-read equivalent (4 buffers)", path, seconds, 4 * CHUNK_FRAMES / RATE, DROP_OLDEST, speed)
+        run("ring 0.5s, drop oldest", path, seconds, 0.5, DROP_OLDEST, speed)
+        run("ring 10s, drop oldest", path, seconds, 10.0, DROP_OLDEST, speed)
+        run("ring 0.5s, block", path, seconds, 0.5, BLOCK, speed)
+        run("ring 0.5s, block, file at max speed", path, seconds, 0.5, BLOCK, 0)
+
+if __name__ == "__main__":
+    benchmark_audio_capture()
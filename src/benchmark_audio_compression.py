@@ -0,0 +1,41 @@
+import shutil
+import tempfile
+import numpy as np
+from data_management.audio_compression import AudioCompressor, CODECS
+from data_management.storage import DataStorage
+
+RATE = 16000
+
+def speech_like(seconds, seed=0):
+    """Float32 audio with voiced bursts (harmonics + noise) separated by quiet gaps."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * RATE)) / RATE
+    pitch = 120 + 40 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = (np.sin(2 * np.pi * 0.4 * t) > -0.2).astype(float) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) ** 2)
+    audio = 0.2 * voiced * envelope + 0.01 * rng.standard_normal(len(t))
+    return audio.astype(np.float32)
+
+def benchmark_compression(seconds=600, sessions=3):
+    if not shutil.which("ffmpeg"):
+        print("ffmpeg not found; the encoder needs it (pydub shells out to ffmpeg)")
+        return
+    for codec in CODECS:
+        with tempfile.TemporaryDirectory() as base_dir:
+            storage = DataStorage(base_dir)
+            for i in range(sessions):
+                with storage.open_recording(f"bench{i}") as recorder:
+                    audio = speech_like(seconds, seed=i)
+                    for start in range(0, len(audio), 1024):
+                        recorder.write(audio[start:start + 1024].tobytes())
+                # Only recordings the index knows as a session's are compressed
+                storage.store_interaction(None, "...", {}, session_id=f"bench{i}", audio_file=str(recorder.path),
+                                          audio_start=0.0, audio_end=seconds)
+            compressor = AudioCompressor(storage, codec)
+            compressor.compress_pending()
+            print(compressor.report())
+            storage.close()
+
+if __name__ == "__main__":
+    benchmark_compression()
@@ -0,0 +1,173 @@
+import argparse
+import re
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from pydub import AudioSegment
+from benchmark_vad import CHUNK_FRAMES, RATE, SYNTHETIC_AUDIO, add_noise, conversation, mask, score, visit_truth
+from data_management.session_recorder import SessionRecorder
+from voice_processing.denoise import SpectralGate
+from voice_processing.pcm import float_to_int16
+from voice_processing.vad import VoiceActivityDetector
+
+SYNTHETIC_TEXT = Path("data/synthetic/text")
+
+def engine_noise(rng, samples, snr_db):
+    """
+    A tricycle idling nearby: a two-stroke hum (about 25 Hz firing rate with
+    harmonics, wandering with the throttle) over exhaust rumble, at snr_db
+    below the speech level.
+    """
+    t = np.arange(len(samples)) / RATE
+    rate = 25 * (1 + 0.05 * np.sin(2 * np.pi * 0.3 * t))
+    phase = 2 * np.pi * np.cumsum(rate) / RATE
+    hum = sum(np.sin(k * phase + rng.uniform(0, 2 * np.pi)) / k for k in range(1, 40))
+    spectrum = np.fft.rfft(rng.standard_normal(len(samples)))
+    spectrum[int(800 * len(samples) / RATE):] *= 0.1
+    noise = hum + 0.5 * np.fft.irfft(spectrum, len(samples)) * np.std(hum)
+    speech_power = np.mean(samples[np.abs(samples) > 1e-4] ** 2)
+    noise *= np.sqrt(speech_power / np.mean(noise ** 2) / 10 ** (snr_db / 10))
+    return (samples + noise).astype(np.float32)
+
+def level_db(samples):
+    return 10 * np.log10(np.mean(samples ** 2) + 1e-12)
+
+def quality(output, clean, speech):
+    """Noise left in the silence (dBFS) and speech SNR (clean speech over what differs from it, dB)."""
+    silence = output[~speech]
+    error = output[speech] - clean[speech]
+    return level_db(silence), level_db(clean[speech]) - level_db(error)
+
+def sample_mask(truth, length):
+    result = np.zeros(length, dtype=bool)
+    for start, end in truth:
+        result[int(start * RATE):int(end * RATE)] = True
+    return result
+
+def run(label, noisy, clean, truth):
+    seconds = len(noisy) / RATE
+    speech = sample_mask(truth, len(noisy))
+    gate, vad = SpectralGate(rate=RATE), VoiceActivityDetector(rate=RATE)
+    # Live path: the gate learns from the audio the VAD has not opened on, as in run_session
+    started = time.process_time()
+    streamed = []
+    for start in range(0, len(noisy), CHUNK_FRAMES):
+        streamed.append(gate.process(noisy[start:start + CHUNK_FRAMES], silence=not vad.speaking))
+        vad.process(streamed[-1])
+    streamed.append(gate.flush())
+    stream_time = time.process_time() - started
+    streamed = np.concatenate(streamed)
+    started = time.process_time()
+    batch = SpectralGate(rate=RATE).denoise(noisy)
+    batch_time = time.process_time() - started
+    raw_silence, raw_snr = quality(noisy, clean, speech)
+    stream_silence, stream_snr = quality(streamed, clean, speech)
+    batch_silence, batch_snr = quality(batch, clean, speech)
+    vad_raw = score(VoiceActivityDetector(rate=RATE).segments(noisy), truth, seconds)
+    vad_batch = score(VoiceActivityDetector(rate=RATE).segments(batch), truth, seconds)
+    print(f"  {label:<20} noise in silence {raw_silence:6.1f} -> {stream_silence:6.1f} dB streaming, "
+          f"{batch_silence:6.1f} dB batch; speech SNR {raw_snr:5.1f} -> {stream_snr:5.1f} / {batch_snr:5.1f} dB")
+    print(f"  {'':<20} CPU {stream_time / seconds * 1000:5.2f} ms per audio second streaming with VAD "
+          f"({seconds / stream_time:5.0f}x real time), {batch_time / seconds * 1000:5.2f} ms batch; "
+          f"VAD recall {vad_raw[0]:6.1%} -> {vad_batch[0]:6.1%}, forwarded {vad_raw[2]:5.1%} -> {vad_batch[2]:5.1%}")
+    return batch
+
+def load_visit(path):
+    audio = AudioSegment.from_file(path).set_channels(1).set_frame_rate(RATE).set_sample_width(2)
+    return np.frombuffer(audio.raw_data, dtype='<i2').astype(np.float32) / 32768
+
+def script_words(path):
+    """The words spoken in a dialogue script, without timestamps, speaker labels or punctuation."""
+    words = []
+    for line in path.read_text(encoding='utf-8').splitlines():
+        match = re.match(r'\s*(?:\[\d{2}:\d{2}\]\s*)?[^:\[\]]+:\s*(\S.*)', line)
+        if match:
+            words.extend(re.findall(r"[\w']+", match.group(1).lower()))
+    return words
+
+def word_error_rate(hypothesis, reference):
+    """Word-level edit distance over the reference length."""
+    previous = np.arange(len(hypothesis) + 1)
+    for i, word in enumerate(reference, 1):
+        current = np.empty_like(previous)
+        current[0] = i
+        for j, guess in enumerate(hypothesis, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (word != guess))
+        previous = current
+    return previous[-1] / max(len(reference), 1)
+
+def transcribe(client, samples):
+    """Whisper's transcript of samples, sent as a 16-bit WAV."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "audio.wav"
+        recorder = SessionRecorder(path, rate=RATE, channels=1, sample_width=2, is_float=False)
+        recorder.write(float_to_int16(samples, np.empty(len(samples), dtype='<i2'), np.empty_like(samples)).tobytes())
+        recorder.close()
+        with open(path, 'rb') as audio:
+            response = client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio,
+                language="tl",  # ISO code for Tagalog
+                response_format="text",
+                prompt="This is a conversation between a Barangay Health Worker and a patient in Tagalog (Tayabas dialect)."
+            )
+    return re.findall(r"[\w']+", str(response).lower())
+
+def benchmark_transcription(visits, conditions, rng):
+    """Whisper word error rate on noisy and denoised copies of generated visits, against their scripts."""
+    from openai import OpenAI
+    client = OpenAI()
+    for name, samples, _ in visits:
+        script = SYNTHETIC_TEXT / f"{Path(name).stem}.txt"
+        if not script.exists():
+            print(f"{name}: no script in {SYNTHETIC_TEXT}, skipped")
+            continue
+        reference = script_words(script)
+        print(f"{name}: {len(reference)} words")
+        for label, noise in conditions:
+            noisy = noise(rng, samples)
+            for version, audio in (("raw", noisy), ("denoised", SpectralGate(rate=RATE).denoise(noisy))):
+                words = transcribe(client, audio)
+                print(f"  {label:<20} {version:<9} WER {word_error_rate(words, reference):6.1%}, "
+                      f"{len(words)} words transcribed")
+
+def benchmark_denoise():
+    parser = argparse.ArgumentParser(description="Benchmark spectral-gating noise suppression")
+    parser.add_argument('--online', action='store_true',
+                        help='Also transcribe noisy and denoised generated visits with Whisper and compare WER '
+                             '(needs OPENAI_API_KEY and data/synthetic audio with scripts)')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    conditions = [
+        ("pink noise 10 dB", lambda rng, s: add_noise(rng, s, 10)),
+        ("pink noise 5 dB", lambda rng, s: add_noise(rng, s, 5)),
+        ("pink noise 0 dB", lambda rng, s: add_noise(rng, s, 0)),
+        ("tricycle 5 dB", lambda rng, s: engine_noise(rng, s, 5)),
+        ("10 dB, +6 dB midway", lambda rng, s: add_noise(rng, s, 10, 0.5)),
+    ]
+    visits = []
+    for path in sorted(SYNTHETIC_AUDIO.glob("*.mp3"))[:5]:
+        samples = load_visit(path)
+        visits.append((path.name, samples, visit_truth(samples)))
+    if not visits:
+        print(f"No generated visits in {SYNTHETIC_AUDIO}; using stand-in conversations built the same way")
+        for number in range(2):
+            visits.append((f"stand-in visit {number + 1}",) + conversation(rng))
+        visits.append(("stand-in visit with exam pauses",) + conversation(rng, idle=0.2))
+    gate = SpectralGate(rate=RATE)
+    print(f"Frame {gate.frame} samples, hop {gate.hop}, latency {gate.latency * 1000:.0f} ms; "
+          f"CPU is process time, speech SNR is against the clean recording")
+    for name, samples, truth in visits:
+        silence = 1 - mask(truth, len(samples) / RATE).mean()
+        print(f"{name}: {len(samples) / RATE:.0f}s, {len(truth)} lines, {silence:.0%} silence")
+        for label, noise in conditions:
+            run(label, noise(rng, samples), samples, truth)
+    if args.online:
+        benchmark_transcription([visit for visit in visits if visit[0].endswith('.mp3')], conditions, rng)
+    else:
+        print("Transcription quality needs Whisper: run with --online on generated visits for WER, raw vs denoised")
+
+if __name__ == "__main__":
+    benchmark_denoise()
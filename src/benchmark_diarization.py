@@ -0,0 +1,143 @@
+import re
+import time
+from itertools import permutations
+from pathlib import Path
+import numpy as np
+from pydub import AudioSegment
+from benchmark_vad import RATE, add_noise, syllable, visit_truth
+from voice_processing.diarization import BHW, PATIENT, Diarizer
+
+SYNTHETIC_AUDIO = Path("data/synthetic/audio")
+SYNTHETIC_TEXT = Path("data/synthetic/text")
+RESOLUTION = 0.01
+COLLAR = 0.25  # seconds either side of a true boundary not scored, as is usual for DER
+
+# Stand-in voices: pitch range (Hz), formant scale, harmonic roll-off. generate_audio.py uses
+# nova for the BHW and alloy or echo for a female or male patient.
+VOICES = {
+    'bhw': ((190, 240), 1.12, 1.0),
+    'patient_f': ((165, 215), 1.0, 1.3),
+    'patient_m': ((95, 140), 0.85, 1.1),
+}
+
+def dialogue(rng, voices, lines=40):
+    """
+    A visit laid out like generate_audio.py's (100 ms fades, 500 ms pauses,
+    750 ms on a change of speaker) with each speaker's lines in their own
+    voice. Returns the audio and the true (start, end, speaker) lines.
+    """
+    parts, truth, position, speaker = [], [], 0, 0
+    names = list(voices)
+    for line in range(lines):
+        if line:
+            changed = len(names) > 1 and rng.random() < 0.7
+            speaker ^= changed
+            pause = int((0.75 if changed else 0.5) * RATE)
+            parts.append(np.zeros(pause))
+            position += pause
+        words = []
+        for _ in range(rng.integers(3, 15)):
+            words.extend(syllable(rng, rng.uniform(0.1, 0.3), voices[names[speaker]])
+                         for _ in range(rng.integers(1, 4)))
+            words.append(np.zeros(int(rng.uniform(0.02, 0.15) * RATE)))
+        speech = np.concatenate(words[:-1]) * rng.uniform(0.05, 0.3) / 0.3
+        fade = int(0.1 * RATE)
+        speech[:fade] *= np.linspace(0, 1, fade)
+        speech[-fade:] *= np.linspace(1, 0, fade)
+        parts.append(speech)
+        truth.append((position / RATE, (position + len(speech)) / RATE, names[speaker]))
+        position += len(speech)
+    parts.append(np.zeros(int(0.5 * RATE)))
+    return np.concatenate(parts).astype(np.float32), truth
+
+def script_speakers(path):
+    """BHW or patient for each line of a dialogue script, as generate_audio.py reads it."""
+    speakers = []
+    for line in path.read_text(encoding='utf-8').splitlines():
+        match = re.match(r'\s*(?:\[\d{2}:\d{2}\]\s*)?([^:\[\]]+):\s*\S', line)
+        if match:
+            speakers.append('bhw' if 'BHW' in match.group(1) else 'patient')
+    return speakers
+
+def labels(intervals, seconds):
+    """Per-frame speaker name (None for no speech)."""
+    result = np.full(int(seconds / RESOLUTION) + 1, None, dtype=object)
+    for start, end, speaker in intervals:
+        result[int(start / RESOLUTION):int(end / RESOLUTION)] = speaker
+    return result
+
+def error_rates(turns, truth, seconds):
+    """
+    Diarization error rate (missed speech + false alarm + speaker confusion,
+    over the true speech time, with the best mapping of found to true
+    speakers) and the confusion with roles as labelled (BHW must be the BHW).
+    """
+    reference, hypothesis = labels(truth, seconds), labels(turns, seconds)
+    scored = np.ones(len(reference), dtype=bool)
+    for start, end, _ in truth:
+        for edge in (start, end):
+            scored[max(0, int((edge - COLLAR) / RESOLUTION)):int((edge + COLLAR) / RESOLUTION)] = False
+    reference, hypothesis = reference[scored], hypothesis[scored]
+    speech, found = reference != None, hypothesis != None  # noqa: E711 (elementwise)
+    total = max(speech.sum(), 1)
+    missed, false_alarm = (speech & ~found).sum(), (found & ~speech).sum()
+    both = speech & found
+    true_names = sorted(set(reference[speech]))
+    found_names = sorted(set(hypothesis[found]))
+    best = both.sum()
+    for order in permutations(true_names, min(len(true_names), len(found_names))):
+        mapping = dict(zip(found_names, order))
+        wrong = sum(1 for r, h in zip(reference[both], hypothesis[both]) if mapping.get(h) != r)
+        best = min(best, wrong)
+    roles = {BHW: 'bhw', PATIENT: 'patient'}
+    role_wrong = sum(1 for r, h in zip(reference[both], hypothesis[both]) if roles.get(h) != r.split('_')[0])
+    return (missed + false_alarm + best) / total, missed / total, false_alarm / total, best / total, role_wrong / total
+
+def run(label, samples, truth, diarizer):
+    seconds = len(samples) / RATE
+    started = time.perf_counter()
+    turns = diarizer.diarize(samples)
+    elapsed = time.perf_counter() - started
+    der, missed, false_alarm, confusion, role = error_rates(turns, truth, seconds)
+    speakers = len({turn.speaker for turn in turns})
+    print(f"  {label:<36} DER {der:6.1%} (missed {missed:5.1%}, false alarm {false_alarm:5.1%}, "
+          f"confusion {confusion:5.1%}), role error {role:5.1%}, {speakers} speakers, "
+          f"{len(turns)} segments, {seconds / elapsed:5.0f}x real time")
+
+def benchmark_diarization():
+    rng = np.random.default_rng(0)
+    visits = []
+    for path in sorted(SYNTHETIC_AUDIO.glob("*.mp3"))[:5]:
+        script = SYNTHETIC_TEXT / f"{path.stem}.txt"
+        if not script.exists():
+            continue
+        audio = AudioSegment.from_file(path).set_channels(1).set_frame_rate(RATE).set_sample_width(2)
+        samples = np.frombuffer(audio.raw_data, dtype='<i2').astype(np.float32) / 32768
+        intervals, speakers = visit_truth(samples), script_speakers(script)
+        if len(intervals) != len(speakers):
+            print(f"{path.name}: {len(intervals)} lines in the audio but {len(speakers)} in the script, skipped")
+            continue
+        visits.append((path.name, samples, [(start, end, speaker) for (start, end), speaker in zip(intervals, speakers)]))
+    enrollment = None
+    if not visits:
+        print(f"No generated visits in {SYNTHETIC_AUDIO}; using stand-in visits with distinct voices")
+        for number, patient in enumerate(('patient_f', 'patient_m', 'patient_f')):
+            visits.append((f"stand-in visit {number + 1} ({patient.replace('_', ' ')})",)
+                          + dialogue(rng, {'bhw': VOICES['bhw'], patient: VOICES[patient]}))
+        # First-speaker identification gets this one backwards; an enrolled voice should not
+        visits.append(("stand-in visit 4 (patient m speaks first)",)
+                      + dialogue(rng, {'patient_m': VOICES['patient_m'], 'bhw': VOICES['bhw']}))
+        # The BHW enrolled once, on a separate recording of their own voice
+        monologue, _ = dialogue(rng, {'bhw': VOICES['bhw']}, lines=8)
+        enrollment = Diarizer().enroll(monologue)
+    for name, samples, truth in visits:
+        print(f"{name}: {len(samples) / RATE:.0f}s, {len(truth)} lines")
+        for label, snr in (("clean", None), ("noise 20 dB SNR", 20), ("noise 10 dB SNR", 10)):
+            noisy = add_noise(rng, samples, snr)
+            run(f"{label}, 2 speakers", noisy, truth, Diarizer())
+            run(f"{label}, speakers estimated", noisy, truth, Diarizer(num_speakers=None))
+            if enrollment is not None:
+                run(f"{label}, enrolled BHW", noisy, truth, Diarizer(profile=enrollment))
+
+if __name__ == "__main__":
+    benchmark_diarization()
@@ -0,0 +1,71 @@
+import os
+import random
+import struct
+import tempfile
+import time
+from pathlib import Path
+from data_management.encryption import EncryptedFileReader, generate_key
+from data_management.session_recorder import SessionRecorder, read_wav_info
+
+RATE = 16000
+CHUNK_FRAMES = 1024
+CHUNK = struct.pack(f"<{CHUNK_FRAMES}f", *([0.25] * CHUNK_FRAMES))  # one paFloat32 chunk (~64 ms)
+WINDOW = RATE * 4  # one second of float32 mono
+KEY = generate_key()
+
+def record(path, chunks, key=None):
+    """Append a session's chunks, syncing every 5 s of audio as the live recorder would."""
+    started = time.perf_counter()
+    recorder = SessionRecorder(path, rate=RATE, fsync_interval=float('inf'),
+                               key=key, key_id="bench" if key else None)
+    chunks_per_sync = int(5 * RATE / CHUNK_FRAMES)
+    for i in range(chunks):
+        recorder.write(CHUNK)
+        if i % chunks_per_sync == chunks_per_sync - 1:
+            recorder.sync()
+    recorder.close()
+    return time.perf_counter() - started
+
+def random_windows(path, offsets, key=None):
+    """Read one-second windows at the given data offsets."""
+    started = time.perf_counter()
+    if key is None:
+        fd = os.open(path, os.O_RDONLY)
+        for offset in offsets:
+            assert len(os.pread(fd, WINDOW, offset)) == WINDOW
+        os.close(fd)
+    else:
+        reader = EncryptedFileReader(path, lambda key_id: key)
+        for offset in offsets:
+            assert len(reader.read_at(offset, WINDOW)) == WINDOW
+        reader.close()
+    return time.perf_counter() - started
+
+def overhead(plain, encrypted):
+    return (encrypted / plain - 1) * 100
+
+def benchmark_encryption(minutes=(10, 60), reads=2000, repeats=3):
+    for length in minutes:
+        chunks = int(length * 60 * RATE / CHUNK_FRAMES)
+        audio_seconds = chunks * CHUNK_FRAMES / RATE
+        print(f"{length}-minute session ({chunks * len(CHUNK) / 1e6:.1f} MB of float32 audio)")
+        with tempfile.TemporaryDirectory() as directory:
+            plain_path, encrypted_path = Path(directory) / "plain.wav", Path(directory) / "encrypted.wav"
+            plain = min(record(plain_path, chunks) for _ in range(repeats))
+            encrypted = min(record(encrypted_path, chunks, KEY) for _ in range(repeats))
+            print(f"  append  plain {plain:6.3f}s  encrypted {encrypted:6.3f}s  "
+                  f"overhead {overhead(plain, encrypted):+6.1f}%  "
+                  f"({(encrypted - plain) / audio_seconds * 100:.4f}% of real time)")
+
+            info = read_wav_info(plain_path)
+            rng = random.Random(0)
+            offsets = [info.data_offset + rng.randrange(0, info.data_size - WINDOW) for _ in range(reads)]
+            plain = min(random_windows(plain_path, offsets) for _ in range(repeats))
+            encrypted = min(random_windows(encrypted_path, offsets, KEY) for _ in range(repeats))
+            print(f"  seek    plain {plain / reads * 1e6:6.1f}us  encrypted {encrypted / reads * 1e6:6.1f}us "
+                  f"per 1 s window  overhead {overhead(plain, encrypted):+6.1f}%")
+            print(f"  size    plain {plain_path.stat().st_size / 1e6:.2f} MB  "
+                  f"encrypted {encrypted_path.stat().st_size / 1e6:.2f} MB")
+
+if __name__ == "__main__":
+    benchmark_encryption()
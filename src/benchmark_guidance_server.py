@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+import numpy as np
+from benchmark_vad import RATE, conversation
+
+SYNTHETIC_AUDIO = Path("data/synthetic/audio")
+
+def offline_services(assistant, latency, alert_every):
+    """
+    Replace the Whisper ASR (AudioAnalyzer.process_audio_stream) and
+    GuidanceEngine.generate_guidance with fixed-delay stand-ins, so only the
+    server, its DSP and the local pipeline are measured; results say nothing
+    about the real services. Every alert_every-th transcript mentions a danger sign (a different one
+    each time), so the alert path is exercised.
+    """
+    from real_time_guidance.guidance_engine import GuidanceEngine
+    terms = sorted(assistant.guidance_engine.protocol_manager.get_danger_sign_terms())
+    calls = itertools.count()
+
+    def transcribe(audio, rate):
+        time.sleep(latency)
+        number = next(calls)
+        text = f"utterance of {len(audio) / 4 / rate:.1f}s"
+        if alert_every and number % alert_every == 0:
+            text += f", {terms[(number // alert_every) % len(terms)]}"
+        return text
+
+    def guide(self, transcript, *args, **kwargs):
+        time.sleep(latency)
+        return {'summary': transcript[-80:]}
+
+    assistant.analyzer.process_audio_stream = transcribe
+    GuidanceEngine.generate_guidance = guide
+
+def run_server(ports, data_dir, service_latency, alert_every, max_inflight, dsp_block):
+    """Child process: the guidance server on its own, as on the station's box."""
+    sys.stdout = open(os.devnull, 'w')  # per-alert console lines
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    os.environ.setdefault("ANTHROPIC_API_KEY", "offline")
+    os.environ["ASR_WORKERS"] = os.environ["GUIDANCE_WORKERS"] = "32"
+    from frontend.server import GuidanceServer
+    from main import BHWAssistant
+    assistant = BHWAssistant(mode='production', data_dir=data_dir)
+    offline_services(assistant, service_latency, alert_every)
+    server = GuidanceServer(assistant, host="127.0.0.1", port=0, max_sessions=1000, max_inflight=max_inflight,
+                            dsp_block=dsp_block)
+
+    async def serve():
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        await server.start()
+        ports.put(server.port)
+        await stop.wait()
+        await server.close()
+
+    asyncio.run(serve())
+    assistant.shutdown()
+
+def visits(audio_dir):
+    """16-bit visits to stream: recordings from audio_dir, or stand-in visits laid out like generate_audio.py's."""
+    recordings = sorted(Path(audio_dir).glob("*.mp3")) + sorted(Path(audio_dir).glob("*.wav"))
+    if recordings:
+        from voice_processing.audio_capture import load_samples
+        samples = [load_samples(path, RATE) for path in recordings]
+    else:
+        print(f"No recordings in {audio_dir}; streaming stand-in visits")
+        rng = np.random.default_rng(0)
+        samples = [conversation(rng, lines=20, idle=0.2)[0] for _ in range(3)]
+    return [(np.clip(s, -1, 1) * 32767).astype('<i2').tobytes() for s in samples]
+
+async def phone(port, audio, delay, chunk_seconds, speed, result):
+    """One phone: connect, stream the visit in real time, collect what the server pushes until the summary."""
+    from frontend.server import OP_BINARY, OP_TEXT, ConnectionClosed, connect
+    await asyncio.sleep(delay)
+    try:
+        ws = await connect("127.0.0.1", port, f"/session?rate={RATE}&channels=1&format=s16")
+    except (ConnectionError, OSError) as e:
+        result['error'] = str(e)
+        return
+    started = time.perf_counter()
+
+    async def receive():
+        while True:
+            try:
+                opcode, payload = await ws.receive()
+            except ConnectionClosed:
+                return
+            if opcode != OP_TEXT:
+                continue
+            message = json.loads(payload)
+            if message['type'] == 'alert' and message.get('audio_end') is not None:
+                # From the moment the end of the utterance was spoken (captured on the phone)
+                result['alerts'].append(time.perf_counter() - (started + message['audio_end'] / (speed or 1e9)))
+            elif message['type'] == 'guidance':
+                result['guidance'] += 1
+            elif message['type'] == 'summary':
+                result['summary'] = message
+                return
+
+    receiver = asyncio.create_task(receive())
+    chunk = int(chunk_seconds * RATE) * 2
+    try:
+        for index, offset in enumerate(range(0, len(audio), chunk)):
+            # A chunk is sent once it has been recorded; sends block while the server pushes back
+            due = started + (index + 1) * chunk_seconds / speed if speed else time.perf_counter()
+            wait = due - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                result['max_lag'] = max(result['max_lag'], -wait)
+            await ws.send(OP_BINARY, audio[offset:offset + chunk])
+        await ws.send_json({'type': 'end'})
+        await receiver
+    except ConnectionClosed as e:
+        result['error'] = str(e)
+    await ws.close()
+
+def status(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/status") as response:
+        return json.loads(response.read())
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else float('nan')
+
+def run(sessions, audio, args):
+    with tempfile.TemporaryDirectory() as data_dir:
+        context = multiprocessing.get_context('spawn')
+        ports = context.Queue()
+        server = context.Process(target=run_server, args=(ports, data_dir, args.service_latency, args.alert_every,
+                                                          args.max_inflight, args.dsp_block))
+        server.start()
+        port = ports.get(timeout=60)
+        rng = np.random.default_rng(1)
+        results = [{'alerts': [], 'guidance': 0, 'max_lag': 0.0, 'summary': None, 'error': None}
+                   for _ in range(sessions)]
+
+        async def load():
+            await asyncio.gather(*(phone(port, audio[index % len(audio)], rng.uniform(0, args.stagger),
+                                         args.chunk_ms / 1000, args.speed, results[index])
+                                   for index in range(sessions)))
+
+        started, cpu_started = time.perf_counter(), time.process_time()
+        asyncio.run(load())
+        elapsed, client_cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        stats = status(port)
+        server.terminate()
+        server.join()
+
+    alerts = [latency for result in results for latency in result['alerts']]
+    finished = sum(result['summary'] is not None for result in results)
+    errors = [result['error'] for result in results if result['error']]
+    audio_seconds = sum(len(audio[index % len(audio)]) / 2 / RATE for index in range(sessions))
+    print(f"{sessions} phones, {audio_seconds / 60:.0f} min of audio in {elapsed:.0f}s "
+          f"(ASR and guidance stubbed, {args.service_latency * 1000:.0f} ms stand-ins each): "
+          f"peak {stats['peak_sessions']} concurrent sessions, {finished} finished, {len(errors)} failed"
+          + (f" ({errors[0]})" if errors else ""))
+    print(f"  alerts: {len(alerts)} received, latency from end of utterance p50 {percentile(alerts, 50) * 1000:.0f} ms, "
+          f"p95 {percentile(alerts, 95) * 1000:.0f} ms, p99 {percentile(alerts, 99) * 1000:.0f} ms, "
+          f"max {max(alerts, default=float('nan')) * 1000:.0f} ms")
+    print(f"  guidance: {sum(result['guidance'] for result in results)} messages to phones, "
+          f"{stats['coalesced']} coalesced in outboxes, {stats['dropped']} dropped; "
+          f"pipeline coalesced {stats['pipeline']['guidance']['coalesced']}")
+    print(f"  backpressure: {stats['pauses']} pauses ({stats['paused_seconds']:.1f}s), phones at most "
+          f"{max(result['max_lag'] for result in results) * 1000:.0f} ms behind real time")
+    print(f"  CPU: server {stats['cpu_seconds'] / elapsed:.0%}, load generator {client_cpu / elapsed:.0%} "
+          f"of one core ({os.cpu_count()} CPUs)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Many phones streaming visits to one guidance server')
+    parser.add_argument('--sessions', type=str, default='25,50,100',
+                        help='Concurrent phones; a comma-separated list runs each in turn')
+    parser.add_argument('--speed', type=float, default=1.0, help='Streaming speed (0 for as fast as possible)')
+    parser.add_argument('--stagger', type=float, default=10.0, help='Spread phone connections over this many seconds')
+    parser.add_argument('--chunk-ms', type=float, default=64.0, help='Audio per binary message (ms)')
+    parser.add_argument('--audio-dir', type=str, default=str(SYNTHETIC_AUDIO), help='Recordings to stream')
+    parser.add_argument('--service-latency', type=float, default=0.3,
+                        help='Offline stand-in delay for each of ASR and guidance (seconds)')
+    parser.add_argument('--alert-every', type=int, default=5, help='Every n-th transcript mentions a danger sign')
+    parser.add_argument('--max-inflight', type=int, default=8, help="Utterances per phone in processing before its "
+                                                                    "upload is paused")
+    parser.add_argument('--dsp-block', type=float, default=0.25, help='Seconds of audio per server denoise/VAD pass')
+    args = parser.parse_args()
+
+    audio = visits(args.audio_dir)
+    for sessions in (int(count) for count in args.sessions.split(',')):
+        run(sessions, audio, args)
+
+if __name__ == "__main__":
+    main()
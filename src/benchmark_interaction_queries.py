@@ -0,0 +1,62 @@
+import random
+import statistics
+import tempfile
+import time
+from benchmark_storage import synthetic_interactions
+from data_management.storage import DataStorage
+
+WEEK = 7 * 24 * 3600
+
+def median_ms(query, runs=100):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        query()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1e3
+
+def benchmark_queries(sizes=(10_000, 100_000, 300_000), page_size=50):
+    queries = {
+        "patient's sessions": lambda s, rng, now: s.query_interactions(
+            patient_id=f"patient_{rng.randrange(500):05d}", limit=page_size),
+        "danger signs this week": lambda s, rng, now: s.query_interactions(
+            has_danger_signs=True, since=now - WEEK, limit=page_size),
+        "prenatal missing fundal height": lambda s, rng, now: s.query_interactions(
+            condition_type="prenatal", missing_measurement="fundal height", limit=page_size),
+        "one day, 3rd page": lambda s, rng, now: one_day_third_page(s, now - rng.randrange(30) * 86400),
+    }
+
+    def one_day_third_page(storage, until):
+        filters = {'since': until - 86400, 'until': until}
+        page = storage.query_interactions(limit=page_size, **filters)
+        for _ in range(2):
+            if page['next_cursor'] is None:
+                break
+            page = storage.query_interactions(limit=page_size, cursor=page['next_cursor'], **filters)
+
+    print(f"Median query latency (ms) for a {page_size}-row page as the store grows")
+    print(f"{'':<32}" + "".join(f"{size:>12,}" for size in sizes))
+    results = {label: [] for label in queries}
+    with tempfile.TemporaryDirectory() as base_dir:
+        storage = DataStorage(base_dir)
+        stored = 0
+        now = time.time()
+        for size in sizes:
+            # Newest interactions end at "now"; earlier batches are older
+            records = list(synthetic_interactions(size - stored, now - size * 30, seed=size))
+            for i in range(0, len(records), 1000):
+                storage.store_interactions(records[i:i + 1000])
+            stored = size
+            rng = random.Random(0)
+            for label, query in queries.items():
+                results[label].append(median_ms(lambda: query(storage, rng, now)))
+        started = time.perf_counter()
+        streamed = sum(1 for _ in storage.stream_interactions(condition_type="prenatal"))
+        stream_seconds = time.perf_counter() - started
+        storage.close()
+    for label, values in results.items():
+        print(f"{label:<32}" + "".join(f"{v:>12.3f}" for v in values))
+    print(f"stream_interactions(condition_type='prenatal'): {streamed} rows in {stream_seconds:.2f}s")
+
+if __name__ == "__main__":
+    benchmark_queries()
@@ -0,0 +1,130 @@
+import argparse
+import re
+import timeit
+from pathlib import Path
+from dotenv import load_dotenv
+from protocols.protocol_manager import ProtocolManager
+
+# Hand-labelled (required, recorded, taken?) pairs, from the synonym examples the LLM prompt used
+LABELLED_PAIRS = [
+    ("Blood pressure", "BP", True),
+    ("Blood pressure", "presyon", True),
+    ("Blood pressure", "blood pressure reading", True),
+    ("Blood pressure", "BP 120/80", True),
+    ("Weight", "timbang", True),
+    ("Weight", "65 kilos", True),
+    ("Weight gain", "timbang", True),
+    ("Fundal height", "fundal measurement", True),
+    ("Fundal height", "uterine height", True),
+    ("Fetal heart rate", "FHR", True),
+    ("Fetal heart rate", "baby's heartbeat", True),
+    ("Edema check", "pamamaga", True),
+    ("Edema check", "swelling check", True),
+    ("Urinalysis (protein and sugar)", "urine test", True),
+    ("Urinalysis", "ihi test", True),
+    ("Hemoglobin level", "hemoglobin", True),
+    ("Temperature", "temperatura", True),
+    ("Pulse rate", "pulso", True),
+    ("Blood pressure", "timbang", False),
+    ("Fundal height", "BP", False),
+    ("Fetal heart rate", "temperature", False),
+    ("Hemoglobin level", "weight", False),
+    ("Urinalysis", "blood pressure", False),
+    ("Blood type and Rh factor", "fundal height", False),
+]
+
+# Held out: phrasings the synonym tables do not list (misspellings, units, other abbreviations
+# and word forms), so these measure what the trigram scoring generalizes to
+HELD_OUT_PAIRS = [
+    ("Blood pressure", "blood presure 130/90", True),
+    ("Blood pressure", "B.P. 110/70", True),
+    ("Temperature", "temp 37.8C", True),
+    ("Pulse rate", "pulse 88 bpm", True),
+    ("Respiratory rate", "resp rate 18", True),
+    ("Weight", "weighed 62 kg", True),
+    ("Weight", "timbangin", True),
+    ("Fundal height", "fundic height 28 cm", True),
+    ("Fetal heart rate", "fetal heart tones", True),
+    ("Fetal heart rate", "FHT 140", True),
+    ("Hemoglobin level", "haemoglobin 11.2", True),
+    ("Edema check", "ankles checked for oedema", True),
+    ("Urinalysis", "urine dipstick", True),
+    ("Blood type and Rh factor", "blood group O+", True),
+    ("MUAC", "arm circ 23 cm", True),
+    ("Fetal heart rate", "maternal pulse 88", False),
+    ("Fundal height", "height 150 cm", False),
+    ("Weight gain", "height 150 cm", False),
+    ("Temperature", "blood pressure 120/80", False),
+    ("Hemoglobin level", "blood group O+", False),
+    ("Urinalysis", "ultrasound", False),
+]
+
+def score_pairs(matcher, label, pairs):
+    """Agreement with the labels; uncertain pairs would go to the LLM and count separately."""
+    agree = uncertain = 0
+    for required, recorded, expected in pairs:
+        result = matcher.match([required], [recorded])
+        if required in result['uncertain']:
+            uncertain += 1
+            continue
+        taken = required in result['taken']
+        agree += taken == expected
+        if taken != expected:
+            score = result['scores'][required]['score']
+            print(f"  disagree: {required!r} vs {recorded!r} (score {score:.2f}, expected {expected})")
+    print(f"{label}: {agree}/{len(pairs)} agree, {uncertain} left to the LLM, "
+          f"{len(pairs) - agree - uncertain} wrong")
+
+def benchmark_offline(manager):
+    matcher = manager.measurement_matcher
+    score_pairs(matcher, "Labelled pairs (synonym table)", LABELLED_PAIRS)
+    score_pairs(matcher, "Held-out pairs", HELD_OUT_PAIRS)
+
+    required = manager.get_required_measurements('prenatal', 'third')
+    recorded = ["BP 110/70", "timbang", "fundal", "FHR 140", "ihi test"]
+    number = 20000
+    seconds = min(timeit.repeat(lambda: matcher.match(required, recorded), number=number, repeat=5))
+    print(f"match() of {len(required)} required vs {len(recorded)} recorded: {seconds / number * 1e6:.1f} us/call")
+
+def benchmark_against_llm(manager, text_dir):
+    """Compare the matcher with the LLM measurement analysis on the synthetic corpus."""
+    from real_time_guidance.guidance_engine import GuidanceEngine
+    engine = GuidanceEngine(mode='testing')
+
+    agree = total = llm_calls_avoided = 0
+    for transcript_path in sorted(Path(text_dir).glob("*.txt")):
+        transcript = transcript_path.read_text(encoding='utf-8')
+        condition = re.search(r'Condition Type:\s*(\S+)', transcript)
+        extracted = engine._extract_information(transcript)
+        required = manager.get_required_measurements(condition.group(1) if condition else None, extracted.get('trimester'))
+        recorded = extracted.get('measurements') or []
+
+        local = manager.measurement_matcher.match(required, recorded)
+        llm = manager._analyze_measurements(required, extracted)
+        llm_taken = set(llm.get('taken', []))
+        llm_calls_avoided += not local['uncertain']
+
+        for item in required:
+            total += 1
+            if (item in local['taken']) == (item in llm_taken):
+                agree += 1
+            else:
+                score = local['scores'][item]['score']
+                print(f"  {transcript_path.name}: {item!r} local={'taken' if item in local['taken'] else 'not taken'} "
+                      f"(score {score:.2f}) llm={'taken' if item in llm_taken else 'not taken'}")
+
+    if total:
+        print(f"Agreement with LLM: {agree}/{total} ({agree / total:.0%}) required items")
+        print(f"Transcripts needing no LLM call: {llm_calls_avoided}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the local measurement matcher')
+    parser.add_argument('--llm', action='store_true', help='Also compare against the LLM on the synthetic corpus')
+    parser.add_argument('--text-dir', default='data/synthetic/text', help='Synthetic transcript directory')
+    args = parser.parse_args()
+
+    load_dotenv()
+    protocol_manager = ProtocolManager()
+    benchmark_offline(protocol_manager)
+    if args.llm:
+        benchmark_against_llm(protocol_manager, args.text_dir)
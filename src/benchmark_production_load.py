@@ -0,0 +1,127 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+import wave
+from pathlib import Path
+import numpy as np
+from benchmark_vad import RATE, conversation
+from main import BHWAssistant
+from real_time_guidance.guidance_engine import GuidanceEngine
+from voice_processing.audio_capture import SourceMultiplexer
+from voice_processing.voice_input import VoiceInputProcessor
+
+SYNTHETIC_AUDIO = Path("data/synthetic/audio")
+
+def stand_in_visits(directory, count=3):
+    """WAV visits laid out like generate_audio.py's, for when no synthetic audio has been generated."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for number in range(count):
+        samples, _ = conversation(rng, lines=20, idle=0.2)
+        path = Path(directory) / f"stand_in_visit_{number + 1}.wav"
+        with wave.open(str(path), 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(RATE)
+            f.writeframes((samples * 32767).astype('<i2').tobytes())
+        paths.append(path)
+    return paths
+
+def use_offline_services(assistant, engines, latency):
+    """
+    Replace the Whisper ASR (AudioAnalyzer.process_audio_stream) and the
+    guidance calls with fixed-delay stand-ins, so only the local pipeline is
+    measured. Results without --online say nothing about the real services.
+    """
+    def transcribe(audio, rate):
+        time.sleep(latency)
+        return f"utterance of {len(audio) / 4 / rate:.1f}s"
+
+    def guide(transcript, *args, **kwargs):
+        time.sleep(latency)
+        return {}
+
+    assistant.analyzer.process_audio_stream = transcribe
+    for engine in engines:
+        engine.generate_guidance = guide
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else float('nan')
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay many concurrent visits through the production pipeline')
+    parser.add_argument('--sessions', type=int, default=100, help='Concurrent simulated visits')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed (0 for as fast as possible)')
+    parser.add_argument('--stagger', type=float, default=10.0, help='Spread session starts over this many seconds')
+    parser.add_argument('--jitter', type=float, default=0.002, help='Capture callback jitter (seconds)')
+    parser.add_argument('--audio-dir', type=str, default=str(SYNTHETIC_AUDIO), help='Recordings to replay')
+    parser.add_argument('--online', action='store_true',
+                        help='Call the real ASR and guidance services (needs API keys)')
+    parser.add_argument('--service-latency', type=float, default=0.3,
+                        help='Offline stand-in delay for each of ASR and guidance (seconds)')
+    parser.add_argument('--asr-workers', type=int, default=16, help='ASR stage worker threads')
+    parser.add_argument('--guidance-workers', type=int, default=16, help='Guidance stage worker threads')
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help='Print live per-stage pipeline metrics this often (seconds, 0 for off)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        recordings = sorted(Path(args.audio_dir).glob("*.mp3")) + sorted(Path(args.audio_dir).glob("*.wav"))
+        if not recordings:
+            print(f"No recordings in {args.audio_dir}; replaying stand-in visits")
+            recordings = stand_in_visits(data_dir)
+        if not args.online:
+            # The clients are created but never called offline
+            os.environ.setdefault("OPENAI_API_KEY", "offline")
+        os.environ["ASR_WORKERS"] = str(args.asr_workers)
+        os.environ["GUIDANCE_WORKERS"] = str(args.guidance_workers)
+        assistant = BHWAssistant(mode='production', data_dir=data_dir)
+        protocol_manager = assistant.guidance_engine.protocol_manager
+        engines = [GuidanceEngine(protocol_manager=protocol_manager) for _ in range(args.sessions)]
+        if not args.online:
+            use_offline_services(assistant, engines, args.service_latency)
+
+        multiplexer = SourceMultiplexer(speed=args.speed, jitter=args.jitter, seed=0)
+        rng = np.random.default_rng(1)
+        processors = [VoiceInputProcessor(multiplexer.add(recordings[i % len(recordings)],
+                                                          delay=rng.uniform(0, args.stagger)))
+                      for i in range(args.sessions)]
+        results = [None] * args.sessions
+
+        def run(index):
+            results[index] = assistant.run_session(processors[index], f"load_{index:04d}", engines[index])
+
+        audio_seconds = sum(len(session.samples) / session.channels / session.rate for session in multiplexer.sessions)
+        print(f"{args.sessions} sessions, {audio_seconds / 60:.0f} min of audio from {len(recordings)} recordings "
+              f"at {'max' if not args.speed else f'{args.speed:g}x'} speed, "
+              f"{'online' if args.online else f'ASR and guidance stubbed ({args.service_latency * 1000:.0f} ms stand-ins each, --online for the real services)'}")
+        if args.metrics_interval > 0:
+            assistant.pipeline.monitor(args.metrics_interval)
+        started, cpu_started = time.perf_counter(), time.process_time()
+        threads = [threading.Thread(target=run, args=(index,), name=f"session-{index}") for index in range(args.sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        multiplexer.close()
+
+        latencies = [latency for result in results for latency in result['latencies']]
+        overruns = sum(result['capture']['overruns'] for result in results)
+        dropped = sum(result['capture']['dropped_seconds'] for result in results)
+        backlog = max(result['capture']['max_fill_seconds'] for result in results)
+        speech = sum(result['vad'].stats['speech_seconds'] for result in results)
+        print(f"Finished in {elapsed:.1f}s ({audio_seconds / elapsed:.1f}x real time overall), "
+              f"CPU {cpu / elapsed:.0%} of one core")
+        print(f"  {len(latencies)} utterances ({speech / audio_seconds:.0%} of audio forwarded); "
+              f"latency from end of capture p50 {percentile(latencies, 50) * 1000:.0f} ms, "
+              f"p95 {percentile(latencies, 95) * 1000:.0f} ms, p99 {percentile(latencies, 99) * 1000:.0f} ms, "
+              f"max {max(latencies, default=float('nan')) * 1000:.0f} ms")
+        print(f"  capture: {overruns} overruns ({dropped:.2f}s dropped), peak backlog {backlog:.2f}s, "
+              f"{sum(session.deferred for session in multiplexer.sessions)} deferred writes")
+        assistant.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from protocols.bundle import build_bundle
+from protocols.protocol_manager import load_protocol_definitions
+
+# Runs in a fresh interpreter so every measurement is a true cold start
+CHILD = """
+import json, resource, sys, time
+started = time.perf_counter()
+from protocols.protocol_manager import ProtocolManager
+manager = ProtocolManager(bundle_path=sys.argv[2])
+if sys.argv[1] == 'eager-client':
+    manager.claude  # the client used to be created in __init__
+manager.get_required_measurements('prenatal', 'second')
+elapsed = time.perf_counter() - started
+print(json.dumps({'seconds': elapsed, 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+MODES = [
+    ("JSON + eager client (before)", "eager-client", False),
+    ("JSON, lazy client", "lazy", False),
+    ("bundle, lazy client (after)", "lazy", True),
+]
+
+def cold_start(mode, bundle_path, runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, mode, str(bundle_path)],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+def benchmark_startup(runs=10):
+    src_dir = Path(__file__).parent
+    # A bundle of our own, so the installed protocols.bundle is left as it is
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bundle = build_bundle(load_protocol_definitions(src_dir / "protocols" / "definitions"),
+                              Path(tmp_dir) / "protocols.bundle")
+        missing_bundle = Path(tmp_dir) / "protocols.missing"
+
+        print(f"ProtocolManager cold start (import + construct + first lookup), median of {runs} runs")
+        print("-" * 70)
+        for label, mode, use_bundle in MODES:
+            results = cold_start(mode, bundle if use_bundle else missing_bundle, runs)
+            seconds = statistics.median(r['seconds'] for r in results)
+            rss = statistics.median(r['max_rss_kb'] for r in results)
+            print(f"{label:<32} {seconds * 1000:>8.1f} ms {rss / 1024:>8.1f} MB peak RSS")
+
+if __name__ == "__main__":
+    benchmark_startup()
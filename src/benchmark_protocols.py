@@ -0,0 +1,28 @@
+import timeit
+from protocols.protocol_manager import ProtocolManager
+from protocols.compiled import CompiledProtocols
+
+def report(label, statement, number=200000):
+    """Print the mean cost of one call in nanoseconds."""
+    seconds = min(timeit.repeat(statement, number=number, repeat=5))
+    print(f"{label:<45} {seconds / number * 1e9:>10.0f} ns/op")
+
+def benchmark_protocol_lookups():
+    manager = ProtocolManager()
+
+    print("Protocol lookup microbenchmarks")
+    print("-" * 60)
+
+    report("compile all protocols", lambda: CompiledProtocols(manager.protocols), number=200)
+    report("resolve 'non-communicable'", lambda: manager.resolve_protocol_name('non-communicable'))
+    report("required measurements (prenatal, 2nd)", lambda: manager.get_required_measurements('prenatal', 'Second trimester'))
+    report("required measurements (noncommunicable)", lambda: manager.get_required_measurements('noncommunicable'))
+    report("education topics (prenatal, 3rd)", lambda: manager.get_education_topics('prenatal', 'third'))
+    report("danger signs (communicable)", lambda: manager.get_danger_signs('communicable'))
+    report("symptom guidance (prenatal, 'Back pain')", lambda: manager.get_symptom_guidance('prenatal', 'Back pain'))
+    report("danger-sign terms (all protocols)", lambda: manager.get_danger_sign_terms())
+    report("Tagalog term -> sign ('pagdurugo')", lambda: manager.get_danger_sign_terms('communicable').get('pagdurugo'))
+    report("vital thresholds (temperature, communicable)", lambda: manager.get_vital_thresholds('temperature', 'communicable'))
+
+if __name__ == "__main__":
+    benchmark_protocol_lookups()
@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from data_management.retention import RetentionEngine
+from data_management.storage import DataStorage
+
+RATE = 16000
+DAY = 24 * 3600
+
+def du(directory):
+    """Disk usage, counting hard-linked files once."""
+    blocks = {}
+    for path in Path(directory).rglob('*'):
+        if path.is_file():
+            stat = path.stat()
+            blocks[(stat.st_dev, stat.st_ino)] = stat.st_blocks * 512
+    return sum(blocks.values())
+
+def populate(storage, sessions, seconds, duplicates, artifacts):
+    """Recorded sessions of mixed age and outcome, copied synthetic audio and small JSON artifacts."""
+    rng = np.random.default_rng(0)
+    now = time.time()
+    records = []
+    for i in range(sessions):
+        age_days = (5, 40, 400)[i % 3]
+        with storage.open_recording(f"bench{i:04d}", rate=RATE) as recorder:
+            recorder.write((0.1 * rng.standard_normal(seconds * RATE)).astype(np.float32).tobytes())
+        danger = ["Vaginal bleeding"] if i % 5 == 0 else []
+        records.append({'created_at': now - age_days * DAY, 'session_id': f"bench{i:04d}",
+                        'audio_file': str(recorder.path), 'transcript': "BHW: Kumusta po kayo?",
+                        'guidance': {'danger_signs': danger, 'missing_information': []},
+                        'context': {'condition_type': 'prenatal', 'danger_signs': danger}})
+    storage.store_interactions(records)
+
+    synthetic_dir = storage.base_dir / "synthetic" / "audio"
+    synthetic_dir.mkdir(parents=True, exist_ok=True)
+    clip = rng.bytes(512 * 1024)
+    for i in range(duplicates):
+        (synthetic_dir / f"dialogue_{i}.mp3").write_bytes(clip if i % 2 else rng.bytes(512 * 1024))
+
+    analysis_dir = storage.processed_dir / "analysis"
+    analysis_dir.mkdir(parents=True, exist_ok=True)
+    settled = now - 2 * DAY
+    for i in range(artifacts):
+        path = analysis_dir / f"interaction_{i:06d}.json"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"timestamp": i, "transcript": None, "guidance": {"danger_signs": []}}, f, indent=2)
+        os.utime(path, (settled, settled))
+
+def benchmark_retention(sessions=120, seconds=20, duplicates=40, artifacts=5000, budget=0.5):
+    with tempfile.TemporaryDirectory() as base_dir:
+        storage = DataStorage(base_dir)
+        populate(storage, sessions, seconds, duplicates, artifacts)
+        before = du(base_dir)
+        print(f"{sessions} sessions of {seconds}s, {duplicates} synthetic clips, {artifacts} JSON artifacts: "
+              f"{before / 1e6:.1f} MB on disk")
+
+        dry_run = RetentionEngine(storage, dry_run=True)
+        dry_run.run(time_budget=600)
+        print(f"  {dry_run.report()}")
+
+        runs = 0
+        while True:
+            runs += 1
+            engine = RetentionEngine(storage)
+            result = engine.run(time_budget=budget)
+            print(f"  run {runs}: {engine.report()}")
+            if all(result['complete'].values()) or runs >= 50:
+                break
+        after = du(base_dir)
+        print(f"  on disk: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB "
+              f"({(before - after) / 1e6:.1f} MB reclaimed, {runs} runs of {budget:.1f}s)")
+        storage.close()
+
+if __name__ == "__main__":
+    benchmark_retention()
@@ -0,0 +1,103 @@
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from pydub.utils import which
+from data_management.audio_compression import AudioCompressor, load_pcm16
+from data_management.storage import DataStorage
+
+RATE = 16000
+CHUNK_FRAMES = 1024
+TURN_SECONDS = 4.0
+
+def record_session(storage, session_id, minutes):
+    """A session recording with one stored turn every TURN_SECONDS."""
+    rng = np.random.default_rng(0)
+    chunk = (0.1 * rng.standard_normal(CHUNK_FRAMES)).astype(np.float32).tobytes()
+    records, turn_start = [], 0.0
+    with storage.open_recording(session_id, rate=RATE) as recorder:
+        for _ in range(int(minutes * 60 * RATE / CHUNK_FRAMES)):
+            recorder.write(chunk)
+            if recorder.duration - turn_start >= TURN_SECONDS:
+                records.append({'session_id': session_id, 'audio_file': str(recorder.path), 'transcript': "...",
+                                'guidance': {}, 'context': {}, 'audio_start': turn_start,
+                                'audio_end': recorder.duration})
+                turn_start = recorder.duration
+    return storage.store_interactions(records)
+
+def whole_file(storage, session_id, turn_ids):
+    """Today's path: decode the recording, then cut each turn out of it."""
+    audio = storage.open_session_audio(session_id)
+    decoded = load_pcm16(audio.path, storage.open_audio)
+    total = 0
+    for turn_id in turn_ids:
+        start, end = audio.turn_range(turn_id)
+        total += len(decoded[int(start * 1000):int(end * 1000)].raw_data)
+    audio.close()
+    return total
+
+def sliced(storage, session_id, turn_ids):
+    """Stream each turn as a WAV upload would read it, and look at its samples."""
+    total = 0
+    with storage.open_session_audio(session_id) as audio:
+        buffer = bytearray(64 * 1024)
+        for turn_id in turn_ids:
+            upload = audio.turn_wav_file(turn_id)
+            while upload.readinto(buffer):
+                pass
+            start, end = audio.turn_range(turn_id)
+            samples = audio.samples(start, end)
+            total += samples.nbytes
+            del samples
+    return total
+
+def measure(label, run, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    run(*args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<28} {elapsed:7.3f}s  peak Python memory {peak / 1e6:8.2f} MB")
+
+def check_compressed_slices(minutes=1, turns=5):
+    """An encrypted session compressed to FLAC must slice to the same 16-bit samples as its original WAV."""
+    if not which("ffmpeg"):
+        print("ffmpeg not found; skipping the compressed-recording slice check")
+        return
+    with tempfile.TemporaryDirectory() as base_dir:
+        storage = DataStorage(base_dir, encrypt=True)
+        turn_ids = record_session(storage, "bench", minutes)[:turns]
+        with storage.open_session_audio("bench") as audio:
+            original_path = audio.path
+            # The 16-bit samples FLAC must preserve, cut at the same frames slice() uses
+            pcm16 = load_pcm16(audio.path, storage.open_audio).raw_data
+            expected = {turn_id: pcm16[int(round(audio.turn_range(turn_id)[0] * RATE)) * 2:
+                                       int(round(audio.turn_range(turn_id)[1] * RATE)) * 2]
+                        for turn_id in turn_ids}
+        if AudioCompressor(storage, codec='flac').compress_file(original_path) is None:
+            raise AssertionError("FLAC compression failed")
+        with storage.open_session_audio("bench") as audio:
+            assert audio.path.suffix == '.flac' and audio.sample_width == 2, f"unexpected recording {audio.path}"
+            for turn_id in turn_ids:
+                start, end = audio.turn_range(turn_id)
+                assert bytes(audio.slice(start, end)) == expected[turn_id], f"turn {turn_id} differs after FLAC"
+        storage.close()
+    print(f"Encrypted FLAC recording slices match the original WAV ({len(turn_ids)} turns)")
+
+def benchmark_session_audio(minutes=(10, 60), turns=20):
+    for encrypt in (False, True):
+        for length in minutes:
+            with tempfile.TemporaryDirectory() as base_dir:
+                storage = DataStorage(base_dir, encrypt=encrypt)
+                turn_ids = record_session(storage, "bench", length)
+                picked = [turn_ids[i] for i in np.random.default_rng(1).choice(len(turn_ids), turns, replace=False)]
+                print(f"{length}-minute session, {'encrypted' if encrypt else 'plain'}: "
+                      f"{turns} of {len(turn_ids)} turns")
+                measure("decode whole file", whole_file, storage, "bench", picked)
+                measure("SessionAudio slices", sliced, storage, "bench", picked)
+                storage.close()
+
+if __name__ == "__main__":
+    check_compressed_slices()
+    benchmark_session_audio()
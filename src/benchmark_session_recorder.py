@@ -0,0 +1,61 @@
+import json
+import struct
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from data_management.session_recorder import SessionRecorder
+
+RATE = 16000
+CHUNK_FRAMES = 1024
+CHUNK = struct.pack(f"<{CHUNK_FRAMES}f", *([0.25] * CHUNK_FRAMES))  # one paFloat32 chunk (~64 ms)
+
+def per_chunk_files(directory, chunks):
+    """The old production loop: a raw audio file and a JSON file for every chunk."""
+    for i in range(chunks):
+        with open(directory / f"interaction_{i:07d}.wav", 'wb') as f:
+            f.write(CHUNK)
+        with open(directory / f"interaction_{i:07d}.json", 'w', encoding='utf-8') as f:
+            json.dump({"timestamp": i, "audio_file": f"interaction_{i:07d}.wav", "transcript": None}, f, indent=2)
+
+def session_recording(directory, chunks):
+    with SessionRecorder(directory / "session.wav", rate=RATE) as recorder:
+        for _ in range(chunks):
+            recorder.write(CHUNK)
+    return recorder
+
+def read_wav_header(path):
+    """Format tag, channels, rate, bits and data size from the RIFF header."""
+    data = path.read_bytes()[:58]
+    riff, riff_size, wave = struct.unpack_from("<4sI4s", data)
+    tag, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", data, 20)
+    data_size = struct.unpack_from("<I", data, 54)[0]
+    assert riff == b"RIFF" and wave == b"WAVE" and riff_size == path.stat().st_size - 8
+    return tag, channels, rate, bits, data_size
+
+def measure(label, run, directory, chunks):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = run(directory, chunks)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    files = sum(1 for _ in directory.iterdir())
+    print(f"  {label:<26} {elapsed:7.3f}s  {files:>6} files  peak Python memory {peak / 1024:7.1f} KiB")
+    return result
+
+def benchmark_recorder(minutes=(1, 10, 60)):
+    for length in minutes:
+        chunks = int(length * 60 * RATE / CHUNK_FRAMES)
+        print(f"{length}-minute session ({chunks} chunks of {CHUNK_FRAMES} frames)")
+        with tempfile.TemporaryDirectory() as old_dir, tempfile.TemporaryDirectory() as new_dir:
+            if length <= 10:
+                measure("file + JSON per chunk", per_chunk_files, Path(old_dir), chunks)
+            recorder = measure("SessionRecorder", session_recording, Path(new_dir), chunks)
+            tag, channels, rate, bits, data_size = read_wav_header(recorder.path)
+            assert data_size == chunks * len(CHUNK)
+            print(f"  -> {recorder.path.name}: format {tag}, {channels} ch, {rate} Hz, {bits}-bit, "
+                  f"{recorder.duration:.1f}s, {recorder.fsync_count} fsyncs")
+
+if __name__ == "__main__":
+    benchmark_recorder()
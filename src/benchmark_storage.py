@@ -0,0 +1,71 @@
+import random
+import statistics
+import tempfile
+import time
+from data_management.storage import DataStorage
+
+CONDITIONS = ["prenatal", "communicable", "non-communicable", None]
+DANGER_SIGNS = ["Severe headache", "Vaginal bleeding", "Blurred vision", "High fever", "Convulsions"]
+MEASUREMENTS = ["Blood pressure", "Fundal height", "Fetal heart rate", "Weight", "Temperature"]
+
+def synthetic_interactions(count, start, seed=0):
+    """Interaction records without audio, one every ~30 seconds starting at start."""
+    rng = random.Random(seed)
+    for i in range(count):
+        signs = rng.sample(DANGER_SIGNS, 1) if rng.random() < 0.05 else []
+        yield {
+            'created_at': start + i * 30 + rng.random(),
+            'session_id': f"session_{i // 8:06d}",
+            'patient_id': f"patient_{rng.randrange(count // 20):05d}",
+            'transcript': "[00:00] BHW: Kumusta po kayo?\n[00:05] Mother: Okay lang po. " * 4,
+            'guidance': {'recommendations': ["Check blood pressure"], 'danger_signs': signs,
+                         'missing_information': rng.sample(MEASUREMENTS, rng.randint(0, 2))},
+            'context': {'condition_type': rng.choice(CONDITIONS), 'measurements': ["BP 120/80", "timbang"],
+                        'covered_topics': ["nutrition"], 'trimester': None, 'danger_signs': signs},
+        }
+
+def latency(label, query, runs=200):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        query()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    print(f"  {label:<40} p50 {statistics.median(samples) * 1e3:7.3f} ms   p95 {samples[int(runs * 0.95)] * 1e3:7.3f} ms")
+
+def benchmark_storage(count=100_000, batch_size=500):
+    start = time.time() - count * 30
+    with tempfile.TemporaryDirectory() as base_dir:
+        storage = DataStorage(base_dir)
+        records = list(synthetic_interactions(count, start))
+
+        started = time.perf_counter()
+        ids = []
+        for i in range(0, count, batch_size):
+            ids.extend(storage.store_interactions(records[i:i + batch_size]))
+        elapsed = time.perf_counter() - started
+        print(f"Inserted {count} interactions in batches of {batch_size}: {count / elapsed:,.0f} inserts/s")
+
+        single = records[:2000]
+        started = time.perf_counter()
+        for record in single:
+            storage.store_interactions([record])
+        elapsed = time.perf_counter() - started
+        print(f"Inserted {len(single)} interactions one per transaction: {len(single) / elapsed:,.0f} inserts/s")
+
+        rng = random.Random(1)
+        print(f"Query latency at {count + len(single)} interactions:")
+        latency("get_interaction(id)", lambda: storage.get_interaction(rng.choice(ids)))
+        latency("find_interactions(condition_type)", lambda: storage.find_interactions(condition_type="prenatal"))
+        latency("find_interactions(patient_id)",
+                lambda: storage.find_interactions(patient_id=f"patient_{rng.randrange(count // 20):05d}"))
+        latency("find_interactions(danger_sign)", lambda: storage.find_interactions(danger_sign="Convulsions"))
+        latency("find_interactions(one day)", lambda: storage.find_interactions(
+            since=start + rng.randrange(count) * 30, until=start + rng.randrange(count) * 30 + 86400, limit=1000))
+        started = time.perf_counter()
+        scanned = sum(1 for _ in storage.iter_interactions())
+        print(f"  iter_interactions() full scan of {scanned} rows: {time.perf_counter() - started:.2f}s")
+        storage.close()
+
+if __name__ == "__main__":
+    benchmark_storage()
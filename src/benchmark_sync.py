@@ -0,0 +1,111 @@
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from data_management.storage import DataStorage
+from data_management.sync import SyncEngine
+from sync_receiver import SyncReceiver
+
+RATE = 16000
+
+def populate(storage, sessions, seconds, turns):
+    """Recorded sessions, each with a few stored turns."""
+    rng = np.random.default_rng(0)
+    t = np.arange(seconds * RATE) / RATE
+    for i in range(sessions):
+        session_id = f"bench{i:03d}"
+        # Quiet speech-band tone plus noise: compresses roughly like real recordings
+        audio = (0.2 * np.sin(2 * np.pi * 180 * t) * (np.sin(2 * np.pi * 0.5 * t) > 0)
+                 + 0.002 * rng.standard_normal(len(t))).astype(np.float32)
+        with storage.open_recording(session_id, rate=RATE) as recorder:
+            recorder.write(audio.tobytes())
+        storage.store_interactions([{
+            'session_id': session_id, 'audio_file': str(recorder.path), 'transcript': f"Turn {turn}",
+            'guidance': {'danger_signs': []}, 'context': {'condition_type': 'prenatal'},
+            'audio_start': turn * seconds / turns, 'audio_end': (turn + 1) * seconds / turns,
+        } for turn in range(turns)])
+
+def verify(storage, received_dir):
+    """Every session arrived once, with all its turns and its audio byte for byte."""
+    sessions = {}
+    for bundle in sorted((received_dir / "complete").glob("*.tar.gz")):
+        with tarfile.open(bundle, 'r:gz') as tar:
+            for member in tar.getmembers():
+                name = member.name.split("/")[1]
+                data = tar.extractfile(member).read()
+                entry = sessions.setdefault(name, {'turns': 0, 'audio': None})
+                if member.name.endswith("interactions.jsonl"):
+                    entry['turns'] += len(data.splitlines())
+                else:
+                    entry['audio'] = data
+    for name, entry in sessions.items():
+        audio = storage.open_session_audio(name)
+        with storage.open_audio(audio.path) as f:
+            assert entry['audio'] == f.read(), f"{name}: audio differs"
+        assert entry['turns'] == len(audio.turns), f"{name}: {entry['turns']} turns, expected {len(audio.turns)}"
+        audio.close()
+    return len(sessions)
+
+def run(label, sessions, seconds, turns, bandwidth=None, drop_every=0):
+    with tempfile.TemporaryDirectory() as base_dir, tempfile.TemporaryDirectory() as received_dir:
+        storage = DataStorage(base_dir)
+        populate(storage, sessions, seconds, turns)
+        receiver = SyncReceiver(Path(received_dir), drop_every=drop_every)
+        receiver.start()
+
+        engine = SyncEngine(storage, receiver.url, batch_bytes=4 * 1024 * 1024, chunk_size=128 * 1024,
+                            max_bytes_per_second=bandwidth)
+        attempts, started = 1, time.perf_counter()
+        while not engine.sync():
+            attempts += 1  # connectivity came back: resume
+        elapsed = time.perf_counter() - started
+
+        arrived = verify(storage, Path(received_dir))
+        raw = sum(totals['bytes'] for totals in engine.sessions.values())
+        stats = engine.stats
+        print(f"{label}: {arrived}/{sessions} sessions verified, {attempts} attempts, {elapsed:.2f}s")
+        print(f"  {raw / 1e6:.1f} MB packed -> {stats['bytes_sent'] / 1e6:.1f} MB sent in {stats['batches']} batches "
+              f"({raw / max(stats['batch_bytes'], 1):.2f}x), {(stats['bytes_sent'] - stats['batch_bytes']) / 1e3:.0f} kB "
+              f"re-sent after {receiver.dropped} dropped connections, {stats['bytes_sent'] / elapsed / 1e3:.0f} kB/s"
+              + (f" (cap {bandwidth / 1e3:.0f} kB/s)" if bandwidth else ""))
+        per_session = [totals['uploaded_bytes'] for totals in engine.sessions.values()]
+        print(f"  per session: {np.mean(per_session) / 1e3:.0f} kB uploaded on average")
+
+        again = SyncEngine(storage, receiver.url)
+        again.sync()
+        print(f"  second sync: {again.stats['bytes_sent']} bytes sent")
+        receiver.shutdown()
+        receiver.server_close()
+        storage.close()
+
+def check_missing_audio(sessions=3, seconds=5, turns=2):
+    """A session whose recording has gone missing is held back, unsynced, instead of uploaded without it."""
+    with tempfile.TemporaryDirectory() as base_dir, tempfile.TemporaryDirectory() as received_dir:
+        storage = DataStorage(base_dir)
+        populate(storage, sessions, seconds, turns)
+        lost = storage.open_session_audio("bench001")
+        lost.close()
+        lost.path.unlink()
+        receiver = SyncReceiver(Path(received_dir))
+        receiver.start()
+        engine = SyncEngine(storage, receiver.url)
+        assert engine.sync()
+        assert engine.missing_audio == {str(lost.path)}
+        assert verify(storage, Path(received_dir)) == sessions - 1
+        held = list(storage.stream_interactions(synced=False))
+        assert {interaction['session_id'] for interaction in held} == {"bench001"} and len(held) == turns
+        print(f"Missing audio: {len(held)} interactions of bench001 held back unsynced, "
+              f"{sessions - 1} other sessions uploaded")
+        receiver.shutdown()
+        receiver.server_close()
+        storage.close()
+
+def benchmark_sync():
+    check_missing_audio()
+    run("Unlimited, reliable", sessions=20, seconds=30, turns=5)
+    run("Connection dropped every 8 chunks", sessions=20, seconds=30, turns=5, drop_every=8)
+    run("Capped at 500 kB/s", sessions=5, seconds=30, turns=5, bandwidth=500_000)
+
+if __name__ == "__main__":
+    benchmark_sync()
@@ -0,0 +1,147 @@
+import time
+from pathlib import Path
+import numpy as np
+from pydub import AudioSegment
+from voice_processing.vad import VoiceActivityDetector
+
+RATE = 16000
+CHUNK_FRAMES = 1024
+SYNTHETIC_AUDIO = Path("data/synthetic/audio")
+
+def syllable(rng, seconds, voice=None):
+    """
+    A voiced (harmonic, formant-shaped) or unvoiced (fricative) syllable. A
+    voice (pitch range, formant scale for vocal tract length, harmonic
+    roll-off) makes syllables sound like one speaker; without one each
+    syllable gets a random pitch.
+    """
+    pitch, scale, tilt = voice or ((100, 250), 1.0, 1.0)
+    t = np.arange(int(seconds * RATE)) / RATE
+    if rng.random() < 0.75:
+        f0 = rng.uniform(*pitch) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(2, 5) * t))
+        phase = 2 * np.pi * np.cumsum(f0) / RATE
+        formants = rng.uniform([300, 900], [900, 2500]) * scale
+        signal = sum(np.sin(k * phase) / k ** tilt * sum(np.exp(-((k * f0 - f) / 200) ** 2) + 0.05 for f in formants)
+                     for k in range(1, 30))
+    else:
+        noise = rng.standard_normal(len(t))
+        spectrum = np.fft.rfft(noise)
+        spectrum[:int(3000 * len(t) / RATE)] *= 0.05
+        signal = np.fft.irfft(spectrum, len(t)) * 0.5
+    return signal * np.hanning(len(t))
+
+def conversation(rng, lines=40, idle=0.0):
+    """
+    A visit laid out the way synthetic/generate_audio.py assembles one: dialogue
+    lines with 100 ms fades, 500 ms pauses (750 ms on a change of speaker) and
+    500 ms of silence at the end. With idle, that fraction of lines is followed
+    by 5-30 s without speech instead, as while the BHW takes a measurement.
+    Returns the audio and the true line intervals.
+    """
+    parts, truth, position, speaker = [], [], 0, 0
+    for line in range(lines):
+        if line:
+            changed = rng.random() < 0.7
+            speaker ^= changed
+            pause = int((rng.uniform(5, 30) if rng.random() < idle else 0.75 if changed else 0.5) * RATE)
+            parts.append(np.zeros(pause))
+            position += pause
+        words = []
+        for _ in range(rng.integers(3, 15)):
+            words.extend(syllable(rng, rng.uniform(0.1, 0.3)) for _ in range(rng.integers(1, 4)))
+            words.append(np.zeros(int(rng.uniform(0.02, 0.15) * RATE)))
+        speech = np.concatenate(words[:-1]) * rng.uniform(0.05, 0.3) / 0.3
+        fade = int(0.1 * RATE)
+        speech[:fade] *= np.linspace(0, 1, fade)
+        speech[-fade:] *= np.linspace(1, 0, fade)
+        parts.append(speech)
+        truth.append((position / RATE, (position + len(speech)) / RATE))
+        position += len(speech)
+    parts.append(np.zeros(int(0.5 * RATE)))
+    return np.concatenate(parts).astype(np.float32), truth
+
+def visit_truth(samples):
+    """
+    Line intervals of a generated visit: generate_audio.py puts digital silence
+    (at least 500 ms) between lines, so anything louder than -60 dBFS is speech
+    and quiet gaps shorter than 400 ms are inside a line.
+    """
+    frames = samples[:len(samples) // 160 * 160].reshape(-1, 160)
+    active = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10) > -60
+    edges = np.flatnonzero(np.diff(active, prepend=False, append=False)).reshape(-1, 2)
+    truth = []
+    for start, end in edges / 100:
+        if truth and start - truth[-1][1] < 0.4:
+            truth[-1] = (truth[-1][0], end)
+        else:
+            truth.append((start, end))
+    return truth
+
+def add_noise(rng, samples, snr_db, step_at=None):
+    """Pink-ish background noise at snr_db below the speech level, optionally 6 dB louder from step_at on."""
+    if snr_db is None:
+        return samples
+    white = rng.standard_normal(len(samples))
+    spectrum = np.fft.rfft(white)
+    spectrum[1:] /= np.sqrt(np.arange(1, len(spectrum)))
+    noise = np.fft.irfft(spectrum, len(samples))
+    speech_power = np.mean(samples[np.abs(samples) > 1e-4] ** 2)
+    noise *= np.sqrt(speech_power / np.mean(noise ** 2) / 10 ** (snr_db / 10))
+    if step_at is not None:
+        noise[int(step_at * len(noise)):] *= 10 ** (6 / 20)
+    return (samples + noise).astype(np.float32)
+
+def mask(intervals, seconds, resolution=0.01):
+    result = np.zeros(int(seconds / resolution) + 1, dtype=bool)
+    for start, end in intervals:
+        result[int(start / resolution):int(end / resolution)] = True
+    return result
+
+def score(utterances, truth, seconds):
+    detected, expected = mask([(u.start, u.end) for u in utterances], seconds), mask(truth, seconds)
+    recall = (detected & expected).sum() / max(expected.sum(), 1)
+    false_alarm = (detected & ~expected).sum() / max((~expected).sum(), 1)
+    # Each true line should be found once: onset error of the utterance nearest each line start
+    starts = np.array([u.start for u in utterances]) if utterances else np.array([np.inf])
+    onset = np.median([np.min(np.abs(starts - start)) for start, _ in truth])
+    return recall, false_alarm, detected.mean(), onset
+
+def run(label, samples, truth, vad):
+    seconds = len(samples) / RATE
+    started = time.perf_counter()
+    streamed = []
+    vad.reset()
+    for start in range(0, len(samples), CHUNK_FRAMES):
+        streamed.extend(vad.process(samples[start:start + CHUNK_FRAMES]))
+    streamed.extend(vad.flush())
+    stream_time = time.perf_counter() - started
+    started = time.perf_counter()
+    batch = vad.segments(samples)
+    batch_time = time.perf_counter() - started
+    recall, false_alarm, forwarded, onset = score(streamed, truth, seconds)
+    print(f"  {label:<24} {len(streamed):3d} utterances / {len(truth):3d} lines, speech recall {recall:6.1%}, "
+          f"false alarm {false_alarm:5.1%}, forwarded {forwarded:5.1%} of audio, onset error {onset * 1000:4.0f} ms, "
+          f"{seconds / stream_time:6.0f}x real time streaming ({seconds / batch_time:5.0f}x batch, {len(batch)} utterances)")
+
+def benchmark_vad():
+    rng = np.random.default_rng(0)
+    vad = VoiceActivityDetector(rate=RATE)
+    visits = []
+    for path in sorted(SYNTHETIC_AUDIO.glob("*.mp3"))[:5]:
+        audio = AudioSegment.from_file(path).set_channels(1).set_frame_rate(RATE).set_sample_width(2)
+        samples = np.frombuffer(audio.raw_data, dtype='<i2').astype(np.float32) / 32768
+        visits.append((path.name, samples, visit_truth(samples)))
+    if not visits:
+        print(f"No generated visits in {SYNTHETIC_AUDIO}; using stand-in conversations built the same way")
+        for number in range(2):
+            visits.append((f"stand-in visit {number + 1}",) + conversation(rng))
+        visits.append(("stand-in visit with exam pauses",) + conversation(rng, idle=0.2))
+    for name, samples, truth in visits:
+        silence = 1 - mask(truth, len(samples) / RATE).mean()
+        print(f"{name}: {len(samples) / RATE:.0f}s, {len(truth)} lines, {silence:.0%} silence")
+        for label, snr, step in (("clean", None, None), ("noise 20 dB SNR", 20, None), ("noise 10 dB SNR", 10, None),
+                                 ("noise 5 dB SNR", 5, None), ("10 dB, +6 dB midway", 10, 0.5)):
+            run(label, add_noise(rng, samples, snr, step), truth, vad)
+
+if __name__ == "__main__":
+    benchmark_vad()
@@ -0,0 +1,88 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from data_management.storage import DataStorage
+from data_management.write_behind import WriteBehindStorage
+
+CHUNK_SECONDS = 1024 / 16000  # one capture chunk
+GAP_THRESHOLD = 0.005         # a storage call longer than this is a visible capture gap
+
+class SlowFlashStorage(DataStorage):
+    """DataStorage whose commits occasionally stall, like cheap phone flash under load."""
+
+    def __init__(self, base_dir, stall_probability=0.05, stall_seconds=(0.05, 0.3)):
+        super().__init__(base_dir)
+        self.rng = random.Random(0)
+        self.stall_probability = stall_probability
+        self.stall_seconds = stall_seconds
+
+    def store_interactions(self, interactions):
+        if self.rng.random() < self.stall_probability:
+            time.sleep(self.rng.uniform(*self.stall_seconds))
+        return super().store_interactions(interactions)
+
+@contextmanager
+def slow_fsync(stall_probability=0.3, stall_seconds=(0.05, 0.3)):
+    """Make os.fsync (the write-behind journal's) stall like the commits, more often: it runs far less often."""
+    rng = random.Random(1)
+    fsync = os.fsync
+
+    def stalling_fsync(fd):
+        if rng.random() < stall_probability:
+            time.sleep(rng.uniform(*stall_seconds))
+        return fsync(fd)
+
+    os.fsync = stalling_fsync
+    try:
+        yield
+    finally:
+        os.fsync = fsync
+
+def capture_loop(storage, chunks, realtime):
+    """Store one interaction per chunk the way production_mode does; returns per-call times."""
+    context = {'condition_type': 'prenatal', 'measurements': ["BP 120/80"], 'covered_topics': [], 'danger_signs': []}
+    samples = []
+    for i in range(chunks):
+        started = time.perf_counter()
+        storage.store_interaction(None, f"[00:{i % 60:02d}] BHW: chunk {i}", {'recommendations': []},
+                                  context=context, session_id="bench", audio_file="session_bench.wav")
+        elapsed = time.perf_counter() - started
+        samples.append(elapsed)
+        if realtime:
+            time.sleep(max(CHUNK_SECONDS - elapsed, 0))
+    return samples
+
+def summarize(label, samples):
+    samples = sorted(samples)
+    gaps = sum(s > GAP_THRESHOLD for s in samples)
+    print(f"  {label:<22} p50 {statistics.median(samples) * 1e3:7.3f} ms  p99 {samples[int(len(samples) * 0.99)] * 1e3:7.2f} ms  "
+          f"max {samples[-1] * 1e3:7.1f} ms  gaps >{GAP_THRESHOLD * 1e3:.0f} ms: {gaps} ({sum(s for s in samples if s > GAP_THRESHOLD):.2f}s)")
+
+def benchmark_write_behind(chunks=2000, realtime=False):
+    print(f"{chunks} interactions stored from the capture loop, slow-flash storage and journal fsyncs")
+    with tempfile.TemporaryDirectory() as base_dir:
+        storage = SlowFlashStorage(base_dir)
+        summarize("synchronous", capture_loop(storage, chunks, realtime))
+        storage.close()
+    with tempfile.TemporaryDirectory() as base_dir, slow_fsync():
+        storage = WriteBehindStorage(SlowFlashStorage(base_dir))
+        samples = capture_loop(storage, chunks, realtime)
+        started = time.perf_counter()
+        storage.flush()
+        flushed = time.perf_counter() - started
+        storage.wait_durable()
+        synced = time.perf_counter() - started
+        summarize("write-behind", samples)
+        metrics = storage.backpressure()
+        print(f"  write-behind: {metrics['written']} written in {metrics['batches']} batches, max depth "
+              f"{metrics['max_depth']}, blocked puts {metrics['blocked_puts']}, final flush {flushed:.2f}s, "
+              f"durable after {synced:.2f}s")
+        print(f"  journal: {metrics['fsyncs']} fsyncs (up to {metrics['max_sync_group']} records each), "
+              f"slowest {metrics['max_fsync_seconds'] * 1e3:.0f} ms")
+        storage.close()
+
+if __name__ == "__main__":
+    benchmark_write_behind()
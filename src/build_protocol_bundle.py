@@ -0,0 +1,21 @@
+import argparse
+from pathlib import Path
+from protocols.bundle import build_bundle, BundleError, DEFAULT_BUNDLE_PATH
+from protocols.protocol_manager import load_protocol_definitions
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile protocol definitions into a binary bundle')
+    parser.add_argument('--definitions', type=str, default=str(Path(__file__).parent / "protocols" / "definitions"),
+                        help='Protocol definitions directory')
+    parser.add_argument('--output', type=str, default=str(DEFAULT_BUNDLE_PATH), help='Bundle file to write')
+    args = parser.parse_args()
+
+    try:
+        path = build_bundle(load_protocol_definitions(Path(args.definitions)), Path(args.output))
+    except BundleError as e:
+        print(f"Error: {str(e)}")
+        return
+    print(f"Wrote protocol bundle {path} ({path.stat().st_size} bytes)")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
 import os
+import numpy as np
 from anthropic import Anthropic
 from openai import OpenAI
 from pathlib import Path
 
+from voice_processing.denoise import denoised_copy
+from voice_processing.diarization import diarize_file, load_bhw_profile
+from voice_processing.pcm import HEADER, float_to_int16, pack_wav_header
+
 class AudioAnalyzer:
     def __init__(self, anthropic_api_key=None, openai_api_key=None):
         self.claude = Anthropic(api_key=anthropic_api_key or os.getenv("ANTHROPIC_API_KEY"))
         self.openai = OpenAI(api_key=openai_api_key or os.getenv("OPENAI_API_KEY"))
+        self.bhw_profile = load_bhw_profile()
+        self.noise_suppression = os.getenv("NOISE_SUPPRESSION", "on") != "off"
         
         # Set up paths
         self.data_dir = Path("data")
@@ -26,11 +33,25 @@ class AudioAnalyzer:
             )
         return str(response)
 
-    def process_audio_stream(self, audio_data):
-        """Process a stream of audio data in real-time."""
-        # TODO: Implement real-time audio processing
-        # This will be used in production mode
-        pass
+    def process_audio_stream(self, audio_data, rate=16000):
+        """
+        Transcribe one utterance of live audio (float32 mono samples at rate,
+        as the VAD hands it over, already denoised) with Whisper. The
+        utterance is sent as an in-memory 16-bit WAV; nothing touches disk.
+        """
+        samples = np.frombuffer(audio_data, dtype=np.float32)
+        pcm = float_to_int16(samples, np.empty(len(samples), dtype='<i2'), np.empty_like(samples))
+        wav = bytearray(HEADER.size + pcm.nbytes)
+        pack_wav_header(wav, rate, 1, 2, False, pcm.nbytes)
+        wav[HEADER.size:] = pcm.tobytes()
+        response = self.openai.audio.transcriptions.create(
+            model="whisper-1",
+            file=("utterance.wav", bytes(wav)),
+            language="tl",  # ISO code for Tagalog
+            response_format="text",
+            prompt="This is a conversation between a Barangay Health Worker and a patient in Tagalog (Tayabas dialect)."
+        )
+        return str(response).strip()
 
     def extract_claude_content(self, response):
         """Extract clean text content from Claude's response."""
@@ -39,23 +60,25 @@ class AudioAnalyzer:
             content = content[0].text
         return content.strip()
 
-    def structure_transcription(self, raw_transcription):
-        """Use Claude to structure the transcription with proper speaker labels."""
-        response = self.claude.messages.create(
-            model="claude-3-opus-20240229",
-            max_tokens=4096,
-            messages=[{
-                "role": "user",
-                "content": f"""Please analyze this medical conversation between a Barangay Health Worker (BHW) and a patient.
-Structure it with timestamps and speaker labels (BHW or Patient) based on the context of each statement.
-Use this exact format for each line, with no introduction or other text:
-[MM:SS] Speaker: Text
+    def transcribe_segments(self, audio_file_path):
+        """
+        Transcribe Tagalog audio with Whisper, returning its timed segments
+        (start, end, text). The audio is denoised first unless
+        NOISE_SUPPRESSION=off: background noise makes Whisper invent text.
+        """
+        with denoised_copy(audio_file_path, self.noise_suppression) as upload, open(upload, 'rb') as audio:
+            response = self.openai.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio,
+                language="tl",  # ISO code for Tagalog
+                response_format="verbose_json",
+                prompt="This is a conversation between a Barangay Health Worker and a patient in Tagalog (Tayabas dialect)."
+            )
+        return response.segments
 
-Here's the conversation:
-{raw_transcription}"""
-            }]
-        )
-        return self.extract_claude_content(response)
+    def structure_transcription(self, audio_file_path, segments):
+        """Label who said what from the audio itself (local diarization), as [MM:SS] Speaker: Text lines."""
+        return diarize_file(audio_file_path, segments, profile=self.bhw_profile)
 
     def translate_transcription(self, tagalog_text):
         """Translate Tagalog transcription to English using Claude."""
@@ -179,9 +202,9 @@ Initial analysis:
             # 1. Transcribe and structure audio if Tagalog transcription doesn't exist
             if not tagalog_trans_path.exists():
                 print("Transcribing audio...")
-                raw_transcription = self.transcribe_audio(audio_file_path)
+                segments = self.transcribe_segments(audio_file_path)
                 print("Structuring transcription with speaker labels...")
-                tagalog_transcription = self.structure_transcription(raw_transcription)
+                tagalog_transcription = self.structure_transcription(audio_file_path, segments)
                 tagalog_trans_path.write_text(tagalog_transcription, encoding='utf-8')
             else:
                 print(f"Tagalog transcription exists, loading from {tagalog_trans_path}")
@@ -0,0 +1,191 @@
+import io
+import os
+import resource
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Any, Optional
+
+import numpy as np
+from pydub import AudioSegment
+
+from data_management.encryption import is_encrypted, read_key_id
+from data_management.session_recorder import read_wav_info, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM
+from voice_processing.pcm import float_to_int16
+
+# Deployment choices: FLAC keeps every 16-bit sample, Opus is a speech-grade lossy codec
+CODECS = {
+    'flac': {'format': 'flac', 'suffix': '.flac', 'lossless': True, 'parameters': []},
+    'opus': {'format': 'ogg', 'suffix': '.opus', 'lossless': False, 'codec': 'libopus',
+             'parameters': ['-application', 'voip']},
+}
+
+# Lossy output must decode to the same length (Opus pads by a few ms) and a similar level
+MAX_DURATION_DRIFT = 0.1
+MAX_LEVEL_DRIFT_DB = 3.0
+
+PCM_BLOCK = 65536  # samples converted at a time by load_pcm16
+
+
+def load_pcm16(path: Path, open_audio: Callable[[Path], BinaryIO] = lambda path: open(path, 'rb')) -> AudioSegment:
+    """
+    Read a session WAV (float32 or PCM) as a 16-bit AudioSegment for encoding.
+    open_audio opens the file for reading (DataStorage.open_audio for encrypted files).
+    """
+    with open_audio(path) as f:
+        info = read_wav_info(f)
+        if info.format_tag == WAVE_FORMAT_IEEE_FLOAT or (info.format_tag == WAVE_FORMAT_PCM and info.sample_width == 2):
+            f.seek(info.data_offset)
+            data = f.read(info.data_size)
+        else:
+            f.seek(0)
+            return AudioSegment.from_wav(f)
+    if info.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        samples = np.frombuffer(data, dtype=np.float32 if info.sample_width == 4 else np.float64)
+        # Converted in place: no float temporaries the size of the whole recording
+        pcm16 = np.empty(len(samples), dtype='<i2')
+        scratch = np.empty(PCM_BLOCK, dtype=np.float32)
+        for start in range(0, len(samples), PCM_BLOCK):
+            block = samples[start:start + PCM_BLOCK]
+            float_to_int16(block, pcm16[start:start + PCM_BLOCK], scratch[:len(block)])
+        data = pcm16.data.cast('B')
+    frame_size = 2 * info.channels
+    return AudioSegment(data=data[:len(data) - len(data) % frame_size], sample_width=2,
+                        frame_rate=info.rate, channels=info.channels)
+
+
+class AudioCompressor:
+    """
+    Re-encodes finished session recordings in the background. Each file is
+    encoded, decoded again and checked (bit-exact 16-bit samples for FLAC;
+    duration and level for Opus) before the storage index is pointed at the
+    new file and the original removed. The worker thread lowers its own
+    priority (and so that of the ffmpeg processes it spawns) and only touches
+    session recordings whose sessions have ended and whose interactions are
+    all stored, so capture never waits on it and no row is left pointing at a
+    removed file. Encoding and
+    verification happen in memory and the result is written through the
+    storage, so encrypted recordings never touch disk as plaintext.
+    """
+
+    def __init__(self, storage, codec: str = 'flac', bitrate: str = '24k', poll_interval: float = 30.0,
+                 niceness: int = 10):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown audio codec '{codec}', expected one of {', '.join(CODECS)}")
+        self.storage = storage
+        self.codec = codec
+        self.bitrate = bitrate
+        self.poll_interval = poll_interval
+        self.niceness = niceness
+        self.stats = {'files': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0,
+                      'audio_seconds': 0.0, 'cpu_seconds': 0.0}
+        self._failed = set()  # not retried until restart
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background worker."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="audio-compressor", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop after the file currently being encoded, if any."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        try:
+            # On Linux this lowers only the calling thread; ffmpeg children inherit it
+            os.nice(self.niceness)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.is_set():
+            self.compress_pending()
+            self._stop.wait(self.poll_interval)
+
+    def compress_pending(self) -> int:
+        """Compress every finished recording; returns how many were converted."""
+        converted = 0
+        for path in self.storage.finished_recordings():
+            if self._stop.is_set():
+                break
+            if path in self._failed:
+                continue
+            converted += self.compress_file(path) is not None
+        return converted
+
+    def compress_file(self, path: Path) -> Optional[Dict[str, Any]]:
+        """Encode, verify and swap in one recording; returns its stats, or None on failure."""
+        spec = CODECS[self.codec]
+        output_path = path.with_suffix(spec['suffix'])
+        cpu_started = time.thread_time()
+        children_started = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        try:
+            audio = load_pcm16(path, self.storage.open_audio)
+            export_args = {'format': spec['format'], 'parameters': list(spec['parameters'])}
+            if 'codec' in spec:
+                export_args.update(codec=spec['codec'], bitrate=self.bitrate)
+            encoded = io.BytesIO()
+            audio.export(encoded, **export_args)
+            self._verify(audio, encoded, spec)
+            self.storage.write_audio_file(output_path, encoded.getvalue(),
+                                          read_key_id(path) if is_encrypted(path) else None)
+        except Exception as e:
+            print(f"Error compressing {path}: {str(e)}")
+            output_path.unlink(missing_ok=True)
+            self._failed.add(path)
+            self.stats['failed'] += 1
+            return None
+
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu_seconds = (time.thread_time() - cpu_started
+                       + children.ru_utime - children_started.ru_utime
+                       + children.ru_stime - children_started.ru_stime)
+        bytes_in, bytes_out = path.stat().st_size, output_path.stat().st_size
+        if not self.storage.replace_audio_file(path, output_path):
+            # Nothing points at the new file (interactions still queued): keep the original, retry later
+            print(f"Not compressing {path} yet: no stored interactions were repointed")
+            output_path.unlink(missing_ok=True)
+            return None
+        path.unlink()
+
+        result = {'path': output_path, 'bytes_in': bytes_in, 'bytes_out': bytes_out,
+                  'ratio': bytes_in / max(bytes_out, 1), 'audio_seconds': audio.duration_seconds,
+                  'cpu_seconds': cpu_seconds}
+        self.stats['files'] += 1
+        self.stats['bytes_in'] += bytes_in
+        self.stats['bytes_out'] += bytes_out
+        self.stats['audio_seconds'] += audio.duration_seconds
+        self.stats['cpu_seconds'] += cpu_seconds
+        return result
+
+    def _verify(self, original: AudioSegment, encoded: BinaryIO, spec: Dict[str, Any]):
+        """Decode the encoded audio and check it against the source."""
+        encoded.seek(0)
+        decoded = AudioSegment.from_file(encoded, format=spec['format'])
+        if spec['lossless']:
+            decoded = decoded.set_sample_width(2)
+            if decoded.raw_data != original.raw_data:
+                raise ValueError("decoded samples differ from the source")
+            return
+        if abs(decoded.duration_seconds - original.duration_seconds) > MAX_DURATION_DRIFT:
+            raise ValueError(f"decoded duration {decoded.duration_seconds:.2f}s, "
+                             f"expected {original.duration_seconds:.2f}s")
+        if original.rms and abs(decoded.dBFS - original.dBFS) > MAX_LEVEL_DRIFT_DB:
+            raise ValueError(f"decoded level {decoded.dBFS:.1f} dBFS, expected {original.dBFS:.1f} dBFS")
+
+    def report(self) -> str:
+        """Compression ratio and CPU cost so far."""
+        stats = self.stats
+        if not stats['files']:
+            return f"Audio compression ({self.codec}): no files converted, {stats['failed']} failed"
+        ratio = stats['bytes_in'] / max(stats['bytes_out'], 1)
+        cpu_per_hour = stats['cpu_seconds'] / max(stats['audio_seconds'], 1e-9) * 3600
+        return (f"Audio compression ({self.codec}): {stats['files']} files, "
+                f"{stats['bytes_in'] / 1e6:.1f} MB -> {stats['bytes_out'] / 1e6:.1f} MB ({ratio:.1f}x), "
+                f"{stats['cpu_seconds']:.1f} CPU s ({cpu_per_hour:.0f} CPU s per hour of audio), "
+                f"{stats['failed']} failed")
@@ -0,0 +1,337 @@
+import base64
+import io
+import os
+import struct
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+KEY_SIZE = 32
+NONCE_SIZE = 12
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# File layout: header (MAGIC, chunk size, key id), then one record per chunk:
+# random nonce + AES-256-GCM ciphertext + tag. Every record but the last holds
+# exactly chunk_size plaintext bytes, so chunk i starts at a computable offset.
+# Each chunk's associated data binds the header, the chunk index and whether it
+# is the final chunk, so chunks cannot be reordered, swapped between files, or
+# truncated away without detection.
+MAGIC = b"BHWENC01"
+FILE_HEADER = struct.Struct("<8sIH")
+CHUNK_AAD = struct.Struct("<QB")
+
+MASTER_KEY_ENV = "BHW_STORAGE_KEY"
+MASTER_KEY_FILE_ENV = "BHW_STORAGE_KEY_FILE"
+DEFAULT_MASTER_KEY_PATH = Path("~/.config/bhw-assistant/master.key")
+# Where earlier versions kept the key file, relative to the data directory
+LEGACY_MASTER_KEY_PATH = Path("keys") / "master.key"
+
+
+class EncryptionError(Exception):
+    """Raised when encrypted data fails authentication or a key is unavailable."""
+
+
+def generate_key() -> bytes:
+    return AESGCM.generate_key(bit_length=KEY_SIZE * 8)
+
+
+def encrypt_value(key: bytes, plaintext: bytes, associated_data: bytes) -> bytes:
+    """One-shot AEAD for small values (database fields, wrapped keys): nonce + ciphertext."""
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + AESGCM(key).encrypt(nonce, plaintext, associated_data)
+
+
+def decrypt_value(key: bytes, sealed: bytes, associated_data: bytes) -> bytes:
+    try:
+        return AESGCM(key).decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], associated_data)
+    except InvalidTag:
+        raise EncryptionError("Encrypted value failed authentication")
+
+
+def master_key_path() -> Path:
+    """The master key file: BHW_STORAGE_KEY_FILE if set, otherwise one in the user's config directory."""
+    return Path(os.getenv(MASTER_KEY_FILE_ENV) or DEFAULT_MASTER_KEY_PATH).expanduser()
+
+
+def load_master_key(data_dir: Path, key_path: Optional[Path] = None) -> bytes:
+    """
+    The key that wraps per-session keys for data_dir: BHW_STORAGE_KEY
+    (base64) if set, otherwise the key file at key_path (master_key_path() by
+    default), created on first use and readable only by its owner.
+
+    The key file must lie outside data_dir, so that a copy of the data
+    directory does not carry the key that opens it. A key file left at
+    data_dir/keys/master.key by earlier versions is moved to key_path. Either
+    way the file sits on the same device as the data; only BHW_STORAGE_KEY,
+    supplied from somewhere else, keeps a stolen device's data sealed.
+    """
+    encoded = os.getenv(MASTER_KEY_ENV)
+    if encoded:
+        key = base64.b64decode(encoded)
+        if len(key) != KEY_SIZE:
+            raise EncryptionError(f"{MASTER_KEY_ENV} must be {KEY_SIZE} bytes, base64-encoded")
+        return key
+
+    data_dir = Path(data_dir).resolve()
+    key_path = Path(key_path or master_key_path()).expanduser().resolve()
+    if key_path.is_relative_to(data_dir):
+        raise EncryptionError(f"The master key file {key_path} must be outside the data directory {data_dir}")
+
+    legacy_path = data_dir / LEGACY_MASTER_KEY_PATH
+    if legacy_path.exists():
+        legacy_key = legacy_path.read_bytes()
+        if not key_path.exists():
+            _write_key_file(key_path, legacy_key)
+        elif key_path.read_bytes() != legacy_key:
+            raise EncryptionError(f"{legacy_path} differs from the master key at {key_path}; "
+                                  f"point {MASTER_KEY_FILE_ENV} at a new location to move it there")
+        legacy_path.unlink()
+        print(f"Moved the master key out of the data directory to {key_path}")
+
+    if key_path.exists():
+        return key_path.read_bytes()
+    key = generate_key()
+    _write_key_file(key_path, key)
+    return key
+
+
+def _write_key_file(key_path: Path, key: bytes):
+    """Create a key file readable only by its owner; fails if one exists."""
+    key_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def is_encrypted(path: Path) -> bool:
+    """True if the file starts with the encrypted-file header."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def read_key_id(path: Path) -> str:
+    """Key id recorded in an encrypted file's header."""
+    with open(path, 'rb') as f:
+        header = f.read(FILE_HEADER.size)
+        magic, _, key_id_length = FILE_HEADER.unpack(header)
+        if magic != MAGIC:
+            raise EncryptionError(f"{path} is not an encrypted file")
+        return f.read(key_id_length).decode('utf-8')
+
+
+class EncryptedFileWriter:
+    """
+    Append-only encrypted file, written one chunk at a time. Only the current,
+    incomplete chunk is held in memory. sync() also writes that partial chunk
+    (re-encrypted under a fresh nonce each time it grows) so a crash loses
+    nothing that was synced. write_at() patches already-written bytes, e.g. a
+    WAV header, by re-encrypting the affected chunks.
+    """
+
+    def __init__(self, path: Path, key: bytes, key_id: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self._aead = AESGCM(key)
+        key_id_bytes = key_id.encode('utf-8')
+        self._header = FILE_HEADER.pack(MAGIC, chunk_size, len(key_id_bytes)) + key_id_bytes
+        self._record_size = NONCE_SIZE + chunk_size + TAG_SIZE
+        self._chunks = 0             # full chunks on disk
+        self._tail = bytearray()     # plaintext of the incomplete chunk
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'w+b')
+        self._file.write(self._header)
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def tell(self) -> int:
+        """Plaintext bytes written so far."""
+        return self._chunks * self.chunk_size + len(self._tail)
+
+    def _offset(self, index: int) -> int:
+        return len(self._header) + index * self._record_size
+
+    def _write_chunk(self, index: int, plaintext: bytes, final: bool = False):
+        nonce = os.urandom(NONCE_SIZE)
+        self._file.seek(self._offset(index))
+        self._file.write(nonce)
+        self._file.write(self._aead.encrypt(nonce, plaintext, self._header + CHUNK_AAD.pack(index, final)))
+
+    def write(self, data: bytes):
+        """Append plaintext."""
+        self._tail += data
+        if len(self._tail) < self.chunk_size:
+            return
+        full = len(self._tail) - len(self._tail) % self.chunk_size
+        with memoryview(self._tail) as view:
+            for start in range(0, full, self.chunk_size):
+                self._write_chunk(self._chunks, view[start:start + self.chunk_size])
+                self._chunks += 1
+        del self._tail[:full]
+
+    def write_at(self, offset: int, data: bytes):
+        """Overwrite plaintext bytes that have already been written."""
+        if offset + len(data) > self.tell():
+            raise ValueError("write_at can only overwrite existing bytes")
+        while data:
+            index, within = divmod(offset, self.chunk_size)
+            take = min(self.chunk_size - within, len(data))
+            if index == self._chunks:
+                self._tail[within:within + take] = data[:take]
+            else:
+                self._file.seek(self._offset(index))
+                record = self._file.read(self._record_size)
+                plaintext = bytearray(self._aead.decrypt(
+                    record[:NONCE_SIZE], record[NONCE_SIZE:], self._header + CHUNK_AAD.pack(index, False)
+                ))
+                plaintext[within:within + take] = data[:take]
+                self._write_chunk(index, bytes(plaintext))
+            offset += take
+            data = data[take:]
+
+    def sync(self):
+        """Write the partial chunk, then flush and fsync."""
+        if self._tail:
+            self._write_chunk(self._chunks, self._tail)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Write the final chunk (possibly empty) that marks the file complete."""
+        if self._file.closed:
+            return
+        self._write_chunk(self._chunks, self._tail, final=True)
+        self._file.truncate()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+class EncryptedFileReader(io.RawIOBase):
+    """
+    Seekable, read-only view of an encrypted file that decrypts only the chunks
+    a read touches. With strict=False, a file whose final chunk is missing
+    (the writer crashed) reads up to the last authenticated chunk.
+    """
+
+    def __init__(self, path: Path, key_for: Callable[[str], bytes], strict: bool = True):
+        super().__init__()
+        self.path = Path(path)
+        self._file = open(self.path, 'rb')
+        magic, self.chunk_size, key_id_length = FILE_HEADER.unpack(self._file.read(FILE_HEADER.size))
+        if magic != MAGIC:
+            self._file.close()
+            raise EncryptionError(f"{self.path} is not an encrypted file")
+        self.key_id = self._file.read(key_id_length).decode('utf-8')
+        self._header = FILE_HEADER.pack(magic, self.chunk_size, key_id_length) + self.key_id.encode('utf-8')
+        self._aead = AESGCM(key_for(self.key_id))
+        self.strict = strict
+        self._record_size = NONCE_SIZE + self.chunk_size + TAG_SIZE
+
+        body = os.fstat(self._file.fileno()).st_size - len(self._header)
+        full, last = divmod(body, self._record_size)
+        if last == 0 and full:
+            full, last = full - 1, self._record_size
+        if 0 < last < NONCE_SIZE + TAG_SIZE:
+            last = 0  # torn write of the final record
+        self._last_index = full
+        self._last_length = max(last - NONCE_SIZE - TAG_SIZE, 0)
+        self.complete = True
+        self._cached: Tuple[int, bytes] = (-1, b"")
+        self._position = 0
+        try:
+            if not last:
+                raise EncryptionError(f"{self.path} is truncated")
+            self._chunk(self._last_index)
+        except EncryptionError:
+            if strict:
+                self._file.close()
+                raise
+            # Crashed writer: keep the full chunks before the unreadable or missing tail
+            self.complete = False
+            if last and full:
+                self._last_index, self._last_length = full - 1, self.chunk_size
+            elif last:
+                self._last_length = 0
+        self.size = self._last_index * self.chunk_size + self._last_length
+
+    def _chunk(self, index: int) -> bytes:
+        """Decrypt (and cache) one chunk."""
+        if self._cached[0] == index:
+            return self._cached[1]
+        length = self.chunk_size if index < self._last_index else self._last_length
+        self._file.seek(len(self._header) + index * self._record_size)
+        record = memoryview(self._file.read(NONCE_SIZE + length + TAG_SIZE))
+        nonce, ciphertext = record[:NONCE_SIZE], record[NONCE_SIZE:]
+        finals = (True, False) if index == self._last_index else (False,)
+        for final in finals:
+            try:
+                plaintext = self._aead.decrypt(nonce, ciphertext, self._header + CHUNK_AAD.pack(index, final))
+            except InvalidTag:
+                continue
+            if index == self._last_index and not final:
+                self.complete = False
+                if self.strict:
+                    raise EncryptionError(f"{self.path} is truncated")
+            self._cached = (index, plaintext)
+            return plaintext
+        raise EncryptionError(f"Chunk {index} of {self.path} failed authentication")
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        """Plaintext bytes [offset, offset + size), decrypting only the chunks involved."""
+        end = min(offset + size, self.size)
+        index, within = divmod(offset, self.chunk_size)
+        if within + (end - offset) <= self.chunk_size and offset < end:
+            return self._chunk(index)[within:within + end - offset]
+        parts = []
+        while offset < end:
+            index, within = divmod(offset, self.chunk_size)
+            chunk = self._chunk(index)
+            take = min(len(chunk) - within, end - offset)
+            parts.append(chunk[within:within + take])
+            offset += take
+        return b"".join(parts)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.read_at(self._position, len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        self._position = max(base + offset, 0)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def open_readable(path: Path, key_for: Optional[Callable[[str], bytes]] = None):
+    """Binary file object for path, decrypting transparently if it is encrypted."""
+    if is_encrypted(path):
+        if key_for is None:
+            raise EncryptionError(f"{path} is encrypted and no key lookup was given")
+        return io.BufferedReader(EncryptedFileReader(path, key_for), buffer_size=DEFAULT_CHUNK_SIZE)
+    return open(path, 'rb')
@@ -0,0 +1,368 @@
+import hashlib
+import json
+import os
+import time
+import zipfile
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from data_management.audio_compression import load_pcm16
+from data_management.encryption import is_encrypted, read_key_id
+from data_management.session_recorder import HEADER, read_wav_info
+from voice_processing.pcm import PcmConverter
+
+DAY = 24 * 3600
+
+
+class AudioRule(NamedTuple):
+    """
+    What to do with a stored audio file. A rule matches when every condition
+    that is set holds for the interactions referencing the file; the first
+    matching rule wins and files matching none are kept.
+    """
+    name: str
+    action: str                             # 'keep', 'downsample' or 'delete'
+    min_age_days: float = 0                 # age of the newest interaction using the file
+    danger_signs: Optional[bool] = None     # any interaction reported a danger sign
+    processed: Optional[bool] = None        # every interaction has a stored transcript
+    flag: Optional[Tuple[str, str]] = None  # (kind, value) flag on any interaction
+
+
+DEFAULT_AUDIO_RULES = (
+    AudioRule('danger-sign sessions', 'keep', danger_signs=True),
+    AudioRule('not yet processed', 'keep', processed=False),
+    AudioRule('processed, over a year old', 'delete', min_age_days=365),
+    AudioRule('processed, over 30 days old', 'downsample', min_age_days=30),
+)
+
+# Speech stays intelligible for review at 8 kHz, 16-bit: a quarter of the float32 recording
+DOWNSAMPLE_RATE = 8000
+DOWNSAMPLE_BLOCK = 16384  # frames converted at a time, through the converter's reused buffers
+
+# Directories (relative to the data dir) whose duplicate files are hard-linked together. Only
+# write-once audio: rewriting one path of a linked pair in place would change the other too.
+DEDUP_DIRS = ('raw/audio', 'synthetic/audio')
+
+# Small JSON artifacts in data/processed are packed into monthly zip archives once they stop changing
+COMPACT_PATTERN = '*.json'
+COMPACT_MAX_BYTES = 64 * 1024
+COMPACT_MIN_AGE_DAYS = 1
+ARCHIVE_DIR = 'archives'
+COMPACT_BATCH = 500  # files per archive update, so the time budget is checked between batches
+
+HASH_BLOCK = 1024 * 1024
+
+
+def disk_usage(path: Path) -> int:
+    """Bytes allocated on disk for a file (small files still take a whole block)."""
+    stat = path.stat()
+    return getattr(stat, 'st_blocks', 0) * 512 or stat.st_size
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RetentionEngine:
+    """
+    Reclaims space under the data directory in three passes:
+
+    - audio: applies AudioRules to each stored audio file, deleting it (and
+      clearing the interactions' audio_file) or downsampling it in place;
+    - dedup: replaces audio files with identical content by hard links to one copy;
+    - compact: packs small, settled JSON files from data/processed into
+      zip archives, verifying each archive before removing the originals.
+
+    run() stops once its time budget is spent and saves where each pass got to
+    in data/retention_state.json (along with the content hashes computed so
+    far), so repeated runs work through a large tree incrementally.
+    """
+
+    def __init__(self, storage, rules: Iterable[AudioRule] = DEFAULT_AUDIO_RULES, dry_run: bool = False):
+        self.storage = storage
+        self.rules = tuple(rules)
+        for rule in self.rules:
+            if rule.action not in ('keep', 'downsample', 'delete'):
+                raise ValueError(f"Unknown retention action '{rule.action}' in rule '{rule.name}'")
+        self.dry_run = dry_run
+        self.data_dir = Path(storage.base_dir)
+        self.state_path = self.data_dir / "retention_state.json"
+        self.state = self._load_state()
+        self.stats = {
+            'deleted': 0, 'downsampled': 0, 'kept': 0, 'deduplicated': 0, 'compacted': 0, 'failed': 0,
+            'reclaimed_audio': 0, 'reclaimed_dedup': 0, 'reclaimed_compact': 0, 'seconds': 0.0,
+        }
+        self.complete = {'audio': False, 'dedup': False, 'compact': False}
+
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'audio_cursor': None, 'hashes': {}}
+
+    def _save_state(self):
+        if self.dry_run:
+            return
+        temp_path = self.state_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
+
+    def run(self, time_budget: float = 60.0) -> Dict[str, Any]:
+        """Run the passes in order until they finish or time_budget seconds have passed."""
+        started = time.monotonic()
+        deadline = started + time_budget
+        try:
+            self.complete['audio'] = self.apply_audio_rules(deadline)
+            self.complete['dedup'] = time.monotonic() < deadline and self.deduplicate(deadline)
+            self.complete['compact'] = time.monotonic() < deadline and self.compact(deadline)
+        finally:
+            self._save_state()
+            self.stats['seconds'] += time.monotonic() - started
+        return {**self.stats, 'complete': dict(self.complete)}
+
+    # Audio
+
+    def rule_for(self, summary: Dict[str, Any], now: Optional[float] = None) -> Optional[AudioRule]:
+        """The first rule matching an audio_file_summaries entry, or None."""
+        age_days = ((now or time.time()) - summary['newest']) / DAY
+        for rule in self.rules:
+            if age_days < rule.min_age_days:
+                continue
+            if rule.danger_signs is not None and summary['danger'] != rule.danger_signs:
+                continue
+            if rule.processed is not None and summary['processed'] != rule.processed:
+                continue
+            if rule.flag is not None and (rule.flag[0], rule.flag[1].lower()) not in {
+                    (kind, value.lower()) for kind, value in summary['flags']}:
+                continue
+            return rule
+        return None
+
+    def apply_audio_rules(self, deadline: float) -> bool:
+        """Apply the rules to stored audio from the saved cursor on; True once every file was visited."""
+        active = {str(path) for path in self.storage.active_recordings}
+        while time.monotonic() < deadline:
+            summaries = self.storage.audio_file_summaries(after=self.state.get('audio_cursor'))
+            if not summaries:
+                self.state['audio_cursor'] = None  # next run starts a fresh pass
+                return True
+            for summary in summaries:
+                if time.monotonic() >= deadline:
+                    return False
+                path = Path(summary['audio_file'])
+                rule = self.rule_for(summary)
+                if rule is None or rule.action == 'keep' or summary['audio_file'] in active or not path.exists():
+                    self.stats['kept'] += 1
+                elif rule.action == 'delete':
+                    self._delete_audio(path)
+                else:
+                    self._downsample(path)
+                self.state['audio_cursor'] = summary['audio_file']
+        return False
+
+    def _delete_audio(self, path: Path):
+        # A hard-linked copy frees nothing until its last link goes
+        reclaimed = disk_usage(path) if path.stat().st_nlink == 1 else 0
+        if not self.dry_run:
+            self.storage.replace_audio_file(path, None)
+            path.unlink()
+        self.stats['deleted'] += 1
+        self.stats['reclaimed_audio'] += reclaimed
+
+    def _downsample(self, path: Path):
+        """Rewrite a WAV recording as 16-bit PCM at DOWNSAMPLE_RATE, keeping its path and encryption key."""
+        if path.suffix != '.wav':
+            self.stats['kept'] += 1  # already compressed
+            return
+        try:
+            with self.storage.open_audio(path) as f:
+                info = read_wav_info(f)
+            if info.rate <= DOWNSAMPLE_RATE and info.sample_width == 2:
+                self.stats['kept'] += 1
+                return
+            audio = load_pcm16(path, self.storage.open_audio)
+            encoded = self._resample(audio)
+            before = disk_usage(path)
+            if self.dry_run:
+                reclaimed = before - len(encoded)
+            else:
+                temp_path = path.with_name(path.name + '.tmp')
+                self.storage.write_audio_file(temp_path, encoded,
+                                              read_key_id(path) if is_encrypted(path) else None)
+                os.replace(temp_path, path)
+                reclaimed = before - disk_usage(path)
+        except Exception as e:
+            print(f"Error downsampling {path}: {str(e)}")
+            self.stats['failed'] += 1
+            return
+        self.stats['downsampled'] += 1
+        self.stats['reclaimed_audio'] += reclaimed
+
+    @staticmethod
+    def _resample(audio) -> bytearray:
+        """
+        16-bit WAV of audio at DOWNSAMPLE_RATE. A windowed-sinc resampler
+        (rather than pydub's linear interpolation, which folds everything
+        above 4 kHz back into the band) streams the samples block by block
+        into one growing bytearray; its delay is trimmed so the recording
+        keeps its timing and length.
+        """
+        converter = PcmConverter(audio.frame_rate, audio.channels, int16_in=True, rate_out=DOWNSAMPLE_RATE)
+        samples = np.frombuffer(audio.raw_data, dtype='<i2').reshape(-1, audio.channels)
+        frame_size = 2 * audio.channels
+        length = len(samples) * DOWNSAMPLE_RATE // audio.frame_rate
+        lead = round(converter.delay * DOWNSAMPLE_RATE)  # whole output samples by construction
+        encoded = bytearray(HEADER.size)
+        for start in range(0, len(samples), DOWNSAMPLE_BLOCK):
+            encoded += converter.convert(samples[start:start + DOWNSAMPLE_BLOCK])
+        # Zeros push the last input through the filter
+        encoded += converter.convert(np.zeros((int(converter.delay * audio.frame_rate) + 2, audio.channels), np.int16))
+        del encoded[HEADER.size:HEADER.size + lead * frame_size]
+        del encoded[HEADER.size + length * frame_size:]
+        encoded[:HEADER.size] = converter.wav_header(len(encoded) - HEADER.size)
+        return encoded
+
+    # Deduplication
+
+    def _cached_hash(self, path: Path, stat: os.stat_result) -> str:
+        """Content hash, reused from the state while the file's size and mtime are unchanged."""
+        key = str(path)
+        cached = self.state['hashes'].get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = file_hash(path)
+        self.state['hashes'][key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def deduplicate(self, deadline: float) -> bool:
+        """Hard-link files with identical content; True if every candidate was hashed."""
+        active = {str(path) for path in self.storage.active_recordings}
+        by_size = defaultdict(list)
+        for directory in DEDUP_DIRS:
+            root = self.data_dir / directory
+            if not root.exists():
+                continue
+            for path in root.rglob('*'):
+                if path.is_file() and not path.is_symlink() and str(path) not in active:
+                    stat = path.stat()
+                    if stat.st_size:
+                        by_size[stat.st_size].append((path, stat))
+
+        # Forget hashes of files that are gone
+        present = {str(path) for files in by_size.values() for path, _ in files}
+        self.state['hashes'] = {key: value for key, value in self.state['hashes'].items() if key in present}
+
+        for files in by_size.values():
+            if len(files) < 2:
+                continue
+            by_hash = defaultdict(list)
+            for path, stat in files:
+                if time.monotonic() >= deadline:
+                    return False
+                by_hash[self._cached_hash(path, stat)].append((path, stat))
+            for duplicates in by_hash.values():
+                original, original_stat = duplicates[0]
+                for path, stat in duplicates[1:]:
+                    if (stat.st_dev, stat.st_ino) == (original_stat.st_dev, original_stat.st_ino):
+                        continue  # already linked
+                    self._link(original, path)
+        return True
+
+    def _link(self, original: Path, duplicate: Path):
+        reclaimed = disk_usage(duplicate)
+        if not self.dry_run:
+            temp_path = duplicate.with_name(duplicate.name + '.tmp')
+            try:
+                os.link(original, temp_path)
+                os.replace(temp_path, duplicate)
+            except OSError as e:
+                print(f"Error linking {duplicate} to {original}: {str(e)}")
+                temp_path.unlink(missing_ok=True)
+                self.stats['failed'] += 1
+                return
+        self.stats['deduplicated'] += 1
+        self.stats['reclaimed_dedup'] += reclaimed
+
+    # Compaction
+
+    def compact(self, deadline: float) -> bool:
+        """Pack settled small JSON files into archives; True if none are left to pack."""
+        processed_dir = self.data_dir / "processed"
+        archive_root = processed_dir / ARCHIVE_DIR
+        settled = time.time() - COMPACT_MIN_AGE_DAYS * DAY
+        groups = defaultdict(list)
+        for path in processed_dir.rglob(COMPACT_PATTERN):
+            if archive_root in path.parents or not path.is_file():
+                continue
+            stat = path.stat()
+            if stat.st_size <= COMPACT_MAX_BYTES and stat.st_mtime < settled:
+                month = time.strftime("%Y-%m", time.localtime(stat.st_mtime))
+                archive = archive_root / path.parent.relative_to(processed_dir) / f"{month}.zip"
+                groups[archive].append(path)
+
+        for archive, paths in groups.items():
+            for start in range(0, len(paths), COMPACT_BATCH):
+                if time.monotonic() >= deadline:
+                    return False
+                self._pack(archive, paths[start:start + COMPACT_BATCH])
+        return True
+
+    def _pack(self, archive: Path, paths: List[Path]):
+        """Add files to an archive, read every one back, then remove the originals."""
+        if self.dry_run:
+            # Upper bound: ignores the archive's own growth
+            self.stats['compacted'] += len(paths)
+            self.stats['reclaimed_compact'] += sum(disk_usage(path) for path in paths)
+            return
+
+        archive.parent.mkdir(parents=True, exist_ok=True)
+        before = disk_usage(archive) if archive.exists() else 0
+        packed = []
+        try:
+            with zipfile.ZipFile(archive, 'a', compression=zipfile.ZIP_DEFLATED) as zf:
+                existing = set(zf.namelist())
+                for path in paths:
+                    data = path.read_bytes()
+                    if path.name in existing:
+                        # Already archived (e.g. a crash before the original was removed)
+                        if zf.read(path.name) == data:
+                            packed.append((path, data))
+                        continue
+                    zf.writestr(path.name, data)
+                    packed.append((path, data))
+            with zipfile.ZipFile(archive, 'r') as zf:
+                for path, data in packed:
+                    if zf.read(path.name) != data:
+                        raise ValueError(f"{path.name} did not read back intact")
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            print(f"Error compacting into {archive}: {str(e)}")
+            self.stats['failed'] += 1
+            return
+
+        freed = sum(disk_usage(path) for path, _ in packed)
+        for path, _ in packed:
+            path.unlink()
+        self.stats['compacted'] += len(packed)
+        self.stats['reclaimed_compact'] += freed - (disk_usage(archive) - before)
+
+    def report(self) -> str:
+        """Reclaimed space per pass so far."""
+        stats = self.stats
+        total = stats['reclaimed_audio'] + stats['reclaimed_dedup'] + stats['reclaimed_compact']
+        pending = [name for name, done in self.complete.items() if not done]
+        return (f"Retention{' (dry run)' if self.dry_run else ''}: reclaimed {total / 1e6:.1f} MB in "
+                f"{stats['seconds']:.1f}s - audio {stats['reclaimed_audio'] / 1e6:.1f} MB "
+                f"({stats['deleted']} deleted, {stats['downsampled']} downsampled, {stats['kept']} kept), "
+                f"dedup {stats['reclaimed_dedup'] / 1e6:.1f} MB ({stats['deduplicated']} files linked), "
+                f"compaction {stats['reclaimed_compact'] / 1e6:.1f} MB ({stats['compacted']} files archived), "
+                f"{stats['failed']} failed"
+                + (f"; unfinished: {', '.join(pending)} (continues next run)" if pending else ""))
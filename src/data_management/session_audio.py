@@ -0,0 +1,221 @@
+import io
+import mmap
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+from pydub import AudioSegment
+
+from data_management.encryption import EncryptedFileReader, is_encrypted
+from data_management.session_recorder import HEADER, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM, read_wav_info
+
+# Headerless PCM (interaction audio saved straight from the capture loop) is read in the recorder's default format
+RAW_FORMAT = {'rate': 16000, 'channels': 1, 'sample_width': 4, 'format_tag': WAVE_FORMAT_IEEE_FLOAT}
+# Files that may hold headerless PCM: .pcm/.raw, and the .wav the file-based store wrote raw capture bytes to
+PCM_SUFFIXES = ('.wav', '.pcm', '.raw')
+# ffmpeg demuxer for compressed suffixes that are not a format name (AudioCompressor writes Opus in Ogg)
+DECODE_FORMATS = {'.opus': 'ogg'}
+
+
+def wav_header(rate: int, channels: int, sample_width: int, format_tag: int, data_bytes: int) -> bytes:
+    """Header for a WAV file holding data_bytes of audio in the given format."""
+    block_align = channels * sample_width
+    return HEADER.pack(
+        b"RIFF", HEADER.size - 8 + data_bytes, b"WAVE",
+        b"fmt ", 18, format_tag, channels, rate, rate * block_align, block_align, sample_width * 8, 0,
+        b"fact", 4, data_bytes // block_align,
+        b"data", data_bytes,
+    )
+
+
+class WavSliceReader(io.RawIOBase):
+    """
+    Read-only file object presenting a WAV header followed by an audio slice.
+    Reads copy straight from the slice into the caller's buffer, so an upload
+    (e.g. the transcription API's multipart body) streams the turn without a
+    WAV file ever being assembled in memory or on disk.
+    """
+
+    def __init__(self, header: bytes, data: memoryview, name: str = "turn.wav"):
+        super().__init__()
+        self.name = name
+        self._parts = (memoryview(header), data)
+        self._size = len(header) + len(data)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        written, position = 0, self._position
+        for part in self._parts:
+            if position >= len(part):
+                position -= len(part)
+                continue
+            take = min(len(part) - position, len(buffer) - written)
+            buffer[written:written + take] = part[position:position + take]
+            written += take
+            position = 0
+            if written == len(buffer):
+                break
+        self._position += written
+        return written
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self._size}[whence]
+        self._position = min(max(base + offset, 0), self._size)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+class SessionAudio:
+    """
+    Random access to one stored recording by time range or turn id.
+
+    Plain WAV or headerless PCM files are memory-mapped and slices are
+    memoryviews into the mapping: nothing is read until it is used, and only
+    the pages a slice touches are paged in, so memory does not grow with the
+    recording's length. Encrypted recordings decrypt only the chunks a slice
+    covers. Compressed recordings (FLAC/Opus), encrypted or not, have no byte
+    offsets per sample and are decoded whole.
+
+    turns maps turn (interaction) ids to their (start, end) seconds, as
+    returned by DataStorage.turn_index. Slices stay valid until close().
+    """
+
+    def __init__(self, path: Path, turns: Optional[Dict[str, Tuple[float, float]]] = None,
+                 key_for: Optional[Callable[[str], bytes]] = None):
+        self.path = Path(path)
+        self.turns = dict(turns or {})
+        self._file: Optional[BinaryIO] = None
+        self._map = None
+        self._reader = None
+        self._data = None
+
+        if is_encrypted(self.path):
+            if key_for is None:
+                raise ValueError(f"{self.path} is encrypted and no key lookup was given")
+            self._reader = EncryptedFileReader(self.path, key_for, strict=False)
+            if self.path.suffix in PCM_SUFFIXES:
+                self._set_format(self._reader, self._reader.size)
+            else:
+                self._decode(io.BufferedReader(self._reader))
+        elif self.path.suffix in PCM_SUFFIXES:
+            self._file = open(self.path, 'rb')
+            size = self.path.stat().st_size
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+            self._set_format(self._file, size)
+            view = memoryview(self._map) if self._map is not None else memoryview(b"")
+            self._data = view[self.data_offset:self.data_offset + self.data_size]
+        else:
+            self._decode()
+
+    def _set_format(self, source: BinaryIO, size: int):
+        """Read the format from the WAV header, or assume the raw capture format."""
+        if source.read(4) == b"RIFF":
+            source.seek(0)
+            info = read_wav_info(source)
+            self.rate, self.channels, self.sample_width, self.format_tag = (
+                info.rate, info.channels, info.sample_width, info.format_tag)
+            self.data_offset = info.data_offset
+            # A recording cut off between header updates has more audio than its header says
+            data_size = info.data_size if info.data_size else size - info.data_offset
+            self.data_size = min(data_size, size - info.data_offset)
+        else:
+            self.rate, self.channels, self.sample_width, self.format_tag = (
+                RAW_FORMAT['rate'], RAW_FORMAT['channels'], RAW_FORMAT['sample_width'], RAW_FORMAT['format_tag'])
+            self.data_offset, self.data_size = 0, size
+        self.data_size -= self.data_size % self.frame_size
+
+    def _decode(self, source: Optional[BinaryIO] = None):
+        """Decode a compressed recording whole: the file itself, or source with its decrypted bytes."""
+        if source is None:
+            audio = AudioSegment.from_file(self.path)
+        else:
+            audio = AudioSegment.from_file(
+                source, format=DECODE_FORMATS.get(self.path.suffix, self.path.suffix.lstrip('.')))
+        self.rate, self.channels, self.sample_width, self.format_tag = (
+            audio.frame_rate, audio.channels, audio.sample_width, WAVE_FORMAT_PCM)
+        self.data_offset, self.data_size = 0, len(audio.raw_data)
+        self._data = memoryview(audio.raw_data)
+
+    @property
+    def frame_size(self) -> int:
+        return self.channels * self.sample_width
+
+    @property
+    def duration(self) -> float:
+        return self.data_size / self.frame_size / self.rate
+
+    def _byte_range(self, start: float, end: Optional[float]) -> Tuple[int, int]:
+        first = min(max(int(round(start * self.rate)), 0) * self.frame_size, self.data_size)
+        last = self.data_size if end is None else min(int(round(end * self.rate)) * self.frame_size, self.data_size)
+        return first, max(first, last)
+
+    def slice(self, start: float = 0.0, end: Optional[float] = None) -> memoryview:
+        """Audio bytes between start and end seconds (end None: to the end of the recording)."""
+        first, last = self._byte_range(start, end)
+        if self._data is not None:
+            return self._data[first:last]
+        return memoryview(self._reader.read_at(self.data_offset + first, last - first))
+
+    def turn_range(self, turn_id: str) -> Tuple[float, float]:
+        try:
+            return self.turns[turn_id]
+        except KeyError:
+            raise KeyError(f"No audio range recorded for turn '{turn_id}' in {self.path}")
+
+    def turn(self, turn_id: str) -> memoryview:
+        """Audio bytes of one turn."""
+        return self.slice(*self.turn_range(turn_id))
+
+    def samples(self, start: float = 0.0, end: Optional[float] = None) -> np.ndarray:
+        """A slice as a (frames, channels) array viewing the same memory."""
+        if self.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+            dtype = np.float32 if self.sample_width == 4 else np.float64
+        else:
+            dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[self.sample_width]
+        return np.frombuffer(self.slice(start, end), dtype=np.dtype(dtype).newbyteorder('<')).reshape(-1, self.channels)
+
+    def wav_file(self, start: float = 0.0, end: Optional[float] = None, name: str = "turn.wav") -> WavSliceReader:
+        """A slice as a streaming WAV file object, e.g. for a transcription request."""
+        data = self.slice(start, end)
+        header = wav_header(self.rate, self.channels, self.sample_width, self.format_tag, len(data))
+        return WavSliceReader(header, data, name)
+
+    def turn_wav_file(self, turn_id: str) -> WavSliceReader:
+        return self.wav_file(*self.turn_range(turn_id), name=f"{turn_id}.wav")
+
+    def chunks(self, start: float = 0.0, end: Optional[float] = None, frames: int = 1024) -> Iterator[memoryview]:
+        """A slice in playback-sized pieces (e.g. for a PyAudio output stream's write)."""
+        data = self.slice(start, end)
+        step = frames * self.frame_size
+        for offset in range(0, len(data), step):
+            yield data[offset:offset + step]
+
+    def close(self):
+        """Release the mapping; slices handed out must not be used afterwards."""
+        if self._data is not None:
+            self._data.release()
+            self._data = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # a caller still holds a slice; the mapping goes when it does
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+        if self._reader is not None:
+            self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,166 @@
+import os
+import struct
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, NamedTuple, Optional, Union
+
+from data_management.encryption import EncryptedFileWriter
+
+# WAVE format tags
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+# RIFF header, 18-byte fmt chunk (with cbSize), fact chunk and data chunk header.
+# The RIFF size, fact sample count and data size are patched as audio is appended.
+HEADER = struct.Struct("<4sI4s 4sIHHIIHHH 4sII 4sI")
+RIFF_SIZE_OFFSET = 4
+FACT_SAMPLES_OFFSET = 12 + 26 + 8
+DATA_SIZE_OFFSET = HEADER.size - 4
+CHUNK_HEADER = struct.Struct("<4sI")
+
+
+class WavInfo(NamedTuple):
+    format_tag: int
+    channels: int
+    rate: int
+    sample_width: int
+    data_offset: int
+    data_size: int
+
+
+def read_wav_info(source: Union[Path, BinaryIO]) -> WavInfo:
+    """
+    Parse a WAV file's fmt chunk and locate its data chunk (PCM or IEEE float).
+    source is a path or a seekable binary file object positioned at the start.
+    """
+    if not hasattr(source, 'read'):
+        with open(source, 'rb') as f:
+            return read_wav_info(f)
+    f, path = source, getattr(source, 'name', 'audio')
+    riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+    if riff != b"RIFF" or wave != b"WAVE":
+        raise ValueError(f"{path} is not a WAV file")
+    fmt = None
+    while True:
+        header = f.read(CHUNK_HEADER.size)
+        if len(header) < CHUNK_HEADER.size:
+            raise ValueError(f"{path} has no data chunk")
+        chunk_id, size = CHUNK_HEADER.unpack(header)
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHIIHH", f.read(16))
+            f.seek(size - 16 + (size & 1), os.SEEK_CUR)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError(f"{path} has data before its fmt chunk")
+            format_tag, channels, rate, _, _, bits = fmt
+            return WavInfo(format_tag, channels, rate, bits // 8, f.tell(), size)
+        else:
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+class SessionRecorder:
+    """
+    Streams one interaction's audio into a single WAV file. Chunks go through a
+    fixed-size buffered writer, so memory stays constant however long the
+    session runs. Every fsync_interval seconds the header sizes are patched and
+    the file is fsynced, so a crash loses at most that much audio and leaves a
+    playable file. close() writes the final header.
+
+    Given a key, the file is written through EncryptedFileWriter instead and
+    only ever holds ciphertext.
+    """
+
+    def __init__(self, path: Path, rate: int = 16000, channels: int = 1, sample_width: int = 4,
+                 is_float: bool = True, buffer_size: int = 256 * 1024, fsync_interval: float = 5.0,
+                 on_close: Optional[Callable[["SessionRecorder"], None]] = None,
+                 key: Optional[bytes] = None, key_id: Optional[str] = None):
+        self.path = Path(path)
+        self.rate = rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.format_tag = WAVE_FORMAT_IEEE_FLOAT if is_float else WAVE_FORMAT_PCM
+        self.fsync_interval = fsync_interval
+        self.on_close = on_close
+        self.data_bytes = 0
+        self.fsync_count = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.encrypted = key is not None
+        if self.encrypted:
+            self._file = EncryptedFileWriter(self.path, key, key_id or self.path.stem)
+        else:
+            self._file = open(self.path, 'wb', buffering=buffer_size)
+        self._file.write(self._header())
+        self._last_sync = time.monotonic()
+
+    @property
+    def frames(self) -> int:
+        return self.data_bytes // (self.sample_width * self.channels)
+
+    @property
+    def duration(self) -> float:
+        """Seconds of audio written so far."""
+        return self.frames / self.rate
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def _header(self) -> bytes:
+        block_align = self.channels * self.sample_width
+        return HEADER.pack(
+            b"RIFF", HEADER.size - 8 + self.data_bytes, b"WAVE",
+            b"fmt ", 18, self.format_tag, self.channels, self.rate, self.rate * block_align,
+            block_align, self.sample_width * 8, 0,
+            b"fact", 4, self.frames,
+            b"data", self.data_bytes,
+        )
+
+    def write(self, chunk: bytes):
+        """Append a chunk of interleaved samples in the recorder's format."""
+        if not chunk:
+            return
+        self._file.write(chunk)
+        self.data_bytes += len(chunk)
+        if time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """Flush buffered audio, patch the header sizes and fsync."""
+        if self.encrypted:
+            # The header sits in the first chunk: patch it in one re-encryption
+            self._file.write_at(0, self._header())
+            self._file.sync()
+            self.fsync_count += 1
+            self._last_sync = time.monotonic()
+            return
+        self._file.flush()
+        end = self._file.tell()
+        header = self._header()
+        self._file.seek(RIFF_SIZE_OFFSET)
+        self._file.write(header[RIFF_SIZE_OFFSET:RIFF_SIZE_OFFSET + 4])
+        self._file.seek(FACT_SAMPLES_OFFSET)
+        self._file.write(header[FACT_SAMPLES_OFFSET:FACT_SAMPLES_OFFSET + 4])
+        self._file.seek(DATA_SIZE_OFFSET)
+        self._file.write(header[DATA_SIZE_OFFSET:])
+        self._file.seek(end)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.fsync_count += 1
+        self._last_sync = time.monotonic()
+
+    def close(self) -> Path:
+        """Finalize the header and close the file; returns its path."""
+        if self._file.closed:
+            return self.path
+        self.sync()
+        self._file.close()
+        if self.on_close:
+            self.on_close(self)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,59 +1,532 @@
-import os
 import json
+import sqlite3
+import threading
+import time
+import uuid
 import datetime
 from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from data_management.encryption import (
+    EncryptedFileWriter, EncryptionError, decrypt_value, encrypt_value, generate_key, load_master_key, open_readable,
+)
+from data_management.session_audio import SessionAudio
+from data_management.session_recorder import SessionRecorder
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS interactions (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    session_id TEXT,
+    patient_id TEXT,
+    condition_type TEXT,
+    has_danger_signs INTEGER NOT NULL DEFAULT 0,
+    audio_file TEXT,
+    transcript TEXT,
+    guidance TEXT,
+    context TEXT,
+    key_id TEXT,
+    audio_start REAL,
+    audio_end REAL,
+    synced_at REAL,
+    sync_batch TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_interactions_time ON interactions(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_interactions_condition_time ON interactions(condition_type, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_interactions_patient_time ON interactions(patient_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_interactions_session_time ON interactions(session_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_interactions_danger_time ON interactions(has_danger_signs, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_interactions_audio ON interactions(audio_file);
+CREATE INDEX IF NOT EXISTS idx_interactions_unsynced ON interactions(created_at) WHERE synced_at IS NULL;
+
+-- Flags an interaction can be filtered on: reported danger signs, measurements the guidance found missing
+CREATE TABLE IF NOT EXISTS interaction_flags (
+    interaction_id TEXT NOT NULL REFERENCES interactions(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL COLLATE NOCASE,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (interaction_id, kind, value)
+);
+CREATE INDEX IF NOT EXISTS idx_flags_lookup ON interaction_flags(kind, value, created_at, interaction_id);
+
+-- Per-session data keys, each wrapped (AES-GCM) by the master key
+CREATE TABLE IF NOT EXISTS encryption_keys (
+    key_id TEXT PRIMARY KEY,
+    wrapped_key BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+SCHEMA_VERSION = 5
+
+# Free-text fields encrypted at rest; the indexed columns and flags stay plaintext so queries keep using the indexes
+ENCRYPTED_FIELDS = ('transcript', 'guidance', 'context')
+
+# Flag kinds and the guidance/context keys they are read from
+FLAG_SOURCES = {
+    'danger_sign': (('guidance', 'danger_signs'), ('context', 'danger_signs')),
+    'missing_measurement': (('guidance', 'missing_information'),),
+}
+
+COLUMNS = ('id', 'created_at', 'session_id', 'patient_id', 'condition_type', 'has_danger_signs',
+           'audio_file', 'transcript', 'guidance', 'context', 'key_id', 'audio_start', 'audio_end')
+INSERT_INTERACTION = f"INSERT OR IGNORE INTO interactions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+INSERT_FLAG = "INSERT OR IGNORE INTO interaction_flags (interaction_id, kind, value, created_at) VALUES (?, ?, ?, ?)"
+
 
 class DataStorage:
-    def __init__(self):
-        self.base_dir = Path("data")
+    """
+    Interaction store. Audio goes to data/raw/audio as before; metadata lives in
+    an SQLite database (WAL mode, so the audit and sync jobs can read while the
+    production loop writes) indexed by id, time, condition, patient, session and flags.
+    Queries page by (created_at, id) keysets rather than offsets, so their cost
+    depends on the page size, not on how many interactions are stored.
+
+    With encrypt on (the default), audio files and the transcript, guidance and
+    context fields are encrypted with a per-session key (the session id, or the
+    interaction id for one-off interactions). Session keys are stored wrapped by
+    the master key from BHW_STORAGE_KEY or a key file outside base_dir
+    (BHW_STORAGE_KEY_FILE, by default ~/.config/bhw-assistant/master.key).
+    """
+
+    def __init__(self, base_dir: str = "data", encrypt: bool = True):
+        self.base_dir = Path(base_dir)
         self.raw_dir = self.base_dir / "raw"
         self.processed_dir = self.base_dir / "processed"
-        
+        self.db_path = self.base_dir / "interactions.db"
+        self.encrypt = encrypt
+
         # Ensure directories exist
         self.raw_dir.mkdir(parents=True, exist_ok=True)
         self.processed_dir.mkdir(parents=True, exist_ok=True)
 
-    def store_interaction(self, audio_data, transcript, guidance):
-        """Store a complete interaction including audio, transcript, and guidance."""
-        # Generate timestamp for unique identification
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Store audio data
-        audio_path = self.raw_dir / "audio" / f"interaction_{timestamp}.wav"
-        self._save_audio(audio_data, audio_path)
-        
-        # Store transcript and guidance
-        metadata = {
-            "timestamp": timestamp,
-            "audio_file": str(audio_path),
-            "transcript": transcript,
-            "guidance": guidance
-        }
-        
-        metadata_path = self.processed_dir / "analysis" / f"interaction_{timestamp}.json"
-        self._save_metadata(metadata, metadata_path)
+        self._lock = threading.Lock()
+        # Recordings still being written; background jobs must leave these alone
+        self.active_recordings = set()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._keys: Dict[str, bytes] = {}
+        self._master_key = None
+        if encrypt or self._conn.execute("SELECT 1 FROM encryption_keys LIMIT 1").fetchone():
+            # Also needed to read back data written while encryption was on
+            self._master_key = load_master_key(self.base_dir)
+        self._migrate()
 
-    def _save_audio(self, audio_data, path):
-        """Save audio data to file."""
-        path.parent.mkdir(parents=True, exist_ok=True)
-        with open(path, 'wb') as f:
-            f.write(audio_data)
+    def _migrate(self):
+        """
+        Bring existing data up to SCHEMA_VERSION. The only earlier layout is the
+        file-based store, one JSON metadata file per interaction, which is imported
+        into a new database once; later schema changes add their steps here.
+        """
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0:
+            self._import_json_metadata()
+        self._conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def store_interaction(self, audio_data, transcript, guidance, context=None,
+                          session_id: Optional[str] = None, patient_id: Optional[str] = None,
+                          audio_file: Optional[str] = None, audio_start: Optional[float] = None,
+                          audio_end: Optional[float] = None) -> str:
+        """
+        Store a complete interaction including audio, transcript, and guidance.
+        context holds the facts extracted by the guidance engine (condition type,
+        measurements, topics, ...) so the session can be audited later without an LLM.
+        Audio already streamed by a SessionRecorder is referenced with audio_file
+        instead of passing audio_data; audio_start/audio_end give the turn's span
+        in that recording, in seconds. Returns the interaction id.
+        """
+        return self.store_interactions([{
+            'audio_data': audio_data, 'transcript': transcript, 'guidance': guidance,
+            'context': context, 'session_id': session_id, 'patient_id': patient_id,
+            'audio_file': audio_file, 'audio_start': audio_start, 'audio_end': audio_end,
+        }])[0]
+
+    def open_recording(self, session_id: str, **params) -> SessionRecorder:
+        """Start streaming a session's audio to data/raw/audio/session_<id>.wav."""
+        path = self.raw_dir / "audio" / f"session_{session_id}.wav"
+        self.active_recordings.add(path)
+        if self.encrypt:
+            params.update(key=self.session_key(session_id, create=True), key_id=session_id)
+        return SessionRecorder(path, on_close=lambda recorder: self.active_recordings.discard(recorder.path), **params)
 
-    def _save_metadata(self, metadata, path):
-        """Save metadata to JSON file."""
+    def open_audio(self, path):
+        """Open a stored audio file for reading, decrypting it if it is encrypted."""
+        return open_readable(Path(path), self.session_key)
+
+    def write_audio_file(self, path, data: bytes, key_id: Optional[str] = None):
+        """Write an audio file, encrypted under key_id's session key when encryption is on."""
+        path = Path(path)
         path.parent.mkdir(parents=True, exist_ok=True)
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        if not self.encrypt:
+            with open(path, 'wb') as f:
+                f.write(data)
+            return
+        key_id = key_id or path.stem
+        writer = EncryptedFileWriter(path, self.session_key(key_id, create=True), key_id)
+        writer.write(data)
+        writer.close()
+
+    def session_key(self, key_id: str, create: bool = False) -> bytes:
+        """Unwrapped data key for a session, generated and stored on first use if create is set."""
+        key = self._keys.get(key_id)
+        if key is not None:
+            return key
+        if self._master_key is None:
+            raise EncryptionError(f"No master key available to unwrap the key for '{key_id}'")
+        with self._lock:
+            row = self._conn.execute("SELECT wrapped_key FROM encryption_keys WHERE key_id = ?", (key_id,)).fetchone()
+            if row is None:
+                if not create:
+                    raise EncryptionError(f"No encryption key stored for '{key_id}'")
+                key = generate_key()
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO encryption_keys (key_id, wrapped_key, created_at) VALUES (?, ?, ?)",
+                        (key_id, encrypt_value(self._master_key, key, key_id.encode('utf-8')), time.time())
+                    )
+            else:
+                key = decrypt_value(self._master_key, row['wrapped_key'], key_id.encode('utf-8'))
+        self._keys[key_id] = key
+        return key
+
+    def finished_recordings(self) -> List[Path]:
+        """
+        Session recordings the index knows (WAV files referenced by interactions
+        of a session) that exist and are no longer being recorded to. Other audio
+        in data/raw/audio, such as the file-based store's interaction_*.wav or
+        recordings copied in by hand, is never listed.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT audio_file FROM interactions "
+                "WHERE session_id IS NOT NULL AND audio_file LIKE '%.wav'"
+            ).fetchall()
+        paths = sorted(Path(row['audio_file']) for row in rows)
+        return [path for path in paths if path not in self.active_recordings and path.exists()]
+
+    def replace_audio_file(self, old_path, new_path) -> int:
+        """
+        Point interactions at a re-encoded audio file, or at none if new_path is
+        None (the audio was deleted); returns the number updated.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE interactions SET audio_file = ? WHERE audio_file = ?",
+                (str(new_path) if new_path is not None else None, str(old_path))
+            )
+        return cursor.rowcount
+
+    def turn_index(self, audio_file) -> Dict[str, Tuple[float, float]]:
+        """(start, end) seconds of each turn recorded in an audio file, by interaction id."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, audio_start, audio_end FROM interactions "
+                "WHERE audio_file = ? AND audio_start IS NOT NULL ORDER BY audio_start",
+                (str(audio_file),)
+            ).fetchall()
+        return {row['id']: (row['audio_start'], row['audio_end']) for row in rows}
+
+    def open_session_audio(self, session_id: Optional[str] = None, audio_file=None) -> SessionAudio:
+        """
+        Slicing access to a session's recording (found by session id, or given
+        as audio_file) with its turn index loaded.
+        """
+        if audio_file is None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT audio_file FROM interactions WHERE session_id = ? AND audio_file IS NOT NULL "
+                    "ORDER BY created_at DESC LIMIT 1", (session_id,)
+                ).fetchone()
+            if row is None:
+                raise KeyError(f"No recording stored for session '{session_id}'")
+            audio_file = row['audio_file']
+        return SessionAudio(Path(audio_file), self.turn_index(audio_file), self.session_key)
+
+    def audio_file_summaries(self, after: Optional[str] = None, limit: int = 200) -> List[Dict[str, Any]]:
+        """
+        One entry per referenced audio file, in path order after the given path:
+        the newest interaction using it, whether any of them has danger signs,
+        whether all of them have a stored transcript, and their flags.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT audio_file, MAX(created_at) AS newest, MAX(has_danger_signs) AS danger, "
+                "MIN(transcript IS NOT NULL) AS processed, "
+                "(SELECT GROUP_CONCAT(f.kind || ':' || f.value, char(31)) FROM interaction_flags AS f "
+                " JOIN interactions AS i ON i.id = f.interaction_id WHERE i.audio_file = interactions.audio_file) AS flags "
+                "FROM interactions WHERE audio_file IS NOT NULL AND audio_file > ? "
+                "GROUP BY audio_file ORDER BY audio_file LIMIT ?",
+                (after or "", limit)
+            ).fetchall()
+        return [{
+            'audio_file': row['audio_file'], 'newest': row['newest'], 'danger': bool(row['danger']),
+            'processed': bool(row['processed']),
+            'flags': {tuple(flag.split(':', 1)) for flag in row['flags'].split(chr(31))} if row['flags'] else set(),
+        } for row in rows]
+
+    def store_interactions(self, interactions: Iterable[Dict[str, Any]]) -> List[str]:
+        """
+        Store several interactions in one transaction. Each item has the
+        store_interaction arguments as keys; audio_data may be omitted, and an
+        item that already has an 'id' stored under it is skipped.
+        Returns the interaction ids in order.
+        """
+        rows, flags = [], []
+        for interaction in interactions:
+            created_at = interaction.get('created_at') or time.time()
+            interaction_id = interaction.get('id') or self.new_interaction_id(created_at)
+            audio_file = interaction.get('audio_file')
+            key_id = (interaction.get('session_id') or interaction_id) if self.encrypt else None
+            if interaction.get('audio_data'):
+                audio_path = self.raw_dir / "audio" / f"interaction_{interaction_id}.wav"
+                self.write_audio_file(audio_path, interaction['audio_data'], key_id)
+                audio_file = str(audio_path)
+            row, row_flags = self._row(interaction_id, created_at, audio_file, interaction)
+            if key_id is not None:
+                row = self._encrypt_row(row, key_id)
+            rows.append(row)
+            flags.extend(row_flags)
+
+        with self._lock, self._conn:
+            self._conn.executemany(INSERT_INTERACTION, rows)
+            self._conn.executemany(INSERT_FLAG, flags)
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def new_interaction_id(created_at: float) -> str:
+        """Sortable, collision-free id: microsecond timestamp plus a random suffix."""
+        stamp = datetime.datetime.fromtimestamp(created_at).strftime("%Y%m%d_%H%M%S_%f")
+        return f"{stamp}_{uuid.uuid4().hex[:6]}"
+
+    @staticmethod
+    def _flags(interaction: Dict[str, Any]) -> Dict[str, List[str]]:
+        """Flag values per kind, read from the interaction's guidance and context."""
+        flags = {}
+        for kind, sources in FLAG_SOURCES.items():
+            # Flag values are matched case-insensitively, so de-duplicate the same way
+            values = {}
+            for section, key in sources:
+                for value in (interaction.get(section) or {}).get(key) or []:
+                    if isinstance(value, str):
+                        values.setdefault(value.lower(), value)
+            flags[kind] = list(values.values())
+        return flags
+
+    @classmethod
+    def _row(cls, interaction_id: str, created_at: float, audio_file: Optional[str],
+             interaction: Dict[str, Any]) -> Tuple[tuple, List[tuple]]:
+        """Database row for an interaction, plus its flag rows."""
+        context = interaction.get('context') or {}
+        flags = cls._flags(interaction)
+        row = (
+            interaction_id, created_at, interaction.get('session_id'), interaction.get('patient_id'),
+            context.get('condition_type'), int(bool(flags['danger_sign'])), audio_file,
+            interaction.get('transcript'),
+            json.dumps(interaction.get('guidance'), ensure_ascii=False),
+            json.dumps(interaction.get('context'), ensure_ascii=False),
+            None, interaction.get('audio_start'), interaction.get('audio_end'),
+        )
+        return row, [(interaction_id, kind, value, created_at) for kind, values in flags.items() for value in values]
+
+    def _encrypt_row(self, row: tuple, key_id: str) -> tuple:
+        """Row with its free-text fields encrypted; each is bound to the interaction id and field name."""
+        key = self.session_key(key_id, create=True)
+        values = dict(zip(COLUMNS, row), key_id=key_id)
+        for field in ENCRYPTED_FIELDS:
+            if values[field] is not None:
+                values[field] = encrypt_value(key, values[field].encode('utf-8'), f"{values['id']}:{field}".encode('utf-8'))
+        return tuple(values[column] for column in COLUMNS)
+
+    def _decrypted(self, row: sqlite3.Row) -> Dict[str, Any]:
+        """Free-text fields of a row as plaintext."""
+        values = {field: row[field] for field in ENCRYPTED_FIELDS}
+        if row['key_id'] is not None:
+            key = self.session_key(row['key_id'])
+            for field, value in values.items():
+                if value is not None:
+                    values[field] = decrypt_value(key, value, f"{row['id']}:{field}".encode('utf-8')).decode('utf-8')
+        return values
+
+    def _metadata(self, row: sqlite3.Row) -> Dict[str, Any]:
+        """Metadata dict in the shape the per-interaction JSON files used."""
+        fields = self._decrypted(row)
+        return {
+            "id": row['id'],
+            "timestamp": row['id'],
+            "created_at": row['created_at'],
+            "session_id": row['session_id'],
+            "patient_id": row['patient_id'],
+            "audio_file": row['audio_file'],
+            "audio_start": row['audio_start'],
+            "audio_end": row['audio_end'],
+            "transcript": fields['transcript'],
+            "guidance": json.loads(fields['guidance']) if fields['guidance'] else None,
+            "context": json.loads(fields['context']) if fields['context'] else None,
+        }
 
     def get_interaction(self, timestamp):
-        """Retrieve a stored interaction by timestamp."""
-        audio_path = self.raw_dir / "audio" / f"interaction_{timestamp}.wav"
-        metadata_path = self.processed_dir / "analysis" / f"interaction_{timestamp}.json"
-        
-        if not audio_path.exists() or not metadata_path.exists():
-            return None
-            
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
-            
-        return metadata 
\ No newline at end of file
+        """Retrieve a stored interaction by id (the timestamp for interactions stored as JSON)."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM interactions WHERE id = ?", (str(timestamp),)).fetchone()
+        return self._metadata(row) if row else None
+
+    def query_interactions(self, since: Optional[float] = None, until: Optional[float] = None,
+                           condition_type: Union[str, Sequence[str], None] = None,
+                           patient_id: Optional[str] = None, session_id: Optional[str] = None,
+                           danger_sign: Optional[str] = None, has_danger_signs: Optional[bool] = None,
+                           missing_measurement: Optional[str] = None, synced: Optional[bool] = None,
+                           limit: int = 50, cursor: Optional[str] = None,
+                           newest_first: bool = True) -> Dict[str, Any]:
+        """
+        One page of interactions matching every given filter. since/until are
+        epoch seconds (until exclusive); condition_type may be a list of values;
+        synced selects interactions already uploaded (True) or not yet (False).
+        Pass the returned next_cursor back to get the following page; it is None
+        on the last page. Flag values match case-insensitively.
+        """
+        filters = {
+            'since': since, 'until': until, 'condition_type': condition_type, 'patient_id': patient_id,
+            'session_id': session_id, 'danger_sign': danger_sign, 'has_danger_signs': has_danger_signs,
+            'missing_measurement': missing_measurement, 'synced': synced,
+        }
+        sql, params = self._query_sql(filters, cursor, newest_first, "interactions.*")
+        with self._lock:
+            rows = self._conn.execute(sql, (*params, limit + 1)).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = f"{rows[-1]['created_at']!r}|{rows[-1]['id']}"
+        return {'interactions': [self._metadata(row) for row in rows], 'next_cursor': next_cursor}
+
+    def stream_interactions(self, page_size: int = 500, **filters) -> Iterator[Dict[str, Any]]:
+        """Yield every interaction matching the filters, one page at a time."""
+        cursor = None
+        while True:
+            page = self.query_interactions(limit=page_size, cursor=cursor, **filters)
+            yield from page['interactions']
+            cursor = page['next_cursor']
+            if cursor is None:
+                return
+
+    def find_interactions(self, limit: int = 100, **filters) -> List[str]:
+        """Ids of interactions matching the query_interactions filters, newest first."""
+        sql, params = self._query_sql(filters, None, True, "interactions.id")
+        with self._lock:
+            rows = self._conn.execute(sql, (*params, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_interactions(self, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Yield the metadata of every stored interaction, oldest first."""
+        return self.stream_interactions(page_size=batch_size, newest_first=False)
+
+    @staticmethod
+    def _query_sql(filters: Dict[str, Any], cursor: Optional[str], newest_first: bool,
+                   columns: str) -> Tuple[str, List[Any]]:
+        """
+        SELECT for a filtered, keyset-paginated query. A flag filter drives the
+        query from the flag index (already in time order); otherwise the planner
+        picks the matching (column, created_at, id) index.
+        """
+        unknown = set(filters) - {'since', 'until', 'condition_type', 'patient_id', 'session_id',
+                                  'danger_sign', 'has_danger_signs', 'missing_measurement', 'synced'}
+        if unknown:
+            raise TypeError(f"Unknown interaction filter(s): {', '.join(sorted(unknown))}")
+
+        flag_filters = [(kind, filters[kind]) for kind in ('danger_sign', 'missing_measurement')
+                        if filters.get(kind) is not None]
+        source, time_col, id_col = "interactions", "interactions.created_at", "interactions.id"
+        clauses, params = [], []
+        for i, (kind, value) in enumerate(flag_filters):
+            if i == 0:
+                source = "interaction_flags AS f JOIN interactions ON interactions.id = f.interaction_id"
+                time_col, id_col = "f.created_at", "f.interaction_id"
+                clauses.append("f.kind = ? AND f.value = ?")
+            else:
+                clauses.append("EXISTS (SELECT 1 FROM interaction_flags AS g WHERE g.interaction_id = interactions.id "
+                               "AND g.kind = ? AND g.value = ?)")
+            params.extend((kind, value))
+
+        condition_type = filters.get('condition_type')
+        if condition_type is not None:
+            values = [condition_type] if isinstance(condition_type, str) else list(condition_type)
+            clauses.append(f"interactions.condition_type IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        for column in ('patient_id', 'session_id'):
+            if filters.get(column) is not None:
+                clauses.append(f"interactions.{column} = ?")
+                params.append(filters[column])
+        if filters.get('has_danger_signs') is not None:
+            clauses.append("interactions.has_danger_signs = ?")
+            params.append(int(filters['has_danger_signs']))
+        if filters.get('synced') is not None:
+            clauses.append(f"interactions.synced_at IS {'NOT ' if filters['synced'] else ''}NULL")
+        if filters.get('since') is not None:
+            clauses.append(f"{time_col} >= ?")
+            params.append(filters['since'])
+        if filters.get('until') is not None:
+            clauses.append(f"{time_col} < ?")
+            params.append(filters['until'])
+        if cursor is not None:
+            created_at, interaction_id = cursor.split("|", 1)
+            clauses.append(f"({time_col}, {id_col}) {'<' if newest_first else '>'} (?, ?)")
+            params.extend((float(created_at), interaction_id))
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        direction = "DESC" if newest_first else "ASC"
+        sql = f"SELECT {columns} FROM {source} {where} ORDER BY {time_col} {direction}, {id_col} {direction} LIMIT ?"
+        return sql, params
+
+    def unsynced_groups(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Sessions (or session-less interactions, by id) with interactions not yet
+        uploaded, oldest first: {'session_id', 'interaction_id', 'count', 'audio_files'}.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT session_id, MIN(id) AS interaction_id, COUNT(*) AS count, MIN(created_at) AS oldest, "
+                "GROUP_CONCAT(DISTINCT audio_file) AS audio_files FROM interactions WHERE synced_at IS NULL "
+                "GROUP BY COALESCE(session_id, id) ORDER BY oldest LIMIT ?", (limit,)
+            ).fetchall()
+        return [{
+            'session_id': row['session_id'], 'interaction_id': None if row['session_id'] else row['interaction_id'],
+            'count': row['count'], 'audio_files': row['audio_files'].split(',') if row['audio_files'] else [],
+        } for row in rows]
+
+    def mark_synced(self, interaction_ids: Iterable[str], batch_id: str):
+        """Record that interactions reached the server in the given batch."""
+        synced_at = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE interactions SET synced_at = ?, sync_batch = ? WHERE id = ?",
+                [(synced_at, batch_id, interaction_id) for interaction_id in interaction_ids]
+            )
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def _import_json_metadata(self):
+        """One-time import of interactions stored as per-interaction JSON files."""
+        imported = []
+        for metadata_path in sorted((self.processed_dir / "analysis").glob("interaction_*.json")):
+            try:
+                with open(metadata_path, 'r', encoding='utf-8') as f:
+                    metadata = json.load(f)
+                created_at = datetime.datetime.strptime(metadata['timestamp'], "%Y%m%d_%H%M%S").timestamp()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error importing {metadata_path}: {str(e)}")
+                continue
+            row, flags = self._row(metadata['timestamp'], created_at, metadata.get('audio_file'), metadata)
+            if self.encrypt:
+                row = self._encrypt_row(row, metadata.get('session_id') or metadata['timestamp'])
+            imported.append((row, flags))
+
+        if imported:
+            with self._lock, self._conn:
+                self._conn.executemany(INSERT_INTERACTION, [row for row, _ in imported])
+                self._conn.executemany(INSERT_FLAG, [flag for _, flags in imported for flag in flags])
+            print(f"Imported {len(imported)} interactions from JSON metadata")
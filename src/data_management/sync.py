@@ -0,0 +1,257 @@
+import datetime
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set
+
+import requests
+
+from data_management.encryption import EncryptedFileWriter, open_readable
+
+OUTBOX_KEY_ID = "sync_outbox"
+
+
+class _HashingWriter:
+    """Write-only file object that hashes and counts what passes through it."""
+
+    def __init__(self, target):
+        self.target = target
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        self.target.write(data)
+        return len(data)
+
+    def close(self):
+        self.target.close()
+
+
+class SyncEngine:
+    """
+    Uploads stored sessions to a central server once connectivity returns.
+
+    Sessions that have not been uploaded (interactions with no synced_at) are
+    packed, oldest first, into gzip-compressed tar batches of about
+    batch_bytes: per session an interactions.jsonl and its audio files. Each
+    batch is written to data/sync/outbox (encrypted like the rest of storage)
+    with a JSON manifest, then uploaded in chunk_size pieces. The server
+    reports how much of a batch it already holds, so an interrupted upload -
+    in this run or after a restart - resumes from there instead of starting
+    over. Interactions are marked synced only after the server has verified
+    the whole batch's hash. Sessions still being recorded wait until their
+    recording is closed. Interactions whose audio file is missing are left out
+    of the batch and stay unsynced (the manifest lists the files under
+    missing_audio, and so does self.missing_audio); the next sync() call tries
+    them again.
+
+    max_bytes_per_second caps the upload rate; sync() also stops after
+    time_budget seconds and picks up where it left off on the next call.
+    """
+
+    def __init__(self, storage, server_url: str, batch_bytes: int = 8 * 1024 * 1024,
+                 chunk_size: int = 256 * 1024, max_bytes_per_second: Optional[float] = None,
+                 timeout: float = 30.0, http: Optional[requests.Session] = None):
+        self.storage = storage
+        self.server_url = server_url.rstrip('/')
+        self.batch_bytes = batch_bytes
+        self.chunk_size = chunk_size
+        self.max_bytes_per_second = max_bytes_per_second
+        self.timeout = timeout
+        self.http = http or requests.Session()
+        self.outbox = Path(storage.base_dir) / "sync" / "outbox"
+        self.outbox.mkdir(parents=True, exist_ok=True)
+        # bytes_sent counts every byte put on the wire, including chunks lost to a dropped connection
+        self.stats = {'batches': 0, 'interactions': 0, 'batch_bytes': 0, 'bytes_sent': 0, 'resumed': 0,
+                      'interruptions': 0, 'seconds': 0.0}
+        # Per session: uncompressed bytes packed and its share of the bytes uploaded
+        self.sessions: Dict[str, Dict[str, int]] = {}
+        # Audio files found missing during the last sync(); their interactions were held back
+        self.missing_audio: Set[str] = set()
+        self._next_send = 0.0
+
+    def sync(self, time_budget: Optional[float] = None) -> bool:
+        """Upload pending batches, then everything not yet synced; True once nothing is left."""
+        started = time.monotonic()
+        deadline = None if time_budget is None else started + time_budget
+        self.missing_audio = set()
+        try:
+            for bundle_path in self.outbox.glob("*.tar.gz"):
+                if not bundle_path.with_name(bundle_path.name[:-len(".tar.gz")] + ".json").exists():
+                    bundle_path.unlink()  # crashed while packing: its sessions are still unsynced
+            for manifest_path in sorted(self.outbox.glob("*.json")):
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    if not self._upload(json.load(f), deadline):
+                        return False
+            while deadline is None or time.monotonic() < deadline:
+                held = {str(path) for path in self.storage.active_recordings} | self.missing_audio
+                groups = [group for group in self.storage.unsynced_groups()
+                          if not held.intersection(group['audio_files'])]
+                if not groups:
+                    return True
+                manifest = self._build_batch(groups)
+                if not manifest['interaction_ids']:
+                    # Every session in it was held back
+                    (self.outbox / manifest['bundle']).unlink()
+                    (self.outbox / f"{manifest['batch_id']}.json").unlink()
+                    continue
+                if not self._upload(manifest, deadline):
+                    return False
+            return False
+        except (requests.RequestException, OSError, ValueError) as e:
+            # Offline or the server went away: everything up to the last acknowledged chunk is kept
+            print(f"Sync interrupted: {str(e)}")
+            self.stats['interruptions'] += 1
+            return False
+        finally:
+            self.stats['seconds'] += time.monotonic() - started
+
+    def _build_batch(self, groups: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Pack sessions into a new outbox batch, stopping once it holds about batch_bytes."""
+        created_at = time.time()
+        batch_id = f"{datetime.datetime.fromtimestamp(created_at).strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        bundle_path = self.outbox / f"{batch_id}.tar.gz"
+        if self.storage.encrypt:
+            target = EncryptedFileWriter(bundle_path, self.storage.session_key(OUTBOX_KEY_ID, create=True),
+                                         OUTBOX_KEY_ID)
+        else:
+            target = open(bundle_path, 'wb')
+        writer = _HashingWriter(target)
+
+        interaction_ids, sessions, missing_audio, packed = [], {}, {}, 0
+        with tarfile.open(fileobj=writer, mode='w|gz') as tar:
+            for group in groups:
+                if packed >= self.batch_bytes:
+                    break
+                if group['session_id']:
+                    name = group['session_id']
+                    interactions = list(self.storage.stream_interactions(
+                        session_id=name, synced=False, newest_first=False))
+                else:
+                    name = group['interaction_id']
+                    interactions = [self.storage.get_interaction(name)]
+                missing = [audio_file for audio_file in group['audio_files'] if not Path(audio_file).exists()]
+                if missing:
+                    # Upload the rest; these stay unsynced rather than go without their audio
+                    print(f"Sync: holding back {name}, audio missing: {', '.join(missing)}")
+                    missing_audio[name] = missing
+                    self.missing_audio.update(missing)
+                    interactions = [interaction for interaction in interactions
+                                    if interaction.get('audio_file') not in missing]
+                    if not interactions:
+                        continue
+                metadata = "".join(json.dumps(interaction, ensure_ascii=False) + "\n"
+                                   for interaction in interactions).encode('utf-8')
+                session_bytes = self._add(tar, f"sessions/{name}/interactions.jsonl", metadata)
+                for audio_file in group['audio_files']:
+                    if audio_file in missing:
+                        continue
+                    path = Path(audio_file)
+                    with self.storage.open_audio(path) as f:
+                        session_bytes += self._add(tar, f"sessions/{name}/audio/{path.name}", f)
+                interaction_ids.extend(interaction['id'] for interaction in interactions)
+                sessions[name] = session_bytes
+                packed += session_bytes
+        writer.close()
+
+        manifest = {
+            'batch_id': batch_id, 'bundle': bundle_path.name, 'size': writer.size,
+            'sha256': writer.sha256.hexdigest(), 'created_at': created_at,
+            'interaction_ids': interaction_ids, 'sessions': sessions, 'missing_audio': missing_audio,
+        }
+        manifest_path = self.outbox / f"{batch_id}.json"
+        temp_path = manifest_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, manifest_path)
+        return manifest
+
+    @staticmethod
+    def _add(tar: tarfile.TarFile, name: str, source) -> int:
+        """Add bytes or a seekable file object to the tar stream; returns its size."""
+        info = tarfile.TarInfo(name)
+        info.mtime = int(time.time())
+        if isinstance(source, bytes):
+            info.size = len(source)
+            tar.addfile(info, io.BytesIO(source))
+        else:
+            info.size = source.seek(0, os.SEEK_END)
+            source.seek(0)
+            tar.addfile(info, source)
+        return info.size
+
+    def _throttle(self, size: int):
+        """Pace uploads to max_bytes_per_second."""
+        if not self.max_bytes_per_second:
+            return
+        now = time.monotonic()
+        if self._next_send > now:
+            time.sleep(self._next_send - now)
+            now = self._next_send
+        self._next_send = max(self._next_send, now) + size / self.max_bytes_per_second
+
+    def _upload(self, manifest: Dict[str, Any], deadline: Optional[float]) -> bool:
+        """Send one batch from wherever the server's copy ends; False if the time budget ran out."""
+        batch_id = manifest['batch_id']
+        url = f"{self.server_url}/uploads/{batch_id}"
+        response = self.http.post(f"{self.server_url}/uploads", timeout=self.timeout, json={
+            'upload_id': batch_id, 'size': manifest['size'], 'sha256': manifest['sha256'],
+        })
+        response.raise_for_status()
+        offset = response.json()['offset']
+        self.stats['resumed'] += offset > 0
+
+        bundle_path = self.outbox / manifest['bundle']
+        with open_readable(bundle_path, self.storage.session_key) as bundle:
+            while offset < manifest['size']:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                bundle.seek(offset)
+                chunk = bundle.read(self.chunk_size)
+                self._throttle(len(chunk))
+                self.stats['bytes_sent'] += len(chunk)
+                response = self.http.put(url, data=chunk, timeout=self.timeout,
+                                         headers={'Upload-Offset': str(offset),
+                                                  'Content-Type': 'application/octet-stream'})
+                if response.status_code == 409:
+                    # Out of step (e.g. our previous attempt landed after all): continue from the server's offset
+                    offset = response.json()['offset']
+                    continue
+                response.raise_for_status()
+                offset = response.json()['offset']
+
+        response = self.http.post(f"{url}/complete", timeout=self.timeout)
+        if response.status_code == 422:
+            # The server's copy did not match; it has discarded it and the batch goes again next time
+            raise ValueError(f"Server rejected batch {batch_id}: {response.text}")
+        response.raise_for_status()
+
+        self.storage.mark_synced(manifest['interaction_ids'], batch_id)
+        bundle_path.unlink()
+        (self.outbox / f"{batch_id}.json").unlink()
+
+        self.stats['batches'] += 1
+        self.stats['batch_bytes'] += manifest['size']
+        self.stats['interactions'] += len(manifest['interaction_ids'])
+        packed = sum(manifest['sessions'].values()) or 1
+        for name, session_bytes in manifest['sessions'].items():
+            totals = self.sessions.setdefault(name, {'bytes': 0, 'uploaded_bytes': 0})
+            totals['bytes'] += session_bytes
+            totals['uploaded_bytes'] += round(manifest['size'] * session_bytes / packed)
+        return True
+
+    def report(self) -> str:
+        """Totals for this engine's sync() calls."""
+        stats = self.stats
+        rate = stats['bytes_sent'] / max(stats['seconds'], 1e-9)
+        return (f"Sync: {stats['batches']} batches, {len(self.sessions)} sessions, {stats['interactions']} interactions, "
+                f"{stats['bytes_sent'] / 1e6:.2f} MB sent in {stats['seconds']:.1f}s ({rate / 1e3:.0f} kB/s), "
+                f"{stats['interruptions']} interruptions, {stats['resumed']} uploads resumed")
+
@@ -0,0 +1,285 @@
+import base64
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from data_management.encryption import EncryptionError, decrypt_value, encrypt_value
+from data_management.storage import DataStorage
+
+JOURNAL_KEY_ID = "write_behind_journal"
+
+
+class WriteBehindStorage:
+    """
+    Asynchronous front for DataStorage. store_interaction only appends the
+    record to a journal file and puts it on a bounded queue; a writer thread
+    drains the queue in batches, one SQLite transaction per batch. Journal
+    lines reach the OS before store_interaction returns, so an accepted record
+    survives a crash of the process. A syncer thread fsyncs them in groups every
+    sync_interval seconds (group commit), off the caller's thread; a record is
+    durable against a power cut once that fsync completes, which wait_durable
+    waits for. A power cut can lose what was accepted in the last sync_interval
+    plus one fsync. The journal is replayed on startup,
+    so records accepted before a crash are stored exactly once (ids are
+    assigned up front and inserts skip existing ids), and it is truncated
+    whenever everything in it has been committed.
+
+    When the queue is full, store_interaction blocks until there is room; the
+    time spent blocked is part of the backpressure metrics, which are updated
+    under the journal lock from callers and the writer and syncer threads. Other
+    DataStorage methods pass straight through.
+
+    When the storage encrypts, so does the journal: each line is sealed with a
+    key kept (wrapped) alongside the session keys.
+    """
+
+    def __init__(self, storage: DataStorage, max_queue: int = 1000, batch_size: int = 100,
+                 batch_interval: float = 0.5, sync_interval: float = 0.005):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.sync_interval = sync_interval
+        self.journal_path = storage.base_dir / "write_behind.journal"
+        self._key = storage.session_key(JOURNAL_KEY_ID, create=True) if storage.encrypt else None
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._journal_lock = threading.Lock()
+        # Journal lines written and fsynced so far
+        self._journaled = 0
+        self._synced = 0
+        self._durable = threading.Condition(self._journal_lock)
+        self._idle = threading.Condition()
+        self.metrics = {
+            'enqueued': 0, 'written': 0, 'batches': 0, 'write_errors': 0, 'replayed': 0,
+            'max_depth': 0, 'blocked_puts': 0, 'blocked_seconds': 0.0,
+            'max_enqueue_seconds': 0.0, 'write_seconds': 0.0, 'max_batch_seconds': 0.0,
+            'fsyncs': 0, 'max_fsync_seconds': 0.0, 'max_sync_group': 0,
+        }
+
+        self._replay_journal()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._closed = False
+        self._thread = threading.Thread(target=self._writer, name="write-behind", daemon=True)
+        self._thread.start()
+        self._syncer_thread = threading.Thread(target=self._syncer, name="write-behind-sync", daemon=True)
+        self._syncer_thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def store_interaction(self, audio_data, transcript, guidance, context=None,
+                          session_id: Optional[str] = None, patient_id: Optional[str] = None,
+                          audio_file: Optional[str] = None, audio_start: Optional[float] = None,
+                          audio_end: Optional[float] = None) -> str:
+        """Queue an interaction for storage and return its id without touching the database."""
+        if self._closed:
+            raise RuntimeError("WriteBehindStorage is closed")
+        started = time.perf_counter()
+        created_at = time.time()
+        record = {
+            'id': DataStorage.new_interaction_id(created_at), 'created_at': created_at,
+            'audio_data': audio_data, 'transcript': transcript, 'guidance': guidance,
+            'context': context, 'session_id': session_id, 'patient_id': patient_id,
+            'audio_file': audio_file, 'audio_start': audio_start, 'audio_end': audio_end,
+        }
+        # Snapshot mutable inputs (the guidance engine keeps updating its context)
+        line = self._journal_line(record)
+        record = json.loads(line)
+        record['audio_data'] = audio_data
+
+        if self._key is not None:
+            entry = base64.b64encode(encrypt_value(self._key, line.encode('utf-8'), JOURNAL_KEY_ID.encode())).decode('ascii')
+        else:
+            entry = line
+        with self._durable:
+            self._journal.write(entry + "\n")
+            self._journal.flush()
+            self._journaled += 1
+            self._pending[record['id']] = record
+            self._durable.notify_all()
+
+        blocked_seconds = None
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            blocked = time.perf_counter()
+            self._queue.put(record)
+            blocked_seconds = time.perf_counter() - blocked
+
+        with self._journal_lock:
+            if blocked_seconds is not None:
+                self.metrics['blocked_puts'] += 1
+                self.metrics['blocked_seconds'] += blocked_seconds
+            self.metrics['enqueued'] += 1
+            self.metrics['max_depth'] = max(self.metrics['max_depth'], self._queue.qsize())
+            self.metrics['max_enqueue_seconds'] = max(self.metrics['max_enqueue_seconds'],
+                                                      time.perf_counter() - started)
+        return record['id']
+
+    def wait_durable(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything accepted so far is fsynced to the journal; False on timeout."""
+        with self._durable:
+            target = self._journaled
+            return self._durable.wait_for(lambda: self._synced >= target, timeout)
+
+    def finished_recordings(self) -> List[Path]:
+        """Finished session recordings that no queued interaction still refers to."""
+        with self._journal_lock:
+            referenced = {record.get('audio_file') for record in self._pending.values()}
+        return [path for path in self.storage.finished_recordings() if str(path) not in referenced]
+
+    def replace_audio_file(self, old_path, new_path) -> int:
+        """Repoint stored interactions at new_path; 0 (nothing changed) while any queued one uses old_path."""
+        with self._journal_lock:
+            if any(record.get('audio_file') == str(old_path) for record in self._pending.values()):
+                return 0
+        return self.storage.replace_audio_file(old_path, new_path)
+
+    def get_interaction(self, timestamp):
+        """Retrieve an interaction, including one that is still queued."""
+        record = self._pending.get(str(timestamp))
+        if record is not None:
+            return {key: value for key, value in record.items() if key != 'audio_data'}
+        return self.storage.get_interaction(timestamp)
+
+    @staticmethod
+    def _journal_line(record: Dict[str, Any]) -> str:
+        audio_data = record.get('audio_data')
+        encoded = dict(record, audio_data=base64.b64encode(audio_data).decode('ascii') if audio_data else None)
+        return json.dumps(encoded, ensure_ascii=False)
+
+    def _replay_journal(self):
+        """Store records left in the journal by a previous run that did not shut down cleanly."""
+        if not self.journal_path.exists():
+            return
+        records = []
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    if not line.startswith("{"):
+                        key = self._key or self.storage.session_key(JOURNAL_KEY_ID)
+                        line = decrypt_value(key, base64.b64decode(line), JOURNAL_KEY_ID.encode()).decode('utf-8')
+                    record = json.loads(line)
+                except (json.JSONDecodeError, ValueError, EncryptionError):
+                    continue  # torn final line from the crash
+                if record.get('audio_data'):
+                    record['audio_data'] = base64.b64decode(record['audio_data'])
+                records.append(record)
+        if records:
+            self.storage.store_interactions(records)
+            self.metrics['replayed'] = len(records)
+            print(f"Recovered {len(records)} interactions from the write-behind journal")
+        self.journal_path.unlink()
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        """Block for the first record, then gather more until the batch is full or the interval passes."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _syncer(self):
+        """Fsync journal lines written since the last pass, one fsync per group, until closed."""
+        while True:
+            with self._durable:
+                self._durable.wait_for(lambda: self._journaled > self._synced or self._closed)
+                if self._journaled == self._synced:
+                    return  # closed with everything synced
+                target = self._journaled
+                fd = self._journal.fileno()
+            started = time.perf_counter()
+            os.fsync(fd)
+            elapsed = time.perf_counter() - started
+            with self._durable:
+                self.metrics['fsyncs'] += 1
+                self.metrics['max_fsync_seconds'] = max(self.metrics['max_fsync_seconds'], elapsed)
+                self.metrics['max_sync_group'] = max(self.metrics['max_sync_group'], target - self._synced)
+                self._synced = target
+                self._durable.notify_all()
+            # Let the next group gather
+            time.sleep(self.sync_interval)
+
+    def _writer(self):
+        while True:
+            batch = self._next_batch()
+            stopping = batch[-1] is None
+            records = [r for r in batch if r is not None]
+            if records:
+                self._write(records)
+            with self._journal_lock:
+                # Everything journaled has been committed: start the journal afresh
+                if not self._pending:
+                    self._journal.truncate(0)
+                    self._journal.seek(0)
+            with self._idle:
+                self._idle.notify_all()
+            if stopping:
+                return
+
+    def _write(self, records: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        attempts = 0
+        while True:
+            try:
+                self.storage.store_interactions(records)
+                break
+            except Exception as e:
+                # Records stay journaled and pending; retry rather than lose them, but
+                # don't hang shutdown: the journal is replayed on the next start
+                with self._journal_lock:
+                    self.metrics['write_errors'] += 1
+                attempts += 1
+                print(f"Error writing {len(records)} interactions: {str(e)}")
+                if self._closed and attempts >= 3:
+                    return
+                time.sleep(1.0)
+        elapsed = time.perf_counter() - started
+        with self._journal_lock:
+            for record in records:
+                self._pending.pop(record['id'], None)
+            self.metrics['written'] += len(records)
+            self.metrics['batches'] += 1
+            self.metrics['write_seconds'] += elapsed
+            self.metrics['max_batch_seconds'] = max(self.metrics['max_batch_seconds'], elapsed)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued interaction is committed; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def backpressure(self) -> Dict[str, Any]:
+        """Queue depth plus the accumulated metrics."""
+        with self._journal_lock:
+            return {'depth': self._queue.qsize(), 'pending': len(self._pending), **self.metrics}
+
+    def close(self):
+        """Flush everything, stop the writer and close the underlying storage."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        with self._durable:
+            self._durable.notify_all()
+        self._syncer_thread.join()
+        with self._journal_lock:
+            self._journal.close()
+            if not self._pending:
+                os.remove(self.journal_path)
+        self.storage.close()
@@ -0,0 +1,27 @@
+import argparse
+import numpy as np
+from voice_processing.audio_capture import load_samples
+from voice_processing.diarization import BHW_PROFILE, Diarizer, save_bhw_profile
+
+def main():
+    parser = argparse.ArgumentParser(description="Enroll the BHW's voice so transcripts label them by voice "
+                                                 "rather than as whoever speaks first")
+    parser.add_argument('recordings', nargs='+', help='Recordings of the BHW speaking alone (30 s or more in all)')
+    parser.add_argument('--out', type=str, default=str(BHW_PROFILE), help='Where to save the voice profile')
+    args = parser.parse_args()
+
+    diarizer = Diarizer()
+    profiles = []
+    for path in args.recordings:
+        try:
+            profiles.append(diarizer.enroll(load_samples(path, diarizer.rate)))
+        except Exception as e:
+            print(f"Error enrolling from {path}: {str(e)}")
+    if not profiles:
+        print("No speech to enroll")
+        return
+    save_bhw_profile(np.nanmean(profiles, axis=0), args.out)
+    print(f"Saved the BHW voice profile from {len(profiles)} recording(s) to {args.out}")
+
+if __name__ == "__main__":
+    main()
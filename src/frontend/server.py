@@ -0,0 +1,507 @@
+import asyncio
+import base64
+import bisect
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from real_time_guidance.guidance_engine import GuidanceEngine
+from voice_processing.denoise import SpectralGate
+from voice_processing.pcm import PcmConverter
+from voice_processing.vad import VoiceActivityDetector
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+VAD_RATE = 16000
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+def _percentiles(values) -> Dict[str, float]:
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    return {
+        'count': len(ordered),
+        'p50': ordered[len(ordered) // 2],
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max': ordered[-1]
+    }
+
+
+class WebSocket:
+    """
+    Just enough RFC 6455 over asyncio streams for the guidance protocol: text
+    and binary messages (fragmented or not), ping/pong and the closing
+    handshake; no extensions. Frames from a client are masked and frames
+    from the server are not, as the RFC requires; a peer that breaks that, or
+    sends a fragmented or oversized control frame, is closed with 1002.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, client: bool = False,
+                 max_message: int = 1 << 20):
+        self.reader = reader
+        self.writer = writer
+        self.client = client
+        self.max_message = max_message
+        self.closed = False
+
+    @staticmethod
+    def _unmask(payload: bytes, mask: bytes) -> bytes:
+        # Whole-payload XOR as one big integer: far faster than a Python loop over bytes
+        size = len(payload)
+        key = (mask * (size // 4 + 1))[:size]
+        return (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(size, 'big')
+
+    async def receive(self) -> Tuple[int, bytes]:
+        """The next text or binary message as (opcode, payload); answers pings on the way."""
+        message, opcode = bytearray(), None
+        while True:
+            try:
+                head = await self.reader.readexactly(2)
+                length = head[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await self.reader.readexactly(2), 'big')
+                elif length == 127:
+                    length = int.from_bytes(await self.reader.readexactly(8), 'big')
+                op = head[0] & 0x0F
+                if bool(head[1] & 0x80) == self.client:
+                    await self.close(1002)
+                    raise ConnectionClosed("masked frame from server" if self.client else "unmasked frame from client")
+                if op & 0x8 and (not head[0] & 0x80 or length > 125):
+                    await self.close(1002)
+                    raise ConnectionClosed("fragmented or oversized control frame")
+                if len(message) + length > self.max_message:
+                    await self.close(1009)
+                    raise ConnectionClosed("message too big")
+                mask = await self.reader.readexactly(4) if head[1] & 0x80 else None
+                payload = await self.reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                self.closed = True
+                raise ConnectionClosed(str(e))
+            if mask:
+                payload = self._unmask(payload, mask)
+            if op == OP_PING:
+                await self.send(OP_PONG, payload)
+            elif op == OP_CLOSE:
+                await self.close()
+                raise ConnectionClosed("closed by peer")
+            elif op != OP_PONG:
+                if op != OP_CONTINUATION:
+                    opcode = op
+                message += payload
+                if head[0] & 0x80:
+                    return opcode, bytes(message)
+
+    async def send(self, opcode: int, payload: bytes = b""):
+        """Send one unfragmented frame, waiting while the peer is not reading (transport buffer full)."""
+        if self.closed:
+            raise ConnectionClosed("already closed")
+        header = bytearray([0x80 | opcode])
+        masked = 0x80 if self.client else 0
+        if len(payload) < 126:
+            header.append(masked | len(payload))
+        elif len(payload) < 1 << 16:
+            header.append(masked | 126)
+            header += len(payload).to_bytes(2, 'big')
+        else:
+            header.append(masked | 127)
+            header += len(payload).to_bytes(8, 'big')
+        if self.client:
+            mask = os.urandom(4)
+            header += mask
+            payload = self._unmask(payload, mask) if payload else payload
+        try:
+            self.writer.write(bytes(header) + payload)
+            await self.writer.drain()
+        except ConnectionError as e:
+            self.closed = True
+            raise ConnectionClosed(str(e))
+
+    async def send_json(self, message: Dict[str, Any]):
+        await self.send(OP_TEXT, json.dumps(message, ensure_ascii=False, default=str).encode('utf-8'))
+
+    async def close(self, code: int = 1000):
+        if not self.closed:
+            try:
+                await self.send(OP_CLOSE, code.to_bytes(2, 'big'))
+            except ConnectionClosed:
+                pass
+            self.closed = True
+        self.writer.close()
+
+
+def accept_key(key: str) -> str:
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+
+
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str]]:
+    """Request line and headers (names lowercased) of one HTTP/1.1 request."""
+    head = (await reader.readuntil(b"\r\n\r\n")).decode('latin-1').split("\r\n")
+    method, target, _ = head[0].split(" ", 2)
+    headers = {}
+    for line in head[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+
+async def connect(host: str, port: int, path: str = "/session") -> WebSocket:
+    """Open a client WebSocket to the guidance server (used by the load test and as a reference client)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    writer.write((f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode('ascii'))
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode('latin-1')
+    if " 101 " not in head.split("\r\n")[0] or accept_key(key) not in head:
+        writer.close()
+        raise ConnectionError(f"WebSocket upgrade refused: {head.splitlines()[0]}")
+    return WebSocket(reader, writer, client=True)
+
+
+class ClientSession:
+    """
+    One phone's visit over one WebSocket connection.
+
+    The phone streams binary messages of PCM audio (16-bit by default, at the
+    rate and channel count given when connecting) and finishes with the text
+    message {"type": "end"}. The audio is recorded as sent, converted to
+    16 kHz mono, denoised and split into utterances by VAD on the event loop,
+    in blocks of at least dsp_block seconds (the per-call cost of the DSP
+    dwarfs the per-sample cost at phone chunk sizes); utterances go to the
+    server's shared pipeline for ASR, guidance and storage. The server pushes JSON text messages: "session" on connect,
+    "alert" as soon as a danger sign is heard, "guidance" as it is produced,
+    and "summary" once everything sent has been processed.
+
+    Backpressure is per connection. While max_inflight of this session's
+    utterances are still in the pipeline, the session stops reading its
+    socket, so TCP flow control slows the phone down rather than the server
+    queueing without limit. Outgoing messages wait in a bounded outbox:
+    alerts are never dropped, a newer guidance message replaces one not yet
+    sent, and when the outbox is full of other messages the oldest goes.
+    """
+
+    def __init__(self, server: "GuidanceServer", ws: WebSocket, session_id: str, rate: int, channels: int,
+                 int16: bool):
+        self.server = server
+        self.ws = ws
+        self.session_id = session_id
+        self.rate = rate
+        self.channels = channels
+        self.frame_bytes = channels * (2 if int16 else 4)
+        assistant = server.assistant
+        self.engine = GuidanceEngine(protocol_manager=assistant.guidance_engine.protocol_manager)
+        self.engine.reset_session()
+        self.recorder = assistant.data_storage.open_recording(
+            session_id, rate=rate, channels=channels, sample_width=2 if int16 else 4, is_float=not int16)
+        self.converter = PcmConverter(rate, channels, int16_in=int16, rate_out=VAD_RATE, channels_out=1,
+                                      int16_out=False)
+        self.vad = VoiceActivityDetector(rate=VAD_RATE)
+        self.gate = SpectralGate(rate=VAD_RATE) if assistant.noise_suppression else None
+        self.captured: Dict[float, float] = {}  # captured_at -> utterance end (seconds into the stream)
+        self.arrivals = deque(maxlen=4096)  # (stream seconds received so far, when), for capture times
+        self._block = []
+        self._block_frames = 0
+        self._received = 0
+        self.outbox = deque()
+        self._outbox_ready = asyncio.Event()
+        self._partial = b""
+        self.stats = {'bytes': 0, 'utterances': 0, 'pauses': 0, 'paused_seconds': 0.0,
+                      'coalesced': 0, 'dropped': 0, 'alerts': 0}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        assistant = self.server.assistant
+        assistant.alert_bus.start_session(self.session_id)
+        assistant.pipeline.start_session(
+            self.session_id, self.engine, audio_file=str(self.recorder.path),
+            on_guidance=lambda guidance, request: loop.call_soon_threadsafe(self._guidance, guidance, request),
+            rate=VAD_RATE)
+        self.push({'type': 'session', 'session_id': self.session_id, 'rate': self.rate, 'channels': self.channels})
+        sender = asyncio.create_task(self._send_loop())
+        try:
+            while True:
+                await self._backpressure()
+                opcode, payload = await self.ws.receive()
+                if opcode == OP_BINARY:
+                    await self._audio(payload)
+                elif opcode == OP_TEXT and json.loads(payload).get('type') == 'end':
+                    break
+        except ConnectionClosed:
+            pass  # phone went away: still process what it sent
+        except Exception as e:
+            print(f"Error in session {self.session_id}: {str(e)}")
+        finally:
+            await self._finish()
+            try:
+                # The sender stops once the summary is out (or the phone has gone)
+                await asyncio.wait_for(sender, self.server.send_timeout)
+            except asyncio.TimeoutError:
+                pass
+            await self.ws.close()
+
+    async def _backpressure(self):
+        pipeline = self.server.assistant.pipeline
+        if pipeline.outstanding(self.session_id) >= self.server.max_inflight:
+            self.stats['pauses'] += 1
+            paused = time.perf_counter()
+            await self.server.blocking(pipeline.wait_below, self.session_id, self.server.max_inflight)
+            self.stats['paused_seconds'] += time.perf_counter() - paused
+
+    async def _audio(self, payload: bytes):
+        data = self._partial + payload if self._partial else payload
+        whole = len(data) - len(data) % self.frame_bytes
+        self._partial = data[whole:]
+        if not whole:
+            return
+        data = data[:whole]
+        self.stats['bytes'] += whole
+        self.recorder.write(data)
+        self._received += whole // self.frame_bytes
+        self.arrivals.append((self._received / self.rate, time.perf_counter()))
+        # A copy: the converter reuses its buffer
+        self._block.append(np.frombuffer(self.converter.convert(data), dtype=np.float32).copy())
+        self._block_frames += len(self._block[-1])
+        if self._block_frames >= self.server.dsp_block * VAD_RATE:
+            await self._process_block()
+
+    async def _process_block(self):
+        samples = np.concatenate(self._block) if len(self._block) > 1 else self._block[0]
+        self._block, self._block_frames = [], 0
+        if self.gate:
+            samples = self.gate.process(samples, silence=not self.vad.speaking)
+        for utterance in self.vad.process(samples):
+            await self._submit(utterance)
+
+    def capture_time(self, seconds: float) -> float:
+        """When the chunk holding this stream position arrived (now, if it has not yet)."""
+        index = bisect.bisect_left(self.arrivals, (seconds,))
+        return self.arrivals[index][1] if index < len(self.arrivals) else time.perf_counter()
+
+    async def _submit(self, utterance):
+        captured_at = self.capture_time(utterance.end)
+        self.captured[captured_at] = utterance.end
+        self.stats['utterances'] += 1
+        await self.server.blocking(self.server.assistant.pipeline.submit, self.session_id, utterance, captured_at)
+
+    async def _finish(self):
+        """End of stream: the rest of the audio through VAD, wait for the pipeline, then the summary."""
+        assistant = self.server.assistant
+        try:
+            if self._block:
+                await self._process_block()
+            utterances = self.vad.process(self.gate.flush()) if self.gate else []
+            for utterance in utterances + self.vad.flush():
+                await self._submit(utterance)
+        finally:
+            try:
+                # Drained before the recording counts as finished (and may be compressed)
+                latencies = await self.server.blocking(assistant.pipeline.end_session, self.session_id)
+            finally:
+                self.recorder.close()
+            # Alerts from the last transcripts are delivered before the summary
+            await self.server.blocking(assistant.alert_bus.flush, 5.0)
+            assistant.alert_bus.end_session(self.session_id)
+        self.push({'type': 'summary', 'session_id': self.session_id, 'seconds': self.vad.stats['seconds'],
+                   'utterances': self.stats['utterances'], 'alerts': self.stats['alerts'],
+                   'latency': _percentiles(latencies), 'paused_seconds': self.stats['paused_seconds']})
+
+    def alert(self, alert: Dict[str, Any]):
+        """An alert for this session (on the event loop thread)."""
+        self.stats['alerts'] += 1
+        self.push({'type': 'alert', 'name': alert['name'], 'value': alert.get('value'), 'action': alert.get('action'),
+                   'audio_end': self.captured.get(alert['captured_at']), 'protocol_version': alert.get('protocol_version'),
+                   '_captured_at': alert['captured_at']})
+
+    def _guidance(self, guidance: Dict[str, Any], request: Dict[str, Any]):
+        self.push({'type': 'guidance', 'guidance': guidance, 'audio_start': request['start'],
+                   'audio_end': request['end']})
+
+    def push(self, message: Dict[str, Any]):
+        """Queue a message for the phone, coalescing guidance and shedding all but alerts when full."""
+        if message['type'] == 'guidance':
+            for index, queued in enumerate(self.outbox):
+                if queued['type'] == 'guidance':
+                    self.outbox[index] = message
+                    self.stats['coalesced'] += 1
+                    return
+        if len(self.outbox) >= self.server.max_outbox:
+            for index, queued in enumerate(self.outbox):
+                if queued['type'] not in ('alert', 'summary'):
+                    del self.outbox[index]
+                    self.stats['dropped'] += 1
+                    break
+        self.outbox.append(message)
+        self._outbox_ready.set()
+
+    async def _send_loop(self):
+        try:
+            while True:
+                await self._outbox_ready.wait()
+                self._outbox_ready.clear()
+                while self.outbox:
+                    message = self.outbox.popleft()
+                    captured_at = message.pop('_captured_at', None)
+                    await self.ws.send_json(message)
+                    if captured_at is not None:
+                        self.server.alert_latencies.append(time.perf_counter() - captured_at)
+                    if message['type'] == 'summary':
+                        return
+        except ConnectionClosed:
+            pass
+
+
+class GuidanceServer:
+    """
+    Local guidance service that many BHW phones stream visits to over the
+    LAN, on one asyncio event loop:
+
+        GET /session?rate=16000&channels=1&format=s16   WebSocket, one visit (ClientSession)
+        GET /status                                     JSON: sessions, backpressure, alert latency, pipeline
+
+    Sessions share the assistant's production services: the alert bus, the
+    ASR/guidance/storage pipeline and write-behind storage. Blocking calls
+    into them run on a thread pool so the loop keeps serving other phones.
+
+    Visits are patient data, so the server listens on loopback only unless
+    given another host, and with a token every request must present it, as
+    ?token=... or "Authorization: Bearer ...", or is refused with 401.
+    """
+
+    def __init__(self, assistant, host: str = "127.0.0.1", port: int = 8765, max_sessions: int = 200,
+                 max_inflight: int = 8, max_outbox: int = 64, send_timeout: float = 10.0, dsp_block: float = 0.25,
+                 token: Optional[str] = None):
+        self.assistant = assistant
+        self.host = host
+        self.token = token
+        self.port = port
+        self.max_sessions = max_sessions
+        self.max_inflight = max_inflight
+        self.max_outbox = max_outbox
+        self.send_timeout = send_timeout
+        self.dsp_block = dsp_block
+        self.sessions: Dict[str, ClientSession] = {}
+        self.alert_latencies = deque(maxlen=10000)
+        self.metrics = {'connections': 0, 'rejected': 0, 'peak_sessions': 0, 'bytes': 0, 'utterances': 0,
+                        'pauses': 0, 'paused_seconds': 0.0, 'coalesced': 0, 'dropped': 0, 'alerts': 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_sessions + 4, thread_name_prefix="guidance-server")
+        self._counter = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def blocking(self, function, *args):
+        """Run a call that may block (pipeline backpressure, draining) off the event loop."""
+        return await self._loop.run_in_executor(self._executor, function, *args)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        for alert_type in ('danger_sign', 'vital_out_of_range'):
+            self.assistant.alert_bus.subscribe(
+                alert_type, lambda alert: self._loop.call_soon_threadsafe(self._route_alert, alert))
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve(self, stop: asyncio.Event):
+        """Serve until stop is set, then close gracefully."""
+        await self.start()
+        print(f"Guidance server listening on {self.host}:{self.port}")
+        await stop.wait()
+        print(f"Stopping guidance server: finishing {len(self.sessions)} open sessions...")
+        await self.close()
+
+    async def close(self):
+        """Stop accepting phones and let every open session finish processing what it was sent."""
+        self._server.close()
+        for session in list(self.sessions.values()):
+            await session.ws.close(1001)
+        while self.sessions:
+            await asyncio.sleep(0.05)
+        self._executor.shutdown()
+
+    def _route_alert(self, alert: Dict[str, Any]):
+        session = self.sessions.get(alert.get('session_id'))
+        if session is not None:
+            session.alert(alert)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, target, headers = await read_request(reader)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            writer.close()
+            return
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if not self._authorized(query, headers):
+            return await self._reply(writer, 401, {'error': 'station token required'})
+        if method == 'GET' and url.path == '/status':
+            return await self._reply(writer, 200, self.status())
+        if method != 'GET' or url.path != '/session':
+            return await self._reply(writer, 404, {'error': 'not found'})
+        if headers.get('upgrade', '').lower() != 'websocket' or 'sec-websocket-key' not in headers:
+            return await self._reply(writer, 426, {'error': 'WebSocket upgrade required'})
+        if len(self.sessions) >= self.max_sessions:
+            self.metrics['rejected'] += 1
+            return await self._reply(writer, 503, {'error': 'too many sessions'})
+        try:
+            rate, channels = int(query.get('rate', 16000)), int(query.get('channels', 1))
+            fmt = query.get('format', 's16')
+            if fmt not in ('s16', 'f32') or not 8000 <= rate <= 48000 or channels not in (1, 2):
+                raise ValueError
+        except ValueError:
+            return await self._reply(writer, 400, {'error': 'bad audio format'})
+
+        writer.write((f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept_key(headers['sec-websocket-key'])}\r\n\r\n").encode('ascii'))
+        await writer.drain()
+        self._counter += 1
+        session_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self._counter:04d}"
+        session = ClientSession(self, WebSocket(reader, writer), session_id, rate, channels, fmt == 's16')
+        self.sessions[session_id] = session
+        self.metrics['connections'] += 1
+        self.metrics['peak_sessions'] = max(self.metrics['peak_sessions'], len(self.sessions))
+        try:
+            await session.run()
+        finally:
+            del self.sessions[session_id]
+            for name in ('bytes', 'utterances', 'pauses', 'paused_seconds', 'coalesced', 'dropped', 'alerts'):
+                self.metrics[name] += session.stats[name]
+
+    def _authorized(self, query: Dict[str, str], headers: Dict[str, str]) -> bool:
+        if not self.token:
+            return True
+        presented = query.get('token') or headers.get('authorization', '').removeprefix('Bearer ').strip()
+        return hmac.compare_digest(presented.encode('utf-8'), self.token.encode('utf-8'))
+
+    async def _reply(self, writer: asyncio.StreamWriter, status: int, body: Dict[str, Any]):
+        data = json.dumps(body, default=str).encode('utf-8')
+        reason = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found', 426: 'Upgrade Required',
+                  503: 'Service Unavailable'}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('ascii') + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def status(self) -> Dict[str, Any]:
+        """Server totals (finished sessions) plus the open sessions, alert push latency and pipeline stages."""
+        return {
+            'sessions': len(self.sessions), **self.metrics,
+            'open': {session_id: session.stats for session_id, session in self.sessions.items()},
+            'alert_latency': _percentiles(list(self.alert_latencies)),
+            'pipeline': self.assistant.pipeline.snapshot(),
+            'cpu_seconds': time.process_time()
+        }
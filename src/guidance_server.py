@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+import os
+import signal
+from dotenv import load_dotenv
+from frontend.server import GuidanceServer
+from main import BHWAssistant
+
+async def serve(server):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await server.serve(stop)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve real-time guidance to BHW phones streaming visits over the LAN')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Address to listen on (e.g. 0.0.0.0 for the LAN, which needs a token)')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--max-sessions', type=int, default=200, help='Concurrent visits before new phones are refused')
+    parser.add_argument('--max-inflight', type=int, default=8,
+                        help="Utterances a phone may have in processing before its upload is paused")
+    parser.add_argument('--dsp-block', type=float, default=0.25,
+                        help='Seconds of audio per denoise/VAD pass (larger serves more phones, adds latency)')
+    parser.add_argument('--token', type=str,
+                        help='Shared station token phones must present (default: GUIDANCE_SERVER_TOKEN)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    required_keys = ["OPENAI_API_KEY", "ANTHROPIC_API_KEY"]
+    missing_keys = [key for key in required_keys if not os.getenv(key)]
+    if missing_keys:
+        print(f"Error: Missing required API keys: {', '.join(missing_keys)}")
+        return
+    token = args.token or os.getenv("GUIDANCE_SERVER_TOKEN")
+    if not token and args.host not in ('127.0.0.1', 'localhost', '::1'):
+        print(f"Error: Refusing to serve visits on {args.host} without a station token; set GUIDANCE_SERVER_TOKEN "
+              "or pass --token")
+        return
+
+    assistant = BHWAssistant(mode='production')
+    assistant.setup_directories()
+    server = GuidanceServer(assistant, host=args.host, port=args.port, max_sessions=args.max_sessions,
+                            max_inflight=args.max_inflight, dsp_block=args.dsp_block, token=token)
+    try:
+        asyncio.run(serve(server))
+    finally:
+        assistant.shutdown()
+
+if __name__ == "__main__":
+    main()
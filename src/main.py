@@ -5,26 +5,57 @@ from synthetic.generate_dialogue import DialogueGenerator
 from synthetic.generate_audio import AudioGenerator
 from continuous_analysis.transcribe_analyze import AudioAnalyzer
 from voice_processing.voice_input import VoiceInputProcessor
+from voice_processing.vad import VoiceActivityDetector
+from voice_processing.denoise import SpectralGate, denoised_copy
+from voice_processing.audio_capture import FileSource
+from voice_processing.diarization import diarize_file, load_bhw_profile
 from data_management.storage import DataStorage
+from data_management.write_behind import WriteBehindStorage
+from data_management.audio_compression import AudioCompressor
 from real_time_guidance.guidance_engine import GuidanceEngine
+from real_time_guidance.alert_bus import AlertBus
+from real_time_guidance.pipeline import SessionPipeline
 import json
+import time
+from datetime import datetime
 from pathlib import Path
 from anthropic import Anthropic
 from openai import OpenAI
 
 class BHWAssistant:
-    def __init__(self, mode='synthetic'):
+    def __init__(self, mode='synthetic', data_dir="data"):
         self.mode = mode
-        self.data_storage = DataStorage()
+        # Audio and transcripts are encrypted at rest unless STORAGE_ENCRYPTION=off
+        self.data_storage = DataStorage(data_dir, encrypt=os.getenv("STORAGE_ENCRYPTION", "on") != "off")
         self.analyzer = AudioAnalyzer()
         self.guidance_engine = GuidanceEngine()
+        # Live audio is denoised (spectral gating) ahead of VAD and ASR unless NOISE_SUPPRESSION=off
+        self.noise_suppression = os.getenv("NOISE_SUPPRESSION", "on") != "off"
         
         # Initialize OpenAI and Claude clients
         self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self.claude_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
         
         if mode == 'production':
-            self.voice_processor = VoiceInputProcessor()
+            # Keep database writes off the capture loop
+            self.data_storage = WriteBehindStorage(self.data_storage)
+            # Danger-sign alerts are raised from the transcript stream, apart from full guidance
+            self.alert_bus = AlertBus(self.guidance_engine.protocol_manager)
+            self.alert_bus.subscribe('danger_sign', self._show_alert)
+            self.alert_bus.subscribe('vital_out_of_range', self._show_alert)
+            # Transcription, guidance and storage run on shared worker pools behind each session's capture thread
+            self.pipeline = SessionPipeline(self.analyzer, self.alert_bus, self.data_storage,
+                                            asr_workers=int(os.getenv("ASR_WORKERS", "4")),
+                                            guidance_workers=int(os.getenv("GUIDANCE_WORKERS", "4")),
+                                            # Seconds before provisional guidance is shown (0: wait for the full analysis)
+                                            guidance_deadline=float(os.getenv("GUIDANCE_DEADLINE", "2.0")) or None)
+            # Pick up DOH protocol updates without restarting; running sessions keep their version
+            self.guidance_engine.protocol_manager.watch()
+            # Re-encode finished recordings in the background: flac (lossless), opus (speech) or off
+            codec = os.getenv("AUDIO_CODEC", "flac")
+            self.audio_compressor = AudioCompressor(self.data_storage, codec) if codec != "off" else None
+            if self.audio_compressor:
+                self.audio_compressor.start()
         
     def setup_directories(self):
         """Create necessary data directories."""
@@ -130,39 +161,18 @@ class BHWAssistant:
         
         # 1. Transcribe using OpenAI's Whisper
         print("Transcribing audio...")
-        with open(audio_file_path, 'rb') as audio:
+        with denoised_copy(audio_file_path, self.noise_suppression) as upload, open(upload, 'rb') as audio:
             response = self.openai_client.audio.transcriptions.create(
                 model="whisper-1",
                 file=audio,
                 language="tl",  # ISO code for Tagalog
-                response_format="text",
+                response_format="verbose_json",  # timed segments for speaker labelling
                 prompt="This is a conversation between a Barangay Health Worker and a patient in Tagalog (Tayabas dialect)."
             )
         
-        raw_transcription = str(response)
-        
-        # 2. Use Claude to structure the transcription with speaker labels
+        # 2. Label speakers locally from the audio, and line the timed segments up with them
         print("Adding speaker segmentation...")
-        response = self.claude_client.messages.create(
-            model="claude-3-sonnet-20240229",  # Updated to Claude 3.7 Sonnet
-            max_tokens=4096,
-            messages=[{
-                "role": "user",
-                "content": f"""Please analyze this medical conversation between a Barangay Health Worker (BHW) and a patient.
-Structure it with speaker labels (BHW or Pasiente) based on the context of each statement.
-If there are multiple participants, differentiate them by their roles.
-Make sure to preserve ALL the original Tagalog text exactly as it appears.
-Use this exact format for each line, with no introduction or other text:
-
-BHW: [text spoken by health worker]
-Pasiente: [text spoken by patient]
-
-Here's the conversation:
-{raw_transcription}"""
-            }]
-        )
-        
-        structured_transcription = self._extract_claude_content(response)
+        structured_transcription = diarize_file(audio_file_path, response.segments, profile=load_bhw_profile())
         
         # 3. Translate to English
         print("Translating to English...")
@@ -172,7 +182,7 @@ Here's the conversation:
             messages=[{
                 "role": "user",
                 "content": f"""Translate this Tagalog medical conversation to English.
-Maintain the exact same speaker labels format (BHW: and Pasiente:), with no introduction or other text.
+Maintain the exact same timestamps and speaker labels format ([MM:SS] BHW: and [MM:SS] Pasiente:), with no introduction or other text.
 Make sure to preserve ALL medical terminology accurately.
 
 {structured_transcription}"""
@@ -262,29 +272,112 @@ Initial analysis:
         print(f"- {analysis_path}")
         print(f"- {enhanced_analysis_path}")
 
-    def production_mode(self):
-        """Run the system in production mode with live audio input."""
+    def production_mode(self, source=None):
+        """
+        Run the system in production mode with live audio input, or with a
+        replayed recording as the source (e.g. audio_capture.FileSource).
+        """
         print("\n=== Running in Production Mode ===")
         print("Starting voice input processor...")
-        
+        voice_processor = VoiceInputProcessor(source)
+        session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Live per-stage queue depths and latencies every PIPELINE_METRICS seconds
+        interval = float(os.getenv("PIPELINE_METRICS", "0"))
+        if interval > 0:
+            self.pipeline.monitor(interval)
+        result = self.run_session(voice_processor, session_id)
+        voice_processor.stop()
+        capture = result['capture']
+        if capture:
+            print(f"Capture ({capture['policy']}): {capture['overruns']} overruns "
+                  f"({capture['dropped_seconds']:.2f}s dropped), {capture['underruns']} underruns, "
+                  f"{capture['device_overflows']} device overflows, peak backlog {capture['max_fill_seconds']:.2f}s")
+        if result['denoise']:
+            print(result['denoise'].report())
+        print(result['vad'].report())
+        print(f"Saved {result['recorder'].duration:.0f}s of audio to {result['recorder'].path}")
+        self.shutdown()
+
+    def run_session(self, voice_processor, session_id, guidance_engine=None):
+        """
+        Run one visit through the real-time pipeline until its audio source
+        ends (a replayed recording) or it is interrupted. Several sessions can
+        run at once from different threads, each with its own voice processor
+        and guidance engine. This thread only records, denoises and runs VAD;
+        utterances go on to the shared pipeline, and the session's remaining
+        work is drained before returning. Returns the session's capture and
+        VAD statistics and its latencies: seconds from the last audio of each
+        utterance being captured to its interaction being stored.
+        """
+        guidance_engine = guidance_engine or self.guidance_engine
+        guidance_engine.reset_session()
+        self.alert_bus.start_session(session_id)
+        # One WAV file per session, appended to chunk by chunk
+        recorder = self.data_storage.open_recording(session_id, **voice_processor.recording_params())
+        # Only speech goes to ASR; utterance times line up with the recording
+        vad = VoiceActivityDetector(rate=voice_processor.rate)
+        # The recording keeps the original audio; VAD and ASR hear it denoised (time-aligned, 16 ms later).
+        # Noise is learned while the VAD hears no one speaking.
+        gate = SpectralGate(rate=voice_processor.rate) if self.noise_suppression else None
+        self.pipeline.start_session(session_id, guidance_engine, audio_file=str(recorder.path),
+                                    rate=voice_processor.rate)
+
+        def handle(utterance):
+            captured_at = voice_processor.capture_time(utterance.end) or time.perf_counter()
+            self.pipeline.submit(session_id, utterance, captured_at)
+
         try:
-            while True:
+            while not voice_processor.finished:
                 # Start listening for voice input
-                audio_data = self.voice_processor.listen()
-                
+                audio_data = voice_processor.listen()
+
                 if audio_data:
-                    # Process the audio in real-time
-                    transcript = self.analyzer.process_audio_stream(audio_data)
-                    
-                    # Generate real-time guidance
-                    guidance = self.guidance_engine.generate_guidance(transcript)
-                    
-                    # Store the interaction
-                    self.data_storage.store_interaction(audio_data, transcript, guidance)
-                    
+                    recorder.write(audio_data)
+                    if gate:
+                        audio_data = gate.process(audio_data, silence=not vad.speaking)
+                    for utterance in vad.process(audio_data):
+                        handle(utterance)
+            if gate:
+                for utterance in vad.process(gate.flush()):
+                    handle(utterance)
+            for utterance in vad.flush():
+                handle(utterance)
         except KeyboardInterrupt:
             print("\nStopping voice input processor...")
-            self.voice_processor.stop()
+        finally:
+            voice_processor.stop_recording()
+            try:
+                # Every interaction referencing the recording is handed to storage before it counts as finished
+                latencies = self.pipeline.end_session(session_id)
+                # The visit counts as saved once its journal lines are fsynced
+                self.data_storage.wait_durable()
+            finally:
+                recorder.close()
+            self.alert_bus.end_session(session_id)
+        return {'capture': voice_processor.capture_stats(), 'vad': vad, 'denoise': gate, 'recorder': recorder,
+                'latencies': latencies}
+
+    def shutdown(self):
+        """Stop production mode's background services, flushing what they hold."""
+        # Let queued utterances through every stage before the services behind them close
+        self.pipeline.close()
+        print(self.pipeline.report())
+        if self.audio_compressor:
+            self.audio_compressor.stop()
+            print(self.audio_compressor.report())
+        self.data_storage.close()
+        metrics = self.data_storage.backpressure()
+        print(f"Stored {metrics['written']} interactions in {metrics['batches']} batches "
+              f"(max queue depth {metrics['max_depth']}, blocked {metrics['blocked_seconds']:.2f}s, "
+              f"{metrics['fsyncs']} journal fsyncs)")
+        self.alert_bus.close()
+        self.guidance_engine.protocol_manager.stop_watching()
+
+    def _show_alert(self, alert):
+        """Display a danger-sign or vital-sign alert to the BHW."""
+        detail = f" ({alert['value']})" if alert.get('value') else ""
+        action = f" - {alert['action'].replace('_', ' ')}" if alert.get('action') else ""
+        print(f"\n!!! ALERT: {alert['name'].replace('_', ' ')}{detail}{action} [{alert['latency'] * 1000:.0f} ms]")
 
     def _print_results(self, results):
         """Helper to print analysis results."""
@@ -459,6 +552,10 @@ def main():
                        help='Path to specific transcript file for testing or audio generation')
     parser.add_argument('--all', action='store_true',
                        help='Process all audio files when using real_audio mode')
+    parser.add_argument('--replay', type=str,
+                       help='Drive production mode from a WAV/MP3 recording instead of the microphone')
+    parser.add_argument('--speed', type=float, default=1.0,
+                       help='Replay speed for --replay (0 for as fast as possible)')
     args = parser.parse_args()
 
     # Load environment variables
@@ -489,7 +586,7 @@ def main():
     elif args.mode == 'real_audio':
         assistant.real_audio_mode(process_all=args.all)
     else:  # production mode
-        assistant.production_mode()
+        assistant.production_mode(FileSource(args.replay, speed=args.speed) if args.replay else None)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,383 @@
+import csv
+import re
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from protocols.compiled import CompiledProtocols, humanize, normalize_trimester
+from protocols.measurement_matcher import normalize_text
+from real_time_guidance.local_rules import ACTION_SEVERITY, extract_vital_readings
+
+# Synthetic and recorded transcripts may carry the condition in a header line
+CONDITION_LINE = re.compile(r'Condition Type:\s*(\S+)', re.IGNORECASE)
+
+# Single-valued vital readings are audited per component; blood pressure splits in two
+BLOOD_PRESSURE_COMPONENTS = ('systolic', 'diastolic')
+
+
+class SessionFacts(NamedTuple):
+    """Columnar facts for a batch of sessions; row i of every array is session i."""
+    session_ids: List[str]
+    sources: List[str]             # 'context' if extracted facts were stored, else 'transcript'
+    group_index: np.ndarray        # (S,) index into groups, a (protocol, trimester) requirement key
+    protocol_index: np.ndarray     # (S,) index into protocols
+    measurement_score: np.ndarray  # (S, R) best matcher score per required-measurement vocabulary item
+    topic_covered: np.ndarray      # (S, T) bool, topic vocabulary item covered
+    vital_min: np.ndarray          # (S, C) lowest reading per vital component, NaN if none
+    vital_max: np.ndarray          # (S, C) highest reading per vital component, NaN if none
+
+
+class AdherenceAudit:
+    """
+    Re-check stored interactions against a compiled protocol snapshot without
+    calling the LLM. Session facts are loaded once into arrays; required
+    measurements, education topics and vital thresholds are then evaluated for
+    every session at once, so a protocol change can be audited across the whole
+    archive in seconds.
+
+    Measurements use the local matcher: items it scores as uncertain would go to
+    the LLM during a live session, so here they are counted as missing and
+    reported separately.
+    """
+
+    def __init__(self, compiled: CompiledProtocols):
+        self.compiled = compiled
+        self.matcher = compiled.measurement_matcher
+
+        self.protocols = list(compiled.protocols)
+        for name in self.protocols:
+            compiled.resolve(name)  # loads lazily bundled sections
+        self.groups = sorted((key for key in compiled.requirements if key[0] in self.protocols),
+                             key=lambda key: (key[0], key[1] or ''))
+        self._group_lookup = {key: i for i, key in enumerate(self.groups)}
+
+        self.measurements = list(dict.fromkeys(
+            m for key in self.groups for m in compiled.requirements[key].required_measurements))
+        self.topics = list(dict.fromkeys(
+            t for key in self.groups for t in compiled.requirements[key].education_topics))
+        self._topics_lower = [t.lower() for t in self.topics]
+
+        # Which vocabulary items each group requires
+        self.required_measurements = np.zeros((len(self.groups), len(self.measurements)), dtype=bool)
+        self.required_topics = np.zeros((len(self.groups), len(self.topics)), dtype=bool)
+        measurement_index = {m: i for i, m in enumerate(self.measurements)}
+        topic_index = {t: i for i, t in enumerate(self.topics)}
+        # Vocabulary indices in each group's own order, for reporting missing items as the protocol lists them
+        self._measurement_order: List[List[int]] = []
+        self._topic_order: List[List[int]] = []
+        for g, key in enumerate(self.groups):
+            requirements = compiled.requirements[key]
+            self._measurement_order.append([measurement_index[m] for m in requirements.required_measurements])
+            self._topic_order.append([topic_index[t] for t in requirements.education_topics])
+            self.required_measurements[g, self._measurement_order[g]] = True
+            self.required_topics[g, self._topic_order[g]] = True
+
+        self._compile_vital_rules()
+        self._measurement_scores: Dict[str, np.ndarray] = {}
+        self._topic_matches: Dict[str, np.ndarray] = {}
+
+    def _compile_vital_rules(self):
+        """Lay out normal ranges and alert thresholds as (protocol, component) arrays."""
+        self.components: List[Tuple[str, str]] = []
+        for vital, spec in self.compiled.vital_signs[None].items():
+            if vital == 'blood_pressure':
+                self.components.extend((vital, part) for part in BLOOD_PRESSURE_COMPONENTS)
+            elif 'normal_ranges' in spec or 'alert_thresholds' in spec:
+                self.components.append((vital, 'value'))
+        component_index = {c: i for i, c in enumerate(self.components)}
+
+        shape = (len(self.protocols), len(self.components))
+        self.normal_min = np.full(shape, np.nan)
+        self.normal_max = np.full(shape, np.nan)
+        # One rule per named threshold; a rule fires if any of its components crosses
+        rules: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # Actions ranked most severe first; protocol-specific actions rank after the referral levels
+        self.actions = list(ACTION_SEVERITY) + sorted({
+            threshold.get('action')
+            for name in self.protocols
+            for spec in self.compiled.vital_signs[name].values()
+            for threshold in spec.get('alert_thresholds', {}).values()
+            if threshold.get('action') and threshold.get('action') not in ACTION_SEVERITY
+        })
+        self.no_action = len(self.actions)
+
+        for p, name in enumerate(self.protocols):
+            for vital, spec in self.compiled.vital_signs[name].items():
+                normal = spec.get('normal_ranges', {})
+                if vital == 'blood_pressure':
+                    bounds = [((vital, part), normal.get(part, {})) for part in BLOOD_PRESSURE_COMPONENTS]
+                else:
+                    bounds = [((vital, 'value'), normal.get('adult', normal))]
+                for component, bound in bounds:
+                    if component in component_index and 'min' in bound and 'max' in bound:
+                        self.normal_min[p, component_index[component]] = bound['min']
+                        self.normal_max[p, component_index[component]] = bound['max']
+
+                for threshold_name, threshold in spec.get('alert_thresholds', {}).items():
+                    rule = rules.setdefault((vital, threshold_name), {
+                        'values': np.full(shape, np.nan),
+                        'rank': np.full(len(self.protocols), self.no_action),
+                    })
+                    if vital == 'blood_pressure':
+                        below = 'low' in threshold_name
+                        parts = [(part, threshold[part]) for part in BLOOD_PRESSURE_COMPONENTS if part in threshold]
+                    else:
+                        below = threshold.get('comparison', 'below' if 'low' in threshold_name else 'above') == 'below'
+                        parts = [('value', threshold['value'])] if 'value' in threshold else []
+                    rule['below'] = below
+                    for part, value in parts:
+                        if (vital, part) in component_index:
+                            rule['values'][p, component_index[(vital, part)]] = value
+                    action = threshold.get('action')
+                    rule['rank'][p] = self.actions.index(action) if action in self.actions else self.no_action
+
+        self.vital_rules = list(rules.values())
+
+    def _measurement_row(self, recorded: str) -> np.ndarray:
+        """Matcher score of one recorded measurement against every vocabulary item (cached)."""
+        key = normalize_text(recorded)
+        row = self._measurement_scores.get(key)
+        if row is None:
+            row = np.array([self.matcher.score(m, (key,))[0] for m in self.measurements], dtype=np.float32)
+            self._measurement_scores[key] = row
+        return row
+
+    def _topic_row(self, covered: str) -> np.ndarray:
+        """Vocabulary topics a covered topic counts towards, by the same substring rule as validate_interaction."""
+        key = covered.lower()
+        row = self._topic_matches.get(key)
+        if row is None:
+            row = np.array([key in topic for topic in self._topics_lower], dtype=bool)
+            self._topic_matches[key] = row
+        return row
+
+    def _session_facts(self, interaction: Dict[str, Any]) -> Dict[str, Any]:
+        """Facts for one stored interaction, falling back to the transcript when no context was stored."""
+        transcript = interaction.get('transcript') or ''
+        readings = extract_vital_readings(transcript)
+        context = interaction.get('context')
+        if context:
+            condition_type = context.get('condition_type')
+            trimester = context.get('trimester')
+            measurements = context.get('measurements') or []
+            covered_topics = context.get('covered_topics') or []
+            source = 'context'
+        else:
+            match = CONDITION_LINE.search(transcript)
+            condition_type = match.group(1) if match else None
+            trimester = None
+            measurements = [humanize(vital) for vital in readings]
+            covered_topics = []
+            source = 'transcript'
+
+        protocol = self.compiled.resolve(condition_type)
+        trimester = normalize_trimester(trimester)
+        group = self._group_lookup.get((protocol, trimester), self._group_lookup.get((protocol, None)))
+        return {
+            'protocol': protocol, 'group': group, 'source': source, 'readings': readings,
+            'measurements': [m for m in measurements if isinstance(m, str) and m],
+            'covered_topics': [t for t in covered_topics if isinstance(t, str) and t],
+        }
+
+    def load(self, interactions: Iterable[Dict[str, Any]]) -> SessionFacts:
+        """Extract facts from stored interaction metadata into columnar arrays."""
+        session_ids, sources, groups, protocols = [], [], [], []
+        measurement_sessions, measurement_rows = [], []
+        topic_sessions, topic_rows = [], []
+        reading_sessions, reading_components, reading_values = [], [], []
+        component_index = {c: i for i, c in enumerate(self.components)}
+        protocol_index = {name: i for i, name in enumerate(self.protocols)}
+
+        for s, interaction in enumerate(interactions):
+            facts = self._session_facts(interaction)
+            session_ids.append(str(interaction.get('timestamp', s)))
+            sources.append(facts['source'])
+            groups.append(facts['group'])
+            protocols.append(protocol_index[facts['protocol']])
+            for recorded in facts['measurements']:
+                measurement_sessions.append(s)
+                measurement_rows.append(self._measurement_row(recorded))
+            for covered in facts['covered_topics']:
+                topic_sessions.append(s)
+                topic_rows.append(self._topic_row(covered))
+            for vital, values in facts['readings'].items():
+                for value in values:
+                    parts = zip(BLOOD_PRESSURE_COMPONENTS, value) if vital == 'blood_pressure' else [('value', value)]
+                    for part, reading in parts:
+                        if (vital, part) in component_index:
+                            reading_sessions.append(s)
+                            reading_components.append(component_index[(vital, part)])
+                            reading_values.append(reading)
+
+        count = len(session_ids)
+        measurement_score = np.zeros((count, len(self.measurements)), dtype=np.float32)
+        if measurement_rows:
+            np.maximum.at(measurement_score, np.array(measurement_sessions), np.stack(measurement_rows))
+        topic_covered = np.zeros((count, len(self.topics)), dtype=bool)
+        if topic_rows:
+            np.logical_or.at(topic_covered, np.array(topic_sessions), np.stack(topic_rows))
+
+        vital_min = np.full((count, len(self.components)), np.inf)
+        vital_max = np.full((count, len(self.components)), -np.inf)
+        if reading_values:
+            index = (np.array(reading_sessions), np.array(reading_components))
+            np.minimum.at(vital_min, index, np.array(reading_values))
+            np.maximum.at(vital_max, index, np.array(reading_values))
+        vital_min[np.isinf(vital_min)] = np.nan
+        vital_max[np.isinf(vital_max)] = np.nan
+
+        return SessionFacts(
+            session_ids, sources, np.array(groups, dtype=np.intp), np.array(protocols, dtype=np.intp),
+            measurement_score, topic_covered, vital_min, vital_max
+        )
+
+    def evaluate(self, facts: SessionFacts) -> Dict[str, np.ndarray]:
+        """Evaluate every protocol rule for every session; returns per-session arrays."""
+        required = self.required_measurements[facts.group_index]
+        taken = facts.measurement_score >= self.matcher.match_threshold
+        uncertain = required & ~taken & (facts.measurement_score >= self.matcher.miss_threshold)
+        missing = required & ~taken
+        topics_required = self.required_topics[facts.group_index]
+        topics_missing = topics_required & ~facts.topic_covered
+
+        normal_min = self.normal_min[facts.protocol_index]
+        normal_max = self.normal_max[facts.protocol_index]
+        with np.errstate(invalid='ignore'):
+            out_of_range = (facts.vital_min < normal_min) | (facts.vital_max > normal_max)
+            alert_rank = np.full(len(facts.session_ids), self.no_action)
+            for rule in self.vital_rules:
+                values = rule['values'][facts.protocol_index]
+                crossed = (facts.vital_min <= values) if rule['below'] else (facts.vital_max >= values)
+                fired = crossed.any(axis=1)
+                alert_rank = np.where(fired, np.minimum(alert_rank, rule['rank'][facts.protocol_index]), alert_rank)
+
+        measurements_required = required.sum(axis=1)
+        measurements_missing = missing.sum(axis=1)
+        topics_required_count = topics_required.sum(axis=1)
+        topics_missing_count = topics_missing.sum(axis=1)
+        items_required = measurements_required + topics_required_count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            adherence = np.where(
+                items_required > 0,
+                1.0 - (measurements_missing + topics_missing_count) / np.maximum(items_required, 1),
+                1.0
+            )
+
+        return {
+            'measurements_required': measurements_required,
+            'measurements_missing': missing,
+            'measurements_uncertain': uncertain,
+            'topics_required': topics_required_count,
+            'topics_missing': topics_missing,
+            'adherence': adherence,
+            'fully_adherent': (measurements_missing == 0) & (topics_missing_count == 0),
+            'vitals_out_of_range': out_of_range,
+            'alert_rank': alert_rank,
+        }
+
+    def session_table(self, facts: SessionFacts, results: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+        """One row per session: completion counts, missing items and the most severe alert action."""
+        actions = self.actions + ['']
+        rows = []
+        for s, session_id in enumerate(facts.session_ids):
+            group = facts.group_index[s]
+            protocol, trimester = self.groups[group]
+            missing = results['measurements_missing'][s]
+            topics_missing = results['topics_missing'][s]
+            rows.append({
+                'session': session_id,
+                'protocol': protocol,
+                'trimester': trimester or '',
+                'facts_source': facts.sources[s],
+                'measurements_required': int(results['measurements_required'][s]),
+                'measurements_missing': int(missing.sum()),
+                'measurements_uncertain': int(results['measurements_uncertain'][s].sum()),
+                'topics_required': int(results['topics_required'][s]),
+                'topics_missing': int(topics_missing.sum()),
+                'adherence': round(float(results['adherence'][s]), 3),
+                'vitals_out_of_range': ";".join(
+                    f"{vital}.{part}" if part != 'value' else vital
+                    for (vital, part), flag in zip(self.components, results['vitals_out_of_range'][s]) if flag
+                ),
+                'alert_action': actions[int(results['alert_rank'][s])],
+                'missing_measurements': ";".join(self.measurements[i] for i in self._measurement_order[group] if missing[i]),
+                'missing_topics': ";".join(self.topics[i] for i in self._topic_order[group] if topics_missing[i]),
+            })
+        return rows
+
+    def group_table(self, facts: SessionFacts, results: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+        """Aggregate adherence per (protocol, trimester)."""
+        counts = np.bincount(facts.group_index, minlength=len(self.groups))
+
+        def per_group(values):
+            return np.bincount(facts.group_index, weights=np.asarray(values, dtype=float), minlength=len(self.groups))
+
+        adherence = per_group(results['adherence'])
+        fully_adherent = per_group(results['fully_adherent'])
+        out_of_range = per_group(results['vitals_out_of_range'].any(axis=1))
+        alerted = per_group(results['alert_rank'] < self.no_action)
+        rows = []
+        for g, (protocol, trimester) in enumerate(self.groups):
+            if not counts[g]:
+                continue
+            rows.append({
+                'protocol': protocol,
+                'trimester': trimester or '',
+                'sessions': int(counts[g]),
+                'mean_adherence': round(float(adherence[g] / counts[g]), 3),
+                'fully_adherent_rate': round(float(fully_adherent[g] / counts[g]), 3),
+                'vitals_out_of_range_rate': round(float(out_of_range[g] / counts[g]), 3),
+                'alert_rate': round(float(alerted[g] / counts[g]), 3),
+            })
+        return rows
+
+    def item_table(self, facts: SessionFacts, results: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+        """Miss rate of every required measurement and topic, per (protocol, trimester)."""
+        rows = []
+        for kind, names, required, missing in (
+            ('measurement', self.measurements, self.required_measurements, results['measurements_missing']),
+            ('topic', self.topics, self.required_topics, results['topics_missing']),
+        ):
+            # Sum the missing flags of each group's sessions in one pass
+            missed = np.zeros((len(self.groups), len(names)))
+            np.add.at(missed, facts.group_index, missing)
+            counts = np.bincount(facts.group_index, minlength=len(self.groups))
+            for g, i in zip(*np.nonzero(required & (counts[:, None] > 0))):
+                protocol, trimester = self.groups[g]
+                rows.append({
+                    'protocol': protocol,
+                    'trimester': trimester or '',
+                    'kind': kind,
+                    'item': names[i],
+                    'sessions': int(counts[g]),
+                    'missed': int(missed[g, i]),
+                    'miss_rate': round(float(missed[g, i] / counts[g]), 3),
+                })
+        return rows
+
+    def run(self, interactions: Iterable[Dict[str, Any]], output_dir: Optional[Path] = None) -> Dict[str, Any]:
+        """Audit all interactions and, if output_dir is given, write the three tables as CSV."""
+        facts = self.load(interactions)
+        results = self.evaluate(facts)
+        tables = {
+            'sessions': self.session_table(facts, results),
+            'groups': self.group_table(facts, results),
+            'items': self.item_table(facts, results),
+        }
+        if output_dir is not None:
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            for name, rows in tables.items():
+                write_table(output_dir / f"adherence_{name}.csv", rows)
+        return {'protocol_version': self.compiled.version, **tables}
+
+
+def write_table(path: Path, rows: List[Dict[str, Any]]):
+    """Write a list of dict rows as CSV (header only from the first row)."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if not rows:
+            return
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
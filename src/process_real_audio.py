@@ -3,6 +3,8 @@ from pathlib import Path
 from anthropic import Anthropic
 from openai import OpenAI
 import json
+from voice_processing.denoise import denoised_copy
+from voice_processing.diarization import diarize_file, load_bhw_profile
 
 def extract_claude_content(response):
     """Extract clean text content from Claude's response."""
@@ -18,42 +20,22 @@ def transcribe_audio_with_speaker_segmentation(audio_file_path):
     # Initialize clients
     openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
     claude_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    noise_suppression = os.getenv("NOISE_SUPPRESSION", "on") != "off"
     
-    # 1. Transcribe using OpenAI's Whisper
+    # 1. Transcribe using OpenAI's Whisper (denoised first: background noise makes it invent text)
     print("Transcribing audio...")
-    with open(audio_file_path, 'rb') as audio:
+    with denoised_copy(audio_file_path, noise_suppression) as upload, open(upload, 'rb') as audio:
         response = openai_client.audio.transcriptions.create(
             model="whisper-1",
             file=audio,
             language="tl",  # ISO code for Tagalog
-            response_format="text",
+            response_format="verbose_json",  # timed segments for speaker labelling
             prompt="This is a conversation between a Barangay Health Worker and a patient in Tagalog (Tayabas dialect)."
         )
     
-    raw_transcription = str(response)
-    
-    # 2. Use Claude to structure the transcription with speaker labels
+    # 2. Label speakers locally from the audio, and line the timed segments up with them
     print("Adding speaker segmentation...")
-    response = claude_client.messages.create(
-        model="claude-3-sonnet-20240229",  # Updated to Claude 3.7 Sonnet
-        max_tokens=4096,
-        messages=[{
-            "role": "user",
-            "content": f"""Please analyze this medical conversation between a Barangay Health Worker (BHW) and a patient.
-Structure it with speaker labels (BHW or Pasiente) based on the context of each statement.
-If there are multiple participants, differentiate them by their roles.
-Make sure to preserve ALL the original Tagalog text exactly as it appears.
-Use this exact format for each line, with no introduction or other text:
-
-BHW: [text spoken by health worker]
-Pasiente: [text spoken by patient]
-
-Here's the conversation:
-{raw_transcription}"""
-        }]
-    )
-    
-    structured_transcription = extract_claude_content(response)
+    structured_transcription = diarize_file(audio_file_path, response.segments, profile=load_bhw_profile())
     print("Structuring complete.")
     
     # 3. Translate to English
@@ -64,7 +46,7 @@ Here's the conversation:
         messages=[{
             "role": "user",
             "content": f"""Translate this Tagalog medical conversation to English.
-Maintain the exact same speaker labels format (BHW: and Pasiente:), with no introduction or other text.
+Maintain the exact same timestamps and speaker labels format ([MM:SS] BHW: and [MM:SS] Pasiente:), with no introduction or other text.
 Make sure to preserve ALL medical terminology accurately.
 
 {structured_transcription}"""
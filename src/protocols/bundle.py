@@ -0,0 +1,197 @@
+import json
+import mmap
+import struct
+import zlib
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Any, Iterator, Optional
+
+from protocols.compiled import CompiledProtocols, ProtocolRequirements, PROTOCOL_ALIASES, DEFAULT_PROTOCOL, normalize_condition
+from protocols.measurement_matcher import MeasurementMatcher
+from protocols.schema import validate_protocols
+
+# File layout: MAGIC, header length (uint32), JSON header, then one JSON section per protocol,
+# all UTF-8. The header holds the shared indexes, the sorted names of the definition files it was
+# built from, and each section's [offset, length, crc32], with offsets counted from the end of the
+# header. JSON rather than pickle, so a tampered bundle can at worst fail to load.
+MAGIC = b"BHWPROT2"
+HEADER_LENGTH = struct.Struct("<I")
+
+DEFAULT_BUNDLE_PATH = Path(__file__).parent / "protocols.bundle"
+
+
+class BundleError(Exception):
+    """Raised when a protocol bundle is missing, corrupt, or from another format."""
+
+
+def build_bundle(protocols: Dict[str, Dict[str, Any]], path: Path = DEFAULT_BUNDLE_PATH) -> Path:
+    """
+    Validate and compile the protocol definitions, then write them as one binary
+    bundle whose per-protocol sections can be loaded independently.
+    """
+    errors = validate_protocols(protocols)
+    if errors:
+        raise BundleError("Invalid protocol definitions: " + "; ".join(errors))
+
+    compiled = CompiledProtocols(protocols)
+    sections = {}
+    for name, protocol in protocols.items():
+        sections[name] = _dumps({
+            'protocol': protocol,
+            # [trimester, requirements] pairs: the protocol-wide entry's trimester is None
+            'requirements': [
+                [trimester, list(reqs)] for (protocol_name, trimester), reqs in compiled.requirements.items()
+                if protocol_name == name
+            ],
+            'symptom_guidance': {
+                key: guidance for (protocol_name, key), guidance in compiled.symptom_guidance.items()
+                if protocol_name == name
+            },
+            'danger_sign_terms': compiled.danger_sign_terms.get(name, {}),
+            'vital_signs': compiled.vital_signs.get(name, {}),
+        })
+
+    header = {
+        'version': compiled.version,
+        # Definitions are keyed by file stem, see load_protocol_definitions
+        'sources': sorted(f"{name}.json" for name in protocols),
+        'danger_sign_terms': compiled.danger_sign_terms[None],
+        'vital_signs': compiled.vital_signs[None],
+        'measurement_terms': compiled.measurement_terms,
+        'sections': {},
+    }
+    # Section offsets are relative to the end of the header, whose size is not known yet
+    offset = 0
+    for name, data in sections.items():
+        header['sections'][name] = [offset, len(data), zlib.crc32(data)]
+        offset += len(data)
+    header_bytes = _dumps(header)
+
+    path = Path(path)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header_bytes)))
+        f.write(header_bytes)
+        for data in sections.values():
+            f.write(data)
+    tmp_path.replace(path)
+    return path
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(data: bytes, path: Path, what: str):
+    try:
+        return json.loads(data)
+    except ValueError as e:  # also covers invalid UTF-8
+        raise BundleError(f"Corrupt {what} in {path}: {e}")
+
+
+def _read_header(buffer, path: Path):
+    """Parse a bundle's header from buffer (bytes or an mmap); returns it with the offset of the first section."""
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise BundleError(f"{path} is not a protocol bundle")
+    start = len(MAGIC) + HEADER_LENGTH.size
+    (header_length,) = HEADER_LENGTH.unpack_from(buffer, len(MAGIC))
+    return _loads(buffer[start:start + header_length], path, "header"), start + header_length
+
+
+class _LazyProtocols(Mapping):
+    """Read-only mapping of raw protocol definitions that loads sections on access."""
+
+    def __init__(self, bundle: "BundledProtocols"):
+        self._bundle = bundle
+
+    def __contains__(self, name) -> bool:
+        return name in self._bundle.sections
+
+    def __getitem__(self, name: str) -> Dict[str, Any]:
+        if name not in self._bundle.sections:
+            raise KeyError(name)
+        return self._bundle.load_section(name)['protocol']
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._bundle.sections)
+
+    def __len__(self) -> int:
+        return len(self._bundle.sections)
+
+
+class BundledProtocols(CompiledProtocols):
+    """
+    A CompiledProtocols snapshot read from a prebuilt bundle. The file is
+    memory-mapped; only the header is parsed up front, and each protocol's
+    section is parsed the first time a lookup resolves to it.
+    """
+
+    def __init__(self, path: Path = DEFAULT_BUNDLE_PATH):
+        self.path = Path(path)
+        try:
+            with open(self.path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise BundleError(f"Cannot open protocol bundle {self.path}: {e}")
+
+        header, self._base = _read_header(self._map, self.path)
+
+        self.version = header['version']
+        self.sections = header['sections']
+        self.protocols = _LazyProtocols(self)
+        self.requirements = {}
+        self.symptom_guidance = {}
+        self.danger_sign_terms = {None: header['danger_sign_terms']}
+        self.vital_signs = {None: header['vital_signs']}
+        self.measurement_terms = header['measurement_terms']
+        self.measurement_matcher = MeasurementMatcher(self.measurement_terms)
+        self._loaded: Dict[str, Dict[str, Any]] = {}
+
+    def load_section(self, name: str) -> Dict[str, Any]:
+        """Deserialize one protocol's section (once) and merge it into the indexes."""
+        section = self._loaded.get(name)
+        if section is not None:
+            return section
+
+        offset, length, checksum = self.sections[name]
+        data = self._map[self._base + offset:self._base + offset + length]
+        if zlib.crc32(data) != checksum:
+            raise BundleError(f"Checksum mismatch in section '{name}' of {self.path}")
+        section = _loads(data, self.path, f"section '{name}'")
+
+        for trimester, reqs in section['requirements']:
+            self.requirements[(name, trimester)] = ProtocolRequirements(*reqs)
+        for key, guidance in section['symptom_guidance'].items():
+            self.symptom_guidance[(name, key)] = guidance
+        self.danger_sign_terms[name] = section['danger_sign_terms']
+        self.vital_signs[name] = section['vital_signs']
+        self._loaded[name] = section
+        return section
+
+    def resolve(self, condition_type: Optional[str]) -> str:
+        """Protocol name for a condition type, loading that protocol's section if needed."""
+        name = PROTOCOL_ALIASES.get(normalize_condition(condition_type))
+        name = name if name in self.sections else DEFAULT_PROTOCOL
+        if name not in self._loaded and name in self.sections:
+            self.load_section(name)
+        return name
+
+
+def bundle_is_fresh(path: Path, protocols_dir: Path) -> bool:
+    """
+    True if the bundle exists, was built from exactly the definition files now
+    in protocols_dir (so adding or removing one makes it stale) and is newer
+    than every one of them.
+    """
+    path = Path(path)
+    files = list(Path(protocols_dir).glob("*.json"))
+    try:
+        built = path.stat().st_mtime_ns
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header, _ = _read_header(data, path)
+    except (OSError, ValueError, BundleError, struct.error):
+        return False
+    if header.get('sources') != sorted(f.name for f in files):
+        return False
+    return all(f.stat().st_mtime_ns <= built for f in files)
@@ -0,0 +1,241 @@
+import copy
+import hashlib
+import json
+from typing import Dict, Any, List, Mapping, Optional, NamedTuple, Tuple
+
+from protocols.measurement_matcher import MeasurementMatcher
+
+# Every spelling of a condition type we accept, mapped to its protocol definition
+PROTOCOL_ALIASES = {
+    'prenatal': 'maternal-health',
+    'maternal': 'maternal-health',
+    'maternal-health': 'maternal-health',
+    'pregnancy': 'maternal-health',
+    'communicable': 'communicable-disease',
+    'communicable-disease': 'communicable-disease',
+    'noncommunicable': 'noncommunicable-disease',
+    'non-communicable': 'noncommunicable-disease',
+    'noncommunicable-disease': 'noncommunicable-disease',
+    'non-communicable-disease': 'noncommunicable-disease',
+    'ncd': 'noncommunicable-disease',
+    'basic': 'basic-assessment',
+    'basic-assessment': 'basic-assessment',
+    'vital-signs': 'basic-assessment',
+}
+
+# Protocol used when the condition type is missing or unrecognised
+DEFAULT_PROTOCOL = 'basic-assessment'
+
+TRIMESTERS = ('first', 'second', 'third')
+TRIMESTER_ALIASES = {'1st': 'first', '2nd': 'second', '3rd': 'third', '1': 'first', '2': 'second', '3': 'third'}
+
+
+class ProtocolRequirements(NamedTuple):
+    """What a protocol (optionally for one trimester) asks the BHW to cover."""
+    required_measurements: List[str]
+    education_topics: List[str]
+    danger_signs: List[str]
+
+
+def normalize_condition(condition_type: Optional[str]) -> str:
+    """Lowercase a condition name and unify its separators to hyphens."""
+    return (condition_type or '').strip().lower().replace('_', '-').replace(' ', '-')
+
+
+def normalize_trimester(trimester: Optional[str]) -> Optional[str]:
+    """Reduce free-text like 'Second trimester' or '2nd' to 'first'/'second'/'third'."""
+    if not trimester:
+        return None
+    text = str(trimester).lower()
+    for name in TRIMESTERS:
+        if name in text:
+            return name
+    for alias, name in TRIMESTER_ALIASES.items():
+        if text.startswith(alias):
+            return name
+    return None
+
+
+def normalize_symptom(symptom: str) -> str:
+    """Symptom text as a symptom_guidance key, e.g. 'Back pain' -> 'back_pain'."""
+    return symptom.strip().lower().replace('-', '_').replace(' ', '_')
+
+
+def humanize(key: str) -> str:
+    """Protocol identifiers as display text, e.g. 'blood_pressure' -> 'Blood pressure'."""
+    text = key.replace('_', ' ')
+    return text[:1].upper() + text[1:]
+
+
+def find_sign_entries(node: Any) -> List[Dict[str, Any]]:
+    """Collect every {"sign": ..., "severity": ...} entry nested anywhere in a protocol section."""
+    if isinstance(node, dict):
+        if 'sign' in node and 'severity' in node:
+            return [node]
+        return [entry for value in node.values() for entry in find_sign_entries(value)]
+    if isinstance(node, list):
+        return [entry for value in node for entry in find_sign_entries(value)]
+    return []
+
+
+def _merge(base: Dict[str, Any], overlay: Dict[str, Any]) -> Dict[str, Any]:
+    """Deep-merge overlay onto a copy of base."""
+    merged = copy.deepcopy(base)
+    for key, value in overlay.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+class CompiledProtocols:
+    """
+    Flattened, read-only indexes built once from the raw protocol definitions,
+    so every lookup on the guidance path is a dictionary access:
+    - (protocol, trimester) -> ProtocolRequirements
+    - (protocol, symptom key) -> symptom guidance
+    - danger-sign term (English or Tagalog) -> canonical sign, per protocol
+    - measurement name -> English/Tagalog synonyms
+    - protocol -> vital -> thresholds, with the protocol's modified thresholds applied
+    Returned lists are shared with the index and must not be modified.
+
+    A CompiledProtocols is an immutable snapshot: reloading the definitions
+    builds a new one, so holders of an older snapshot keep a consistent view.
+    """
+
+    def __init__(self, protocols: Dict[str, Dict[str, Any]]):
+        self.protocols = protocols
+        self.version = self._version(protocols)
+        self.requirements: Dict[Tuple[str, Optional[str]], ProtocolRequirements] = {}
+        self.symptom_guidance: Dict[Tuple[str, str], List[str]] = {}
+        self.danger_sign_terms: Dict[Optional[str], Dict[str, str]] = {None: {}}
+        self.vital_signs: Dict[Optional[str], Dict[str, Dict[str, Any]]] = {}
+        self.measurement_terms: Dict[str, List[str]] = {}
+
+        base_vitals = self._base_vitals()
+        self.vital_signs[None] = base_vitals
+        for name, protocol in protocols.items():
+            self._compile_requirements(name, protocol, base_vitals)
+            for symptom_key, guidance in protocol.get('symptom_guidance', {}).items():
+                self.symptom_guidance[(name, normalize_symptom(symptom_key))] = list(guidance)
+            self._compile_danger_sign_terms(name, protocol)
+            self._compile_vitals(name, protocol, base_vitals)
+            for measurement, variants in protocol.get('measurement_terms', {}).items():
+                terms = self.measurement_terms.setdefault(measurement.lower(), [])
+                terms.extend(v.lower() for v in variants if v.lower() not in terms)
+        self.measurement_matcher = MeasurementMatcher(self.measurement_terms)
+
+    def resolve(self, condition_type: Optional[str]) -> str:
+        """Protocol name for a condition type, falling back to basic assessment."""
+        name = PROTOCOL_ALIASES.get(normalize_condition(condition_type))
+        return name if name in self.protocols else DEFAULT_PROTOCOL
+
+    def get_requirements(self, condition_type: Optional[str], trimester: Optional[str] = None) -> ProtocolRequirements:
+        """Requirements for a condition, trimester-specific where the protocol defines them."""
+        name = self.resolve(condition_type)
+        return (self.requirements.get((name, normalize_trimester(trimester)))
+                or self.requirements.get((name, None))
+                or ProtocolRequirements([], [], []))
+
+    def get_symptom_guidance(self, condition_type: Optional[str], symptom: str) -> List[str]:
+        """Protocol advice for one reported symptom, or an empty list."""
+        return self.symptom_guidance.get((self.resolve(condition_type), normalize_symptom(symptom)), [])
+
+    def get_danger_sign_terms(self, condition_type: Optional[str] = None) -> Dict[str, str]:
+        """Lowercase term -> canonical danger sign; all protocols when no condition is given."""
+        if not condition_type:
+            return self.danger_sign_terms[None]
+        return self.danger_sign_terms.get(self.resolve(condition_type), {})
+
+    def get_measurement_terms(self) -> Dict[str, List[str]]:
+        """Lowercase measurement name -> lowercase synonyms, across all protocols."""
+        return self.measurement_terms
+
+    def get_vital_thresholds(self, vital: str, condition_type: Optional[str] = None) -> Dict[str, Any]:
+        """Normal ranges and alert thresholds for a vital, adjusted for the condition's protocol."""
+        return self.get_vital_signs(condition_type).get(normalize_symptom(vital), {})
+
+    def get_vital_signs(self, condition_type: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """All vitals with thresholds, keyed by vital name, for the condition's protocol."""
+        if not condition_type:
+            return self.vital_signs[None]
+        return self.vital_signs.get(self.resolve(condition_type), self.vital_signs[None])
+
+    @staticmethod
+    def _version(protocols: Mapping[str, Dict[str, Any]]) -> str:
+        """Declared protocol version(s) plus a content hash, e.g. '2024.1+3f2a9c1e'."""
+        # Any mapping will do (e.g. a bundle's lazily loaded definitions); json needs a dict
+        protocols = dict(protocols)
+        declared = sorted({str(p['version']) for p in protocols.values() if isinstance(p, dict) and 'version' in p})
+        digest = hashlib.sha256(json.dumps(protocols, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+        return f"{'/'.join(declared) or 'unversioned'}+{digest}"
+
+    def _base_vitals(self) -> Dict[str, Dict[str, Any]]:
+        """Vital-sign and anthropometric specs from the basic assessment protocol."""
+        basic = self.protocols.get('basic-assessment', {})
+        vitals = dict(basic.get('vital_signs', {}))
+        vitals.update(basic.get('anthropometric_measurements', {}))
+        return vitals
+
+    def _compile_requirements(self, name: str, protocol: Dict[str, Any], base_vitals: Dict[str, Dict[str, Any]]):
+        """Index required measurements, education topics and danger signs per trimester."""
+        if 'required_measurements' in protocol:
+            measurements = list(protocol['required_measurements'])
+        elif 'required_assessments' in protocol:
+            measurements = [
+                humanize(m)
+                for assessment in protocol['required_assessments'].values()
+                for m in assessment.get('required_measurements', [])
+            ]
+        else:
+            measurements = [humanize(vital) for vital, spec in base_vitals.items() if spec.get('required')]
+
+        if 'education_topics' in protocol:
+            topics = list(protocol['education_topics'])
+        elif 'prevention_education' in protocol:
+            topics = [
+                humanize(item['topic'])
+                for items in protocol['prevention_education'].values()
+                for item in items if 'topic' in item
+            ]
+        elif 'lifestyle_interventions' in protocol:
+            topics = [humanize(topic) for topic in protocol['lifestyle_interventions']]
+        else:
+            topics = []
+
+        if 'danger_signs' in protocol:
+            signs = list(protocol['danger_signs'])
+        else:
+            signs = list(dict.fromkeys(humanize(e['sign']) for e in find_sign_entries(protocol.get('diseases', {}))))
+
+        self.requirements[(name, None)] = ProtocolRequirements(measurements, topics, signs)
+        for trimester, specific in protocol.get('trimester_specific', {}).items():
+            self.requirements[(name, trimester)] = ProtocolRequirements(
+                list(specific.get('required_measurements', measurements)),
+                list(specific.get('education_topics', topics)),
+                signs
+            )
+
+    def _compile_danger_sign_terms(self, name: str, protocol: Dict[str, Any]):
+        """Index every English and Tagalog danger-sign phrase to its canonical sign."""
+        terms = {}
+        for sign, variants in protocol.get('danger_sign_terms', {}).items():
+            terms[sign.lower()] = sign
+            for variant in variants:
+                terms[variant.lower()] = sign
+        for entry in find_sign_entries(protocol.get('diseases', {})):
+            sign = humanize(entry['sign'])
+            terms[sign.lower()] = sign
+            if entry.get('tagalog'):
+                terms[entry['tagalog'].lower()] = sign
+        self.danger_sign_terms[name] = terms
+        self.danger_sign_terms[None].update(terms)
+
+    def _compile_vitals(self, name: str, protocol: Dict[str, Any], base_vitals: Dict[str, Dict[str, Any]]):
+        """Index vital thresholds, overlaying any protocol-specific modifications."""
+        vitals = dict(base_vitals)
+        for assessment in protocol.get('required_assessments', {}).values():
+            for vital, overlay in assessment.get('modified_thresholds', {}).items():
+                vitals[vital] = _merge(base_vitals.get(vital, {}), overlay)
+        self.vital_signs[name] = vitals
@@ -0,0 +1,100 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple, FrozenSet
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip accents and punctuation, and collapse whitespace."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^a-z0-9'/ ]+", ' ', text)
+    return ' '.join(text.split())
+
+
+def char_ngrams(text: str, n: int = 3) -> FrozenSet[str]:
+    """Character n-grams of a normalized string, padded so short words still match."""
+    padded = f" {text} "
+    if len(padded) <= n:
+        return frozenset([padded])
+    return frozenset(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+def ngram_similarity(a: str, b: str) -> float:
+    """Dice coefficient over character trigrams, 0.0 (disjoint) to 1.0 (identical)."""
+    grams_a, grams_b = char_ngrams(a), char_ngrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+def contains_phrase(text: str, phrase: str) -> bool:
+    """True if phrase appears in text as whole words."""
+    return re.search(r'(?<![a-z0-9])' + re.escape(phrase) + r'(?![a-z0-9])', text) is not None
+
+
+class MeasurementMatcher:
+    """
+    Decides locally whether a required measurement was taken, using the
+    protocol synonym tables (English and Tagalog) plus character-trigram
+    similarity for spellings the tables do not list. Each required item gets
+    a score in [0, 1]; items scoring between the two thresholds are reported
+    as uncertain so the caller can ask the LLM about those pairs only.
+    """
+
+    def __init__(self, measurement_terms: Dict[str, List[str]],
+                 match_threshold: float = 0.75, miss_threshold: float = 0.35):
+        self.match_threshold = match_threshold
+        self.miss_threshold = miss_threshold
+        self.groups = {
+            normalize_text(name): tuple(normalize_text(v) for v in variants)
+            for name, variants in measurement_terms.items()
+        }
+        self._variants = lru_cache(maxsize=1024)(self._variants_uncached)
+        self._score_pair = lru_cache(maxsize=8192)(self._score_pair_uncached)
+
+    def match(self, required: List[str], taken: List[str]) -> Dict[str, Any]:
+        """
+        Compare required measurements with those recorded in the interaction.
+        Returns taken/missing/uncertain lists of required items, plus per-item
+        scores and the recorded measurement that best matched.
+        """
+        normalized_taken = tuple(normalize_text(t) for t in taken if t)
+        result = {'taken': [], 'missing': [], 'uncertain': [], 'scores': {}}
+        for item in required:
+            score, best = self.score(item, normalized_taken)
+            result['scores'][item] = {'score': score, 'matched': best}
+            if score >= self.match_threshold:
+                result['taken'].append(item)
+            elif score < self.miss_threshold:
+                result['missing'].append(item)
+            else:
+                result['uncertain'].append(item)
+        return result
+
+    def score(self, required: str, normalized_taken: Tuple[str, ...]) -> Tuple[float, str]:
+        """Best similarity between one required item and any recorded measurement."""
+        variants = self._variants(normalize_text(required))
+        best_score, best_match = 0.0, ''
+        for taken in normalized_taken:
+            score = self._score_pair(variants, taken)
+            if score > best_score:
+                best_score, best_match = score, taken
+                if score == 1.0:
+                    break
+        return best_score, best_match
+
+    def _variants_uncached(self, required: str) -> Tuple[str, ...]:
+        """The required item plus synonyms of every measurement group it names."""
+        variants = [required]
+        for name, synonyms in self.groups.items():
+            if name == required or contains_phrase(required, name):
+                variants.append(name)
+                variants.extend(synonyms)
+        return tuple(dict.fromkeys(variants))
+
+    def _score_pair_uncached(self, variants: Tuple[str, ...], taken: str) -> float:
+        """1.0 if a known variant is named in the recorded text, else the best trigram similarity."""
+        if any(contains_phrase(taken, v) for v in variants):
+            return 1.0
+        return max(ngram_similarity(v, taken) for v in variants)
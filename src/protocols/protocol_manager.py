@@ -1,9 +1,14 @@
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Optional
-from anthropic import Anthropic
+from typing import Dict, Any, Optional, List
+from protocols.bundle import BundledProtocols, BundleError, DEFAULT_BUNDLE_PATH, bundle_is_fresh
+from protocols.compiled import CompiledProtocols, PROTOCOL_ALIASES, ProtocolRequirements, normalize_condition
+from protocols.schema import validate_protocols
 import os
 import re
+import time
 
 def extract_json_from_text(text: str) -> dict:
     """Extract JSON object from text that might contain other content."""
@@ -16,21 +21,141 @@ def extract_json_from_text(text: str) -> dict:
             pass
     return {}
 
+def load_protocol_definitions(protocols_dir: Path) -> Dict[str, Any]:
+    """Read every protocol JSON file in a directory, keyed by file stem."""
+    protocols = {}
+    for protocol_file in Path(protocols_dir).glob("*.json"):
+        protocol_name = protocol_file.stem
+        with open(protocol_file, 'r', encoding='utf-8') as f:
+            protocols[protocol_name] = json.load(f)
+    return protocols
+
 class ProtocolManager:
-    """Manages loading and accessing BHW protocol definitions."""
+    """
+    Manages loading and accessing BHW protocol definitions.
+
+    The definitions are served from an immutable compiled snapshot. reload()
+    (or the background watcher started by watch()) builds and validates a new
+    snapshot off the request path and swaps it in with a single assignment, so
+    lookups never wait on a reload. Sessions that need a stable view hold on to
+    the snapshot returned by snapshot() and pass it back to validate_interaction.
+
+    At startup a prebuilt bundle (see build_protocol_bundle.py) is used when it
+    is newer than the JSON definitions; it is memory-mapped and each protocol
+    is only deserialized once a lookup needs it.
+    """
     
-    def __init__(self):
-        self.protocols_dir = Path(__file__).parent / "definitions"
-        self.protocols: Dict[str, Any] = {}
-        self._load_all_protocols()
-        self.claude = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    def __init__(self, protocols_dir: Optional[Path] = None, bundle_path: Optional[Path] = None):
+        self.protocols_dir = Path(protocols_dir) if protocols_dir else Path(__file__).parent / "definitions"
+        self.bundle_path = Path(bundle_path) if bundle_path else DEFAULT_BUNDLE_PATH
+        # Indexed view of the definitions used for all per-request lookups
+        self.compiled = self._load_snapshot()
+        self._claude = None
+        # Shared pool for the independent LLM sub-analyses in validate_interaction
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="protocol-analysis")
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._watch_stop = threading.Event()
+        self._watched_state = self._definitions_state()
     
-    def _load_all_protocols(self):
+    @property
+    def claude(self):
+        """Anthropic client, created on first use to keep startup light."""
+        if self._claude is None:
+            from anthropic import Anthropic
+            self._claude = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        return self._claude
+
+    @claude.setter
+    def claude(self, client):
+        self._claude = client
+
+    def _load_snapshot(self) -> CompiledProtocols:
+        """Open the prebuilt bundle if it is up to date, otherwise compile the JSON definitions."""
+        if bundle_is_fresh(self.bundle_path, self.protocols_dir):
+            try:
+                return BundledProtocols(self.bundle_path)
+            except BundleError as e:
+                print(f"Ignoring protocol bundle: {str(e)}")
+        return CompiledProtocols(self._load_all_protocols())
+
+    def _load_all_protocols(self) -> Dict[str, Any]:
         """Load all protocol JSON files from the definitions directory."""
+        return load_protocol_definitions(self.protocols_dir)
+
+    @property
+    def protocols(self) -> Dict[str, Any]:
+        """Raw definitions of the current snapshot."""
+        return self.compiled.protocols
+
+    @property
+    def measurement_matcher(self):
+        """Local measurement matcher of the current snapshot."""
+        return self.compiled.measurement_matcher
+
+    @property
+    def version(self) -> str:
+        """Version stamp of the current snapshot."""
+        return self.compiled.version
+
+    def snapshot(self) -> CompiledProtocols:
+        """The current compiled snapshot; it never changes once handed out."""
+        return self.compiled
+
+    def reload(self) -> bool:
+        """
+        Re-read, validate and compile the definitions, then swap them in.
+        Returns False (keeping the current snapshot) if they fail to load or validate.
+        """
+        with self._reload_lock:
+            try:
+                protocols = self._load_all_protocols()
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Error reloading protocols: {str(e)}")
+                return False
+
+            errors = validate_protocols(protocols)
+            if errors:
+                print(f"Rejected protocol reload: {'; '.join(errors)}")
+                return False
+
+            snapshot = CompiledProtocols(protocols)
+            if snapshot.version != self.compiled.version:
+                self.compiled = snapshot
+                print(f"Loaded protocols version {snapshot.version}")
+            return True
+
+    def watch(self, interval: float = 2.0):
+        """Poll the definitions directory in a background thread and reload on change."""
+        if self._watcher and self._watcher.is_alive():
+            return
+        self._watch_stop.clear()
+        self._watcher = threading.Thread(target=self._watch_loop, args=(interval,), name="protocol-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        """Stop the background definitions watcher."""
+        self._watch_stop.set()
+        if self._watcher:
+            self._watcher.join()
+
+    def _watch_loop(self, interval: float):
+        while not self._watch_stop.wait(interval):
+            state = self._definitions_state()
+            if state != self._watched_state:
+                self._watched_state = state
+                self.reload()
+
+    def _definitions_state(self) -> Dict[str, Any]:
+        """Modification time and size of every definition file, to detect edits."""
+        state = {}
         for protocol_file in self.protocols_dir.glob("*.json"):
-            protocol_name = protocol_file.stem
-            with open(protocol_file, 'r', encoding='utf-8') as f:
-                self.protocols[protocol_name] = json.load(f)
+            try:
+                stat = protocol_file.stat()
+            except OSError:
+                continue
+            state[protocol_file.name] = (stat.st_mtime_ns, stat.st_size)
+        return state
     
     def get_protocol(self, name: str) -> Optional[Dict[str, Any]]:
         """Get a specific protocol by name."""
@@ -56,75 +181,148 @@ class ProtocolManager:
         """Get the non-communicable disease protocol."""
         return self.get_protocol('noncommunicable-disease')
     
-    def get_required_measurements(self, condition_type: str) -> list:
+    def resolve_protocol_name(self, condition_type: Optional[str]) -> str:
+        """Protocol definition name for a condition type (e.g. 'non-communicable' -> 'noncommunicable-disease')."""
+        return self.compiled.resolve(condition_type)
+
+    def get_requirements(self, condition_type: str, trimester: Optional[str] = None) -> ProtocolRequirements:
+        """Required measurements, education topics and danger signs for a condition and trimester."""
+        return self.compiled.get_requirements(condition_type, trimester)
+
+    def get_required_measurements(self, condition_type: str, trimester: Optional[str] = None) -> list:
         """Get required measurements for a specific condition type."""
-        if condition_type == 'prenatal':
-            protocol = self.get_maternal_protocol()
-            if protocol and 'trimester' in protocol:
-                trimester = protocol['trimester'].lower()
-                if trimester in protocol.get('trimester_specific', {}):
-                    return protocol['trimester_specific'][trimester].get('required_measurements', [])
-            return protocol.get('required_measurements', []) if protocol else []
-        elif condition_type == 'communicable':
-            protocol = self.get_communicable_protocol()
-        elif condition_type == 'noncommunicable':
-            protocol = self.get_noncommunicable_protocol()
-        else:
-            protocol = self.get_vital_signs_protocol()
-            
-        return protocol.get('required_measurements', []) if protocol else []
+        return self.compiled.get_requirements(condition_type, trimester).required_measurements
     
     def get_danger_signs(self, condition_type: str) -> list:
         """Get danger signs for a specific condition type."""
-        protocol = self.get_protocol(f"{condition_type}-disease" if condition_type != 'prenatal' else 'maternal-health')
-        return protocol.get('danger_signs', []) if protocol else []
+        return self.compiled.get_requirements(condition_type).danger_signs
     
-    def get_education_topics(self, condition_type: str) -> list:
+    def get_danger_sign_terms(self, condition_type: Optional[str] = None) -> Dict[str, str]:
+        """
+        Map lowercase English/Tagalog danger-sign terms to their canonical sign, for
+        rule-based matching without an LLM. With no condition type, all protocols are used.
+        """
+        return self.compiled.get_danger_sign_terms(condition_type)
+
+    def get_education_topics(self, condition_type: str, trimester: Optional[str] = None) -> list:
         """Get required health education topics for a condition type."""
-        protocol = self.get_protocol(f"{condition_type}-disease" if condition_type != 'prenatal' else 'maternal-health')
-        if protocol and condition_type == 'prenatal' and 'trimester' in protocol:
-            trimester = protocol['trimester'].lower()
-            if trimester in protocol.get('trimester_specific', {}):
-                return protocol['trimester_specific'][trimester].get('education_topics', [])
-        return protocol.get('education_topics', []) if protocol else []
+        return self.compiled.get_requirements(condition_type, trimester).education_topics
+
+    def get_symptom_guidance(self, condition_type: str, symptom: str) -> list:
+        """Get protocol advice for a reported symptom."""
+        return self.compiled.get_symptom_guidance(condition_type, symptom)
+
+    def get_vital_signs(self, condition_type: Optional[str] = None) -> Dict[str, Any]:
+        """Get vital-sign thresholds, with the condition's protocol-specific adjustments."""
+        return self.compiled.get_vital_signs(condition_type)
+
+    def get_vital_thresholds(self, vital: str, condition_type: Optional[str] = None) -> Dict[str, Any]:
+        """Get normal ranges and alert thresholds for one vital sign."""
+        return self.compiled.get_vital_thresholds(vital, condition_type)
     
-    def validate_interaction(self, condition_type: str, interaction_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Validate an interaction against the relevant protocol using LLM-based analysis."""
-        protocol = self.get_protocol(f"{condition_type}-disease" if condition_type != 'prenatal' else 'maternal-health')
-        if not protocol:
-            return {"valid": False, "errors": ["Unknown condition type"]}
+    def validate_interaction(self, condition_type: str, interaction_data: Dict[str, Any],
+                             snapshot: Optional[CompiledProtocols] = None) -> Dict[str, Any]:
+        """
+        Validate an interaction against the relevant protocol using LLM-based analysis.
+        Uses the given protocol snapshot, or the current one if none is given.
+        """
+        compiled = snapshot or self.compiled
+        if PROTOCOL_ALIASES.get(normalize_condition(condition_type)) not in compiled.protocols:
+            return {"valid": False, "errors": ["Unknown condition type"], "protocol_version": compiled.version}
 
         # Get trimester-specific requirements for prenatal care
-        if condition_type == 'prenatal' and 'trimester' in interaction_data:
-            trimester = interaction_data['trimester'].lower()
-            if 'second' in trimester.lower():
-                trimester = 'second'
-            elif 'third' in trimester.lower():
-                trimester = 'third'
-            elif 'first' in trimester.lower():
-                trimester = 'first'
-                
-            if trimester in protocol.get('trimester_specific', {}):
-                trimester_reqs = protocol['trimester_specific'][trimester]
-                required_measurements = trimester_reqs.get('required_measurements', [])
-                education_topics = trimester_reqs.get('education_topics', [])
-            else:
-                required_measurements = protocol.get('required_measurements', [])
-                education_topics = protocol.get('education_topics', [])
-        else:
-            required_measurements = protocol.get('required_measurements', [])
-            education_topics = protocol.get('education_topics', [])
+        requirements = compiled.get_requirements(condition_type, interaction_data.get('trimester'))
+        required_measurements = requirements.required_measurements
+        education_topics = requirements.education_topics
 
         # Get symptom guidance if available
         symptom_guidance = {}
-        if 'symptoms' in interaction_data and 'symptom_guidance' in protocol:
-            for symptom in interaction_data['symptoms']:
-                symptom_key = symptom.lower().replace(' ', '_')
-                if symptom_key in protocol['symptom_guidance']:
-                    symptom_guidance[symptom] = protocol['symptom_guidance'][symptom_key]
-
-        # Ask Claude to analyze measurements and topics
-        measurement_analysis = self.claude.messages.create(
+        for symptom in interaction_data.get('symptoms') or []:
+            guidance = compiled.get_symptom_guidance(condition_type, symptom)
+            if guidance:
+                symptom_guidance[symptom] = guidance
+
+        # Match measurements locally; only low-confidence items go to the LLM
+        started = time.perf_counter()
+        match = compiled.measurement_matcher.match(required_measurements, interaction_data.get('measurements') or [])
+        matching_time = time.perf_counter() - started
+
+        # Run the independent measurement and danger-sign analyses concurrently
+        measurement_future = None
+        if match['uncertain']:
+            measurement_future = self.executor.submit(
+                self._timed, self._analyze_measurements, match['uncertain'], interaction_data
+            )
+        danger_future = self.executor.submit(
+            self._timed, self._analyze_danger_signs, requirements.danger_signs, interaction_data
+        )
+        llm_measurements, measurement_time, measurement_error = (
+            measurement_future.result() if measurement_future else ({}, 0.0, None)
+        )
+        danger_signs, danger_time, danger_error = danger_future.result()
+
+        # Uncertain items the LLM did not confirm as taken are treated as missing
+        confirmed = set(llm_measurements.get('taken', [])) & set(match['uncertain'])
+        taken = set(match['taken']) | confirmed
+        measurements = {
+            'taken': [m for m in required_measurements if m in taken],
+            'missing': [m for m in required_measurements if m not in taken]
+        }
+
+        timings = {
+            "measurement_matching": matching_time,
+            "measurement_analysis": measurement_time,
+            "danger_sign_analysis": danger_time,
+        }
+        errors = [e for e in (measurement_error, danger_error) if e]
+
+        # Generate recommendations based on findings
+        recommendations = []
+
+        # Add symptom-specific guidance
+        for symptom, guidance in symptom_guidance.items():
+            recommendations.extend(guidance)
+
+        # Add recommendations for missing measurements
+        for measurement in measurements.get('missing', []):
+            recommendations.append(f"Schedule follow-up to check {measurement}")
+
+        # Add recommendations for uncovered education topics
+        covered = set(topic.lower() for topic in interaction_data.get('covered_topics', []))
+        missing_topics = []
+        for topic in education_topics:
+            if not any(covered_topic in topic.lower() for covered_topic in covered):
+                missing_topics.append(topic)
+                recommendations.append(f"Discuss {topic} during next visit")
+
+        timings["total"] = time.perf_counter() - started
+
+        result = {
+            "valid": not (errors or measurements.get('missing', []) or missing_topics or danger_signs.get('detected_signs', [])),
+            "missing_measurements": measurements.get('missing', []),
+            "missing_topics": missing_topics,
+            "detected_danger_signs": danger_signs.get('detected_signs', []),
+            "recommendations": recommendations,
+            "measurement_scores": match['scores'],
+            "protocol_version": compiled.version,
+            "timings": timings
+        }
+        if errors:
+            result["errors"] = errors
+        return result
+
+    def _timed(self, analysis, *args):
+        """Run one sub-analysis, returning (result, seconds, error) so a failure stays partial."""
+        started = time.perf_counter()
+        try:
+            return analysis(*args), time.perf_counter() - started, None
+        except Exception as e:
+            print(f"Error during validation: {str(e)}")
+            return {}, time.perf_counter() - started, f"Validation error in {analysis.__name__}: {str(e)}"
+
+    def _analyze_measurements(self, required_measurements: List[str], interaction_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Ask Claude which required measurements were taken and which are missing."""
+        response = self.claude.messages.create(
             model="claude-3-opus-20240229",
             max_tokens=1000,
             messages=[{
@@ -153,9 +351,11 @@ Respond with ONLY a JSON object in this format:
 }}"""
             }]
         )
+        return extract_json_from_text(response.content[0].text)
 
-        # Ask Claude to analyze danger signs
-        danger_analysis = self.claude.messages.create(
+    def _analyze_danger_signs(self, danger_signs: List[str], interaction_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Ask Claude which of the protocol's danger signs appear in the symptoms or risk factors."""
+        response = self.claude.messages.create(
             model="claude-3-opus-20240229",
             max_tokens=1000,
             messages=[{
@@ -173,7 +373,7 @@ For example, these would indicate danger signs:
 Respond with ONLY a JSON object with one key "detected_signs" containing a list of identified danger signs.
 
 Possible danger signs:
-{json.dumps(protocol.get('danger_signs', []), indent=2)}
+{json.dumps(danger_signs, indent=2)}
 
 Patient symptoms:
 {json.dumps(interaction_data.get('symptoms', []), indent=2)}
@@ -182,45 +382,4 @@ Risk factors:
 {json.dumps(interaction_data.get('risk_factors', []), indent=2)}"""
             }]
         )
-
-        try:
-            measurements = extract_json_from_text(measurement_analysis.content[0].text)
-            danger_signs = extract_json_from_text(danger_analysis.content[0].text)
-            
-            # Generate recommendations based on findings
-            recommendations = []
-            
-            # Add symptom-specific guidance
-            for symptom, guidance in symptom_guidance.items():
-                recommendations.extend(guidance)
-            
-            # Add recommendations for missing measurements
-            for measurement in measurements.get('missing', []):
-                recommendations.append(f"Schedule follow-up to check {measurement}")
-            
-            # Add recommendations for uncovered education topics
-            covered = set(topic.lower() for topic in interaction_data.get('covered_topics', []))
-            missing_topics = []
-            for topic in education_topics:
-                if not any(covered_topic in topic.lower() for covered_topic in covered):
-                    missing_topics.append(topic)
-                    recommendations.append(f"Discuss {topic} during next visit")
-            
-            return {
-                "valid": not (measurements.get('missing', []) or missing_topics or danger_signs.get('detected_signs', [])),
-                "missing_measurements": measurements.get('missing', []),
-                "missing_topics": missing_topics,
-                "detected_danger_signs": danger_signs.get('detected_signs', []),
-                "recommendations": recommendations
-            }
-            
-        except Exception as e:
-            print(f"Error during validation: {str(e)}")
-            return {
-                "valid": False,
-                "missing_measurements": [],
-                "missing_topics": [],
-                "detected_danger_signs": [],
-                "recommendations": [],
-                "errors": [f"Validation error: {str(e)}"]
-            } 
\ No newline at end of file
+        return extract_json_from_text(response.content[0].text)
@@ -0,0 +1,81 @@
+from typing import Dict, Any, List
+
+from protocols.compiled import TRIMESTERS
+
+# Definitions every deployment needs; a snapshot missing one is rejected
+REQUIRED_PROTOCOLS = ('basic-assessment', 'maternal-health', 'communicable-disease', 'noncommunicable-disease')
+
+# Top-level keys that must be lists of strings when present
+STRING_LIST_KEYS = ('required_measurements', 'education_topics', 'danger_signs', 'documentation_required')
+
+# Top-level keys that must map a name to a list of strings when present
+TERM_TABLE_KEYS = ('danger_sign_terms', 'measurement_terms', 'symptom_guidance')
+
+
+def _is_string_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _validate_thresholds(where: str, spec: Dict[str, Any]) -> List[str]:
+    """Check a vital's normal ranges and alert thresholds hold numbers."""
+    errors = []
+    normal = spec.get('normal_ranges', {})
+    ranges = [normal] if 'min' in normal or 'max' in normal else [r for r in normal.values() if isinstance(r, dict)]
+    for bounds in ranges:
+        for bound in ('min', 'max'):
+            if bound in bounds and not _is_number(bounds[bound]):
+                errors.append(f"{where}: normal range '{bound}' must be a number")
+    for name, threshold in spec.get('alert_thresholds', {}).items():
+        if not isinstance(threshold, dict):
+            continue
+        for key in ('value', 'systolic', 'diastolic'):
+            if key in threshold and not _is_number(threshold[key]):
+                errors.append(f"{where}: alert threshold '{name}.{key}' must be a number")
+    return errors
+
+
+def validate_protocol(name: str, protocol: Any) -> List[str]:
+    """Structural checks for one protocol definition; returns a list of problems."""
+    if not isinstance(protocol, dict):
+        return [f"{name}: definition must be a JSON object"]
+
+    errors = []
+    for key in STRING_LIST_KEYS:
+        if key in protocol and not _is_string_list(protocol[key]):
+            errors.append(f"{name}: '{key}' must be a list of strings")
+
+    for key in TERM_TABLE_KEYS:
+        table = protocol.get(key, {})
+        if not isinstance(table, dict) or not all(_is_string_list(v) for v in table.values()):
+            errors.append(f"{name}: '{key}' must map names to lists of strings")
+
+    for trimester, specific in protocol.get('trimester_specific', {}).items():
+        if trimester not in TRIMESTERS:
+            errors.append(f"{name}: unknown trimester '{trimester}'")
+        for key in ('required_measurements', 'education_topics'):
+            if key in specific and not _is_string_list(specific[key]):
+                errors.append(f"{name}: trimester_specific.{trimester}.{key} must be a list of strings")
+
+    for section in ('vital_signs', 'anthropometric_measurements'):
+        for vital, spec in protocol.get(section, {}).items():
+            errors.extend(_validate_thresholds(f"{name}: {section}.{vital}", spec))
+
+    for assessment_name, assessment in protocol.get('required_assessments', {}).items():
+        if 'required_measurements' in assessment and not _is_string_list(assessment['required_measurements']):
+            errors.append(f"{name}: required_assessments.{assessment_name}.required_measurements must be a list of strings")
+        for vital, spec in assessment.get('modified_thresholds', {}).items():
+            errors.extend(_validate_thresholds(f"{name}: modified_thresholds.{vital}", spec))
+
+    return errors
+
+
+def validate_protocols(protocols: Dict[str, Any]) -> List[str]:
+    """Validate a full set of protocol definitions before it is compiled and served."""
+    errors = [f"missing protocol definition '{name}'" for name in REQUIRED_PROTOCOLS if name not in protocols]
+    for name, protocol in protocols.items():
+        errors.extend(validate_protocol(name, protocol))
+    return errors
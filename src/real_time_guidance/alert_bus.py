@@ -0,0 +1,182 @@
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Callable
+
+from protocols.protocol_manager import ProtocolManager
+from real_time_guidance.local_rules import detect_danger_signs, detect_vital_alerts
+
+ALERT_TYPES = ('danger_sign', 'vital_out_of_range', 'immediate_referral', 'urgent_referral')
+
+
+class AlertBus:
+    """
+    Publish/subscribe bus for real-time danger-sign alerts.
+
+    Transcript text is pushed in with publish_transcript() and scanned on the
+    bus's own dispatcher thread using local protocol rules only, so alerts
+    never wait on (or slow down) the LLM guidance pipeline. Each alert is
+    delivered once per session to subscribers of its type, and to subscribers
+    of its referral action (e.g. 'immediate_referral').
+    """
+
+    def __init__(self, protocol_manager: Optional[ProtocolManager] = None, latency_window: int = 1000):
+        self.protocol_manager = protocol_manager or ProtocolManager()
+        self.subscribers: Dict[str, Dict[int, Callable[[Dict[str, Any]], None]]] = {t: {} for t in ALERT_TYPES}
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.latencies = deque(maxlen=latency_window)
+        self.metrics = {
+            'transcripts': 0,
+            'alerts_published': 0,
+            'alerts_suppressed': 0
+        }
+        self._tokens = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="alert-bus", daemon=True)
+        self._dispatcher.start()
+
+    def subscribe(self, alert_type: str, callback: Callable[[Dict[str, Any]], None]) -> int:
+        """Register a callback for one alert type; returns a token for unsubscribe()."""
+        if alert_type not in self.subscribers:
+            raise ValueError(f"Unknown alert type: {alert_type}")
+        token = next(self._tokens)
+        with self._lock:
+            self.subscribers[alert_type][token] = callback
+        return token
+
+    def unsubscribe(self, token: int):
+        """Remove a previously registered callback."""
+        with self._lock:
+            for callbacks in self.subscribers.values():
+                callbacks.pop(token, None)
+
+    def start_session(self, session_id: str, condition_type: Optional[str] = None):
+        """
+        Begin tracking a session; alerts are de-duplicated within it and checked
+        against the protocol snapshot that was current when it started.
+        """
+        with self._lock:
+            self.sessions[session_id] = self._new_session(condition_type)
+
+    def set_condition_type(self, session_id: str, condition_type: str):
+        """Narrow danger-sign matching to one protocol once the condition is known."""
+        with self._lock:
+            self.sessions.setdefault(session_id, self._new_session())['condition_type'] = condition_type
+
+    def _new_session(self, condition_type: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            'condition_type': condition_type,
+            'protocols': self.protocol_manager.snapshot(),
+            'seen': set()
+        }
+
+    def end_session(self, session_id: str):
+        """Forget a session's de-duplication state."""
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def publish_transcript(self, session_id: str, text: str, captured_at: Optional[float] = None):
+        """
+        Queue new transcript text for alert detection. captured_at is the
+        time.perf_counter() value when the audio was captured and is used to
+        measure end-to-end alert latency; it defaults to now.
+        """
+        if text:
+            self._queue.put((session_id, text, captured_at or time.perf_counter()))
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until all queued transcript text has been scanned."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def latency_stats(self) -> Dict[str, float]:
+        """Summary of end-to-end alert latency (seconds) over the recent window."""
+        if not self.latencies:
+            return {'count': 0}
+        ordered = sorted(self.latencies)
+        return {
+            'count': len(ordered),
+            'mean': sum(ordered) / len(ordered),
+            'p50': ordered[len(ordered) // 2],
+            'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            'max': ordered[-1]
+        }
+
+    def close(self):
+        """Stop the dispatcher thread after draining queued text."""
+        self._queue.put(None)
+        self._dispatcher.join()
+
+    def _dispatch_loop(self):
+        """Scan queued transcript text and deliver any new alerts."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            session_id, text, captured_at = item
+            try:
+                for alert in self._detect(session_id, text):
+                    self._deliver(alert, captured_at)
+            except Exception as e:
+                print(f"Error detecting alerts: {str(e)}")
+
+    def _detect(self, session_id: str, text: str) -> List[Dict[str, Any]]:
+        """Run the local danger-sign and vital-sign rules over one piece of transcript."""
+        self.metrics['transcripts'] += 1
+        with self._lock:
+            session = self.sessions.setdefault(session_id, self._new_session())
+        condition_type = session.get('condition_type')
+        protocols = session['protocols']
+
+        alerts = []
+        terms = protocols.get_danger_sign_terms(condition_type)
+        for sign in detect_danger_signs(text, terms):
+            alerts.append({
+                'type': 'danger_sign',
+                'name': sign,
+                'action': 'immediate_referral'
+            })
+
+        for hit in detect_vital_alerts(text, protocols.get_vital_signs(condition_type)):
+            alerts.append({
+                'type': 'vital_out_of_range',
+                'name': hit['vital'],
+                'value': hit['value'],
+                'action': hit['action']
+            })
+
+        fresh = []
+        for alert in alerts:
+            key = (alert['type'], alert['name'], alert['action'])
+            if key in session['seen']:
+                self.metrics['alerts_suppressed'] += 1
+                continue
+            session['seen'].add(key)
+            alert['session_id'] = session_id
+            alert['protocol_version'] = protocols.version
+            fresh.append(alert)
+        return fresh
+
+    def _deliver(self, alert: Dict[str, Any], captured_at: float):
+        """Send one alert to its type and action subscribers, recording latency."""
+        with self._lock:
+            callbacks = list(self.subscribers[alert['type']].values())
+            if alert.get('action') in self.subscribers:
+                callbacks += list(self.subscribers[alert['action']].values())
+
+        alert['captured_at'] = captured_at
+        alert['latency'] = time.perf_counter() - captured_at
+        self.latencies.append(alert['latency'])
+        self.metrics['alerts_published'] += 1
+        for callback in callbacks:
+            try:
+                callback(alert)
+            except Exception as e:
+                print(f"Error in alert subscriber: {str(e)}")
@@ -1,9 +1,13 @@
+import copy
 import json
 import os
 import re
-from typing import Dict, Any, List, Tuple
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, List, Tuple, Optional, Callable
 
 from protocols.protocol_manager import ProtocolManager
+from real_time_guidance.local_rules import detect_danger_signs
 from anthropic import Anthropic
 
 def extract_json_from_text(text: str) -> dict:
@@ -23,10 +27,39 @@ class GuidanceEngine:
     measurements. The ProtocolManager encapsulates the logic for referencing official guidelines.
     """
 
-    def __init__(self, mode='production'):
-        self.protocol_manager = ProtocolManager()
+    def __init__(self, mode='production', protocol_manager: Optional[ProtocolManager] = None):
+        # Share one ProtocolManager between engines so a protocol reload reaches all of them
+        self.protocol_manager = protocol_manager or ProtocolManager()
         self.mode = mode
-        # Used to track the relevant context from the latest transcript
+        self.reset_session()
+        self.claude = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))  # LLM instance
+        self.confidence_threshold = 0.8 if mode == 'production' else 0.6
+        # Full LLM analyses run here so a deadline can return before they finish
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="guidance")
+        self.pending_upgrade = None
+        # At most one analysis runs; a request arriving meanwhile waits here, replacing any older one
+        self._upgrade_lock = threading.Condition()
+        self._queued_upgrade: Optional[Dict[str, Any]] = None
+        self._upgrading = False
+        # Tagalog translations keyed by the English guidance they were produced from
+        self.translation_cache: Dict[str, Dict[str, Any]] = {}
+        self.metrics = {
+            'guidance_requests': 0,
+            'deadline_requests': 0,
+            'deadline_hits': 0
+        }
+
+    def reset_session(self):
+        """
+        Start a new interaction: clear the context and pin the current protocol
+        snapshot, so a protocol reload mid-visit does not change the rules this
+        session is checked against.
+        """
+        self.protocols = self.protocol_manager.snapshot()
+        # Analyses still running for the previous session see a different token and are dropped
+        self._session = object()
+        # Used to track the relevant context from the latest transcript. Analyses work on a
+        # copy and swap it in when done, so this dict is never changed while others read it.
         self.current_context = {
             'condition_type': None,
             'measurements': [],
@@ -36,10 +69,10 @@ class GuidanceEngine:
             'trimester': None,
             'danger_signs': []
         }
-        self.claude = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))  # LLM instance
-        self.confidence_threshold = 0.8 if mode == 'production' else 0.6
 
-    def generate_guidance(self, transcript: str, transcript_filename: str = "") -> Dict[str, Any]:
+    def generate_guidance(self, transcript: str, transcript_filename: str = "",
+                          deadline: Optional[float] = None,
+                          on_upgrade: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
         """
         Main entry to produce symptom guidance, protocol suggestions, missing info,
         danger signs, and education topics for the user interface.
@@ -47,37 +80,213 @@ class GuidanceEngine:
          - 'prenatal_' for prenatal
          - 'non-communicable_' for NCD
          - 'communicable_' for communicable diseases
+
+        With a deadline (seconds), the full LLM analysis runs in the background and,
+        if it is not done in time, a provisional result built from local rules is
+        returned instead. Only then is the upgraded guidance passed to on_upgrade
+        (it is also available from self.pending_upgrade) once the analysis completes.
+
+        Analyses do not pile up: a request arriving while one runs waits for it,
+        taking over any request still waiting, so the next analysis is always of
+        the latest transcript and the waiting callers share its result. A result
+        that is already stale when it finishes, or that belongs to a session
+        reset_session has since ended, is not passed to on_upgrade.
         """
-        
+        self.metrics['guidance_requests'] += 1
+        if deadline is None:
+            return self._generate_full_guidance(transcript, transcript_filename)
+
+        self.metrics['deadline_requests'] += 1
+        request = self._request_upgrade(transcript, transcript_filename, on_upgrade)
+        upgrade = request['future']
+        try:
+            return upgrade.result(timeout=deadline)
+        except (FutureTimeoutError, CancelledError):
+            pass
+        with self._upgrade_lock:
+            # The runner sets the result under this lock: either it is done now, or it will deliver it
+            if upgrade.done() and not upgrade.cancelled() and upgrade.exception() is None:
+                return upgrade.result()
+            request['missed'] = True
+        self.metrics['deadline_hits'] += 1
+        return self._generate_provisional_guidance(transcript)
+
+    def _request_upgrade(self, transcript: str, transcript_filename: str,
+                         on_upgrade: Optional[Callable[[Dict[str, Any]], None]]) -> Dict[str, Any]:
+        """Queue a full analysis of transcript, starting the runner if none is active."""
+        with self._upgrade_lock:
+            request = self._queued_upgrade
+            if request is None:
+                request = {'future': Future(), 'missed': False, 'on_upgrade': None}
+                self._queued_upgrade = request
+            # Not started yet: a queued request analyzes the newer transcript instead, for both callers
+            request.update(transcript=transcript, transcript_filename=transcript_filename, session=self._session,
+                           on_upgrade=on_upgrade or request['on_upgrade'])
+            self.pending_upgrade = request['future']
+            start = not self._upgrading
+            self._upgrading = True
+        if start:
+            self.executor.submit(self._run_upgrades)
+        return request
+
+    def _run_upgrades(self):
+        """Analyze queued requests one at a time until none is left waiting."""
+        while True:
+            with self._upgrade_lock:
+                request, self._queued_upgrade = self._queued_upgrade, None
+                if request is None:
+                    self._upgrading = False
+                    self._upgrade_lock.notify_all()
+                    return
+            upgrade = request['future']
+            if request['session'] is not self._session:
+                upgrade.cancel()  # from a visit that has ended
+                continue
+            upgrade.set_running_or_notify_cancel()
+            try:
+                result = self._generate_full_guidance(request['transcript'], request['transcript_filename'],
+                                                      session=request['session'])
+            except Exception as e:
+                print(f"Error in background guidance analysis: {str(e)}")
+                upgrade.set_exception(e)
+                continue
+            with self._upgrade_lock:
+                upgrade.set_result(result)
+                deliver = (request['missed'] and request['on_upgrade'] and self._queued_upgrade is None
+                           and request['session'] is self._session)
+            if deliver:
+                self._deliver_upgrade(result, request['on_upgrade'])
+
+    def wait_for_upgrades(self, timeout: Optional[float] = None) -> bool:
+        """Block until no full analysis is running or queued (so no upgrade is still to come); False on timeout."""
+        with self._upgrade_lock:
+            return self._upgrade_lock.wait_for(lambda: not self._upgrading, timeout)
+
+    def _deliver_upgrade(self, result: Dict[str, Any], on_upgrade: Callable[[Dict[str, Any]], None]):
+        """Pass a finished full analysis to the caller's callback."""
+        try:
+            on_upgrade(result)
+        except Exception as e:
+            print(f"Error delivering upgraded guidance: {str(e)}")
+
+    def _generate_provisional_guidance(self, transcript: str) -> Dict[str, Any]:
+        """
+        Build guidance from local rules only: danger-sign terms reported in the
+        transcript, required measurements the local matcher cannot find, protocol symptom
+        guidance, and translations that are already cached. The lines are those
+        validate_interaction recommends, so a translation cached by a full analysis of
+        the same findings is found here.
+        """
+        context = self.current_context
+        condition_type = context['condition_type']
+        measurements = context.get('measurements') or []
+
+        missing = []
+        symptom_guidance = []
+        education_topics = []
+        if condition_type:
+            required = self.protocols.get_requirements(
+                condition_type, context.get('trimester')
+            ).required_measurements
+            match = self.protocols.measurement_matcher.match(required, measurements)
+            missing = [m for m in required if m not in match['taken']]
+            for symptom in context.get('symptoms') or []:
+                symptom_guidance.extend(self.protocols.get_symptom_guidance(condition_type, symptom))
+            education_topics = self._get_education_topics(context)
+
+        suggestions = [f"Schedule follow-up to check {m}" for m in missing]
+        guidance = {
+            'symptom_guidance': list(dict.fromkeys(
+                symptom_guidance + suggestions + [f"Discuss {t} during next visit" for t in education_topics]
+            )),
+            'protocol_suggestions': suggestions
+        }
+        translations = self.translation_cache.get(self._translation_key(guidance))
+        if translations:
+            guidance = {
+                'symptom_guidance': translations['tagalog']['symptoms'],
+                'protocol_suggestions': translations['tagalog']['protocols']
+            }
+
+        return {
+            'symptom_guidance': guidance['symptom_guidance'],
+            'protocol_suggestions': guidance['protocol_suggestions'],
+            'missing_information': missing,
+            'danger_signs': detect_danger_signs(
+                transcript,
+                self.protocols.get_danger_sign_terms(condition_type)
+            ),
+            'education_topics': education_topics,
+            'provisional': True,
+            'protocol_version': self.protocols.version
+        }
+
+    def _translation_key(self, guidance: Dict[str, Any]) -> str:
+        """Cache key for the English guidance sent for translation: its set of lines, in any order."""
+        return json.dumps(sorted(set(guidance['symptom_guidance']) | set(guidance['protocol_suggestions'])))
+
+    def _generate_full_guidance(self, transcript: str, transcript_filename: str = "",
+                                session: Optional[object] = None) -> Dict[str, Any]:
+        """
+        Run the complete LLM-backed guidance pipeline on a copy of the context,
+        swapped in at the end unless the session (reset_session's token, the
+        current one if not given) has ended meanwhile.
+        """
+        session = session or self._session
+        protocols = self.protocols
+        context = copy.deepcopy(self.current_context)
+
         # 1. Infer condition_type from the start of the filename
-        if not self.current_context['condition_type'] and transcript_filename:
+        if not context['condition_type'] and transcript_filename:
             base_name = os.path.basename(transcript_filename).lower()
             if base_name.startswith("prenatal"):
-                self.current_context['condition_type'] = "prenatal"
+                context['condition_type'] = "prenatal"
             elif base_name.startswith("non-communicable"):
-                self.current_context['condition_type'] = "non-communicable"
+                context['condition_type'] = "non-communicable"
             elif base_name.startswith("communicable"):
-                self.current_context['condition_type'] = "communicable"
+                context['condition_type'] = "communicable"
 
         # 2. Fall back to classification if needed
-        if not self.current_context['condition_type']:
+        if not context['condition_type']:
             condition_type, confidence = self._classify_condition_type(transcript)
             if confidence >= self.confidence_threshold:
-                self.current_context['condition_type'] = condition_type
+                context['condition_type'] = condition_type
 
         # 2. Extract medical info if not already done
         if not any([
-            self.current_context['measurements'], 
-            self.current_context['symptoms'],
-            self.current_context['covered_topics']
+            context['measurements'], 
+            context['symptoms'],
+            context['covered_topics']
         ]):
             extracted_info = self._extract_information(transcript)
-            self._update_context(extracted_info)
+            self._update_context(extracted_info, context)
 
         # 3. Generate protocol-based guidance
-        guidance = self._generate_protocol_guidance()
+        guidance = self._generate_protocol_guidance(context, protocols)
 
         # 4. Attempt translation if desired
+        translations = self._translate_guidance(guidance)
+
+        # 5. Build final return structure
+        result = {
+            'symptom_guidance': translations['tagalog']['symptoms'],
+            'protocol_suggestions': translations['tagalog']['protocols'],
+            'missing_information': guidance['missing_information'],
+            'danger_signs': guidance['danger_signs'],
+            'education_topics': guidance['education_topics'],
+            'provisional': False,
+            'protocol_version': protocols.version
+        }
+        if session is self._session:
+            self.current_context = context
+        return result
+
+    def _translate_guidance(self, guidance: Dict[str, Any]) -> Dict[str, Any]:
+        """Translate symptom guidance and protocol suggestions to Tagalog, reusing cached results."""
+        key = self._translation_key(guidance)
+        if key in self.translation_cache:
+            return self.translation_cache[key]
+
         try:
             response = self.claude.messages.create(
                 model="claude-3-opus-20240229",
@@ -96,37 +305,21 @@ Protocol Suggestions:
                 ]
             )
             translations = extract_json_from_text(response.content[0].text)
-            if not translations:
-                translations = {
-                    "tagalog": {
-                        "symptoms": guidance['symptom_guidance'],
-                        "protocols": guidance['protocol_suggestions']
-                    },
-                    "english": {
-                        "symptoms": guidance['symptom_guidance'],
-                        "protocols": guidance['protocol_suggestions']
-                    }
-                }
+            if translations:
+                self.translation_cache[key] = translations
+                return translations
         except Exception as e:
             print(f"Error calling translation API: {str(e)}")
-            translations = {
-                "tagalog": {
-                    "symptoms": guidance['symptom_guidance'],
-                    "protocols": guidance['protocol_suggestions']
-                },
-                "english": {
-                    "symptoms": guidance['symptom_guidance'],
-                    "protocols": guidance['protocol_suggestions']
-                }
-            }
 
-        # 5. Build final return structure
         return {
-            'symptom_guidance': translations['tagalog']['symptoms'],
-            'protocol_suggestions': translations['tagalog']['protocols'],
-            'missing_information': guidance['missing_information'],
-            'danger_signs': guidance['danger_signs'],
-            'education_topics': guidance['education_topics']
+            "tagalog": {
+                "symptoms": guidance['symptom_guidance'],
+                "protocols": guidance['protocol_suggestions']
+            },
+            "english": {
+                "symptoms": guidance['symptom_guidance'],
+                "protocols": guidance['protocol_suggestions']
+            }
         }
 
     def _classify_condition_type(self, transcript: str) -> Tuple[str, float]:
@@ -204,13 +397,15 @@ Conversation Transcript:
                 'danger_signs': []
             }
 
-    def _update_context(self, extracted_info: Dict[str, Any]):
-        """Update the current context with new data from the transcript info."""
-        self.current_context.update(extracted_info)
+    def _update_context(self, extracted_info: Dict[str, Any], context: Optional[Dict[str, Any]] = None):
+        """Update the context (the current one if not given) with new data from the transcript info."""
+        (self.current_context if context is None else context).update(extracted_info)
 
-    def _generate_protocol_guidance(self) -> Dict[str, List[str]]:
+    def _generate_protocol_guidance(self, context: Optional[Dict[str, Any]] = None,
+                                    protocols=None) -> Dict[str, List[str]]:
         """
-        Generate guidance based on the current context using protocols from the BHW manual.
+        Generate guidance based on a context (the current one by default) using protocols
+        from the BHW manual (the session's snapshot by default).
         Returns a structured analysis with distinct sections:
         - Realtime Alerts: Critical information needed during the exam
         - Missing Information: Required measurements/tests not yet done
@@ -218,8 +413,10 @@ Conversation Transcript:
         - Education Topics: Recommended topics to cover
         - Protocol Suggestions: Follow-up actions needed
         """
+        context = self.current_context if context is None else context
+        protocols = protocols or self.protocols
         # If no condition type, return empty sets
-        if not self.current_context['condition_type']:
+        if not context['condition_type']:
             return {
                 'realtime_alerts': [],
                 'symptom_guidance': [],
@@ -231,8 +428,9 @@ Conversation Transcript:
 
         # Get validation results from ProtocolManager
         validation = self.protocol_manager.validate_interaction(
-            self.current_context['condition_type'],
-            self.current_context
+            context['condition_type'],
+            context,
+            snapshot=protocols
         )
 
         # Initialize guidance structure
@@ -242,11 +440,11 @@ Conversation Transcript:
             'missing_information': [],
             'education_topics': validation.get('missing_topics', []),
             'protocol_suggestions': [],
-            'danger_signs': self.current_context.get('danger_signs', [])  # Keep this for compatibility
+            'danger_signs': context.get('danger_signs', [])  # Keep this for compatibility
         }
 
         # Filter out existing measurements from the missing list
-        existing_lower = [m.lower() for m in self.current_context.get('measurements', [])]
+        existing_lower = [m.lower() for m in context.get('measurements', [])]
         filtered_missing = []
         for item in validation.get('missing_measurements', []):
             if item.lower() not in existing_lower:
@@ -254,9 +452,9 @@ Conversation Transcript:
 
         guidance['missing_information'] = filtered_missing
 
-        # Deduplicate symptom guidance
+        # Deduplicate symptom guidance, keeping the protocol's order
         if validation.get('recommendations'):
-            guidance['symptom_guidance'] = list(set(validation.get('recommendations', [])))
+            guidance['symptom_guidance'] = list(dict.fromkeys(validation.get('recommendations', [])))
 
         # Create protocol suggestions only for truly missing items
         guidance['protocol_suggestions'] = [
@@ -271,18 +469,25 @@ Conversation Transcript:
         """(Optional) If you want direct list of missing measurements from the BHW manual protocols."""
         if not self.current_context['condition_type']:
             return []
-        required = self.protocol_manager.get_required_measurements(self.current_context['condition_type'])
+        required = self.protocols.get_requirements(
+            self.current_context['condition_type'], self.current_context.get('trimester')
+        ).required_measurements
         return [m for m in required if m not in self.current_context['measurements']]
 
     def _get_danger_signs(self) -> List[str]:
         """(Optional) If you want default or comprehensive danger signs, but typically not used if you want only transcript ones."""
         if not self.current_context['condition_type']:
             return []
-        return self.protocol_manager.get_danger_signs(self.current_context['condition_type'])
+        return self.protocols.get_requirements(self.current_context['condition_type']).danger_signs
 
-    def _get_education_topics(self) -> List[str]:
+    def _get_education_topics(self, context: Optional[Dict[str, Any]] = None) -> List[str]:
         """(Optional) If you want a direct query for education topics."""
-        if not self.current_context['condition_type']:
+        context = self.current_context if context is None else context
+        if not context['condition_type']:
             return []
-        required = self.protocol_manager.get_education_topics(self.current_context['condition_type'])
-        return [t for t in required if t not in self.current_context['covered_topics']] 
\ No newline at end of file
+        required = self.protocols.get_requirements(
+            context['condition_type'], context.get('trimester')
+        ).education_topics
+        # Same rule as ProtocolManager.validate_interaction, so both paths suggest the same topics
+        covered = [topic.lower() for topic in context['covered_topics'] or []]
+        return [t for t in required if not any(c in t.lower() for c in covered)] 
\ No newline at end of file
@@ -0,0 +1,124 @@
+import re
+from typing import Dict, Any, List, Optional
+
+# Lines starting with an optional [MM:SS] timestamp followed by a BHW speaker label
+BHW_LINE = re.compile(r'^(\[\d{2}:\d{2}\]\s*)?bhw\s*:')
+
+# Spoken forms of vital-sign readings, keyed by the basic-assessment vital they measure
+VITAL_PATTERNS = {
+    'temperature': re.compile(r'\b(3\d|4[0-3])(\.\d+)?\s*(?:°\s*c?|degrees?|digri|celsius)'),
+    'pulse_rate': re.compile(r'\b(?:pulse|pulso|heart rate)\D{0,15}?(\d{2,3})\b'),
+    'respiratory_rate': re.compile(r'\b(?:respiratory rate|breaths?|paghinga)\D{0,15}?(\d{1,2})\b'),
+}
+BLOOD_PRESSURE_PATTERN = re.compile(r'\b(\d{2,3})\s*(?:/|over)\s*(\d{2,3})\b')
+
+# Referral actions ordered from most to least severe
+ACTION_SEVERITY = ['immediate_referral', 'urgent_referral', 'routine_referral']
+
+
+def patient_text(transcript: str) -> str:
+    """Lowercased transcript with the BHW's own lines removed."""
+    return "\n".join(
+        line for line in transcript.lower().splitlines()
+        if not BHW_LINE.match(line.strip())
+    )
+
+
+def detect_danger_signs(transcript: str, terms: Dict[str, str]) -> List[str]:
+    """
+    Match danger-sign terms (English and Tagalog) against what the patient says.
+    Lines spoken by the BHW are skipped, since a BHW listing warning signs is
+    not the patient reporting them.
+    """
+    text = patient_text(transcript)
+    detected = []
+    for term, sign in terms.items():
+        if sign not in detected and re.search(r'\b' + re.escape(term) + r'\b', text):
+            detected.append(sign)
+    return detected
+
+
+def _most_severe(actions: List[str]) -> Optional[str]:
+    """Pick the most urgent referral action from a list."""
+    ranked = [a for a in ACTION_SEVERITY if a in actions]
+    return ranked[0] if ranked else (actions[0] if actions else None)
+
+
+def _check_value(value: float, spec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Compare a single-valued reading against a vital's normal range and alert thresholds."""
+    actions = []
+    for name, threshold in spec.get('alert_thresholds', {}).items():
+        if 'value' not in threshold:
+            continue
+        below = threshold.get('comparison', 'below' if 'low' in name else 'above') == 'below'
+        if (value <= threshold['value']) if below else (value >= threshold['value']):
+            actions.append(threshold.get('action'))
+
+    normal = spec.get('normal_ranges', {})
+    normal = normal.get('adult', normal)
+    out_of_range = 'min' in normal and not (normal['min'] <= value <= normal['max'])
+
+    if not actions and not out_of_range:
+        return None
+    return {'value': value, 'action': _most_severe(actions)}
+
+
+def _check_blood_pressure(systolic: int, diastolic: int, spec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Compare a systolic/diastolic reading against the blood pressure protocol."""
+    actions = []
+    for name, threshold in spec.get('alert_thresholds', {}).items():
+        below = 'low' in name
+        crossed = False
+        if 'systolic' in threshold:
+            crossed = systolic <= threshold['systolic'] if below else systolic >= threshold['systolic']
+        if not crossed and 'diastolic' in threshold:
+            crossed = diastolic <= threshold['diastolic'] if below else diastolic >= threshold['diastolic']
+        if crossed:
+            actions.append(threshold.get('action'))
+
+    normal = spec.get('normal_ranges', {})
+    out_of_range = any(
+        part in normal and not (normal[part]['min'] <= reading <= normal[part]['max'])
+        for part, reading in (('systolic', systolic), ('diastolic', diastolic))
+    )
+
+    if not actions and not out_of_range:
+        return None
+    return {'value': f"{systolic}/{diastolic}", 'action': _most_severe(actions)}
+
+
+def extract_vital_readings(transcript: str) -> Dict[str, List[Any]]:
+    """
+    Pull spoken vital-sign readings out of a transcript. Blood pressure is
+    returned as (systolic, diastolic) pairs, other vitals as floats.
+    """
+    text = transcript.lower()
+    readings = {}
+    for match in BLOOD_PRESSURE_PATTERN.finditer(text):
+        systolic, diastolic = int(match.group(1)), int(match.group(2))
+        if systolic > diastolic:
+            readings.setdefault('blood_pressure', []).append((systolic, diastolic))
+    for vital, pattern in VITAL_PATTERNS.items():
+        for match in pattern.finditer(text):
+            readings.setdefault(vital, []).append(float("".join(g for g in match.groups() if g)))
+    return readings
+
+
+def detect_vital_alerts(transcript: str, vital_signs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Find spoken vital-sign readings that fall outside the basic-assessment
+    normal ranges. Each hit reports the vital, the reading, and the referral
+    action of the most severe alert threshold crossed (None if only abnormal).
+    """
+    alerts = []
+    for vital, values in extract_vital_readings(transcript).items():
+        if vital not in vital_signs:
+            continue
+        for value in values:
+            if vital == 'blood_pressure':
+                hit = _check_blood_pressure(value[0], value[1], vital_signs[vital])
+            else:
+                hit = _check_value(value, vital_signs[vital])
+            if hit:
+                alerts.append({'vital': vital, **hit})
+    return alerts
@@ -0,0 +1,459 @@
+import copy
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import reduce
+from typing import Dict, Any, List, Optional, Callable
+
+def _percentiles(values) -> Dict[str, float]:
+    if not values:
+        return {'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    ordered = sorted(values)
+    return {
+        'p50': ordered[len(ordered) // 2],
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max': ordered[-1]
+    }
+
+
+class Stage:
+    """
+    One pipeline stage: a bounded FIFO queue feeding a pool of worker
+    threads that call handler(item). put() blocks while the queue is full,
+    so a slow stage pushes back on the one before it instead of growing
+    without limit; the time spent blocked is in the metrics, along with
+    queue depth, time waiting in the queue and time in the handler.
+
+    A handler that raises is reported and counted, and on_error(item) is
+    called so the caller can account for the lost item.
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], None], workers: int = 1, max_queue: int = 100,
+                 on_error: Optional[Callable[[Any], None]] = None, latency_window: int = 1000):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.on_error = on_error
+        self.waits = deque(maxlen=latency_window)
+        self.services = deque(maxlen=latency_window)
+        self.metrics = {
+            'processed': 0, 'errors': 0, 'max_depth': 0,
+            'blocked_puts': 0, 'blocked_seconds': 0.0
+        }
+        self._items = deque()
+        self._busy = 0
+        self._closed = False
+        self._lock = threading.Condition()
+        self._threads = [threading.Thread(target=self._worker, name=f"{name}-{index}", daemon=True)
+                         for index in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def depth(self) -> int:
+        """Items waiting for a worker."""
+        return len(self._items)
+
+    def _full(self) -> bool:
+        return len(self._items) >= self.max_queue
+
+    def _add(self, item, enqueued_at: float):
+        self._items.append((enqueued_at, item))
+
+    def _take(self):
+        return self._items.popleft()
+
+    def _ready(self) -> bool:
+        return bool(self._items)
+
+    def _finish(self, item):
+        pass
+
+    def put(self, item):
+        """Queue an item, blocking while the queue is full."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} stage is closed")
+            if self._full():
+                self.metrics['blocked_puts'] += 1
+                blocked = time.perf_counter()
+                while self._full() and not self._closed:
+                    self._lock.wait()
+                self.metrics['blocked_seconds'] += time.perf_counter() - blocked
+            self._add(item, time.perf_counter())
+            self.metrics['max_depth'] = max(self.metrics['max_depth'], self.depth)
+            self._lock.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._ready() and not self._closed:
+                    self._lock.wait()
+                if not self._ready():
+                    return
+                enqueued_at, item = self._take()
+                self._busy += 1
+                self._lock.notify_all()  # room for a blocked put
+            started = time.perf_counter()
+            try:
+                self.handler(item)
+            except Exception as e:
+                self.metrics['errors'] += 1
+                print(f"Error in {self.name} stage: {str(e)}")
+                if self.on_error:
+                    self.on_error(item)
+            finished = time.perf_counter()
+            with self._lock:
+                self._finish(item)
+                self._busy -= 1
+                self.metrics['processed'] += 1
+                self.waits.append(started - enqueued_at)
+                self.services.append(finished - started)
+                self._lock.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until nothing is queued or being handled; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._ready() or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+        return True
+
+    def close(self):
+        """Finish what is queued, then stop the workers."""
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current depth and busy workers, plus wait and service time percentiles (seconds)."""
+        with self._lock:
+            waits, services = list(self.waits), list(self.services)
+            return {
+                'depth': self.depth, 'busy': self._busy, 'workers': self.workers, **self.metrics,
+                'wait': _percentiles(waits), 'service': _percentiles(services)
+            }
+
+
+class CoalescingStage(Stage):
+    """
+    A stage whose items are keyed (by session): while a key's item is still
+    waiting, a newer one is merged into it with merge(older, newer) rather
+    than queued behind it, and a key is never handled by two workers at
+    once. A busy stage therefore handles the latest state of each session
+    once, instead of working through a backlog of stale ones. Items are
+    (key, value) pairs; the queue holds at most one per key.
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], None], merge: Callable[[Any, Any], Any],
+                 workers: int = 1, max_queue: int = 100, **kwargs):
+        self.merge = merge
+        self._pending: Dict[Any, Any] = {}
+        self._order: "OrderedDict[Any, None]" = OrderedDict()  # keys ready to run, oldest first
+        self._running = set()
+        super().__init__(name, handler, workers, max_queue, **kwargs)
+        self.metrics['coalesced'] = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def _full(self) -> bool:
+        # A key already waiting can always take a newer item
+        return len(self._pending) >= self.max_queue
+
+    def put(self, item):
+        key, value = item
+        with self._lock:
+            if key in self._pending:
+                enqueued_at, older = self._pending[key]
+                self._pending[key] = (enqueued_at, self.merge(older, value))
+                self.metrics['coalesced'] += 1
+                return
+        super().put(item)
+
+    def _add(self, item, enqueued_at: float):
+        key, value = item
+        if key in self._pending:  # raced in while put() was blocked
+            self._pending[key] = (self._pending[key][0], self.merge(self._pending[key][1], value))
+            self.metrics['coalesced'] += 1
+            return
+        self._pending[key] = (enqueued_at, value)
+        if key not in self._running:
+            self._order[key] = None
+
+    def _ready(self) -> bool:
+        return bool(self._order)
+
+    def _take(self):
+        key, _ = self._order.popitem(last=False)
+        enqueued_at, value = self._pending.pop(key)
+        self._running.add(key)
+        return enqueued_at, (key, value)
+
+    def _finish(self, item):
+        key, _ = item
+        self._running.discard(key)
+        if key in self._pending:
+            self._order[key] = None
+
+
+class SessionPipeline:
+    """
+    The real-time path after voice activity detection, as concurrent stages
+    shared by every session:
+
+        ASR (worker pool) -> guidance (worker pool, coalescing) -> storage
+
+    Each session's capture thread only records and runs VAD, then hands
+    utterances to submit(); a slow transcription, guidance call or database
+    write never holds up capture. Queues are bounded, so a backlog pushes
+    back towards capture rather than growing without limit.
+
+    Transcripts go to the alert bus as soon as they arrive and on to
+    guidance in utterance order. While a session's guidance is queued, later
+    transcripts are merged into it, so a busy guidance stage analyzes only
+    the latest state of the conversation, once. Each guidance result is
+    stored as one interaction covering the utterances it analyzed.
+
+    With a guidance_deadline (seconds), guidance calls return the engine's
+    provisional result when its full analysis is not done in time; that is
+    passed to on_guidance at once, and the utterances are stored when the
+    upgraded guidance arrives (and passed to on_guidance again). Whatever no
+    upgrade reaches by end_session is stored with its provisional guidance.
+    """
+
+    def __init__(self, analyzer, alert_bus, storage, asr_workers: int = 4, guidance_workers: int = 4,
+                 max_queue: int = 64, guidance_deadline: Optional[float] = None):
+        self.analyzer = analyzer
+        self.alert_bus = alert_bus
+        self.storage = storage
+        self.guidance_deadline = guidance_deadline
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.asr = Stage('asr', self._transcribe, asr_workers, max_queue, on_error=self._transcribe_failed)
+        self.guidance = CoalescingStage('guidance', self._guide, self._merge, guidance_workers, max_queue,
+                                        on_error=lambda item: self._finish(item[0], item[1]['captured']))
+        self.store = Stage('storage', self._store, 1, max_queue,
+                           on_error=lambda item: self._finish(item[0], item[1]['captured']))
+        self.stages = [self.asr, self.guidance, self.store]
+        self._monitor: Optional[threading.Thread] = None
+        self._stop_monitor = threading.Event()
+
+    def start_session(self, session_id: str, guidance_engine, audio_file: Optional[str] = None,
+                      on_guidance: Optional[Callable[[Dict[str, Any], Dict[str, Any]], None]] = None,
+                      rate: int = 16000):
+        """
+        Register a session whose utterance audio is sampled at rate; its
+        utterances are guided by guidance_engine and stored against audio_file. on_guidance(guidance, request), if given,
+        is called from a guidance worker with each result as it is produced, and
+        from the engine's thread when an upgrade replaces provisional guidance.
+        """
+        with self._lock:
+            self.sessions[session_id] = {
+                'engine': guidance_engine, 'audio_file': audio_file, 'on_guidance': on_guidance, 'rate': rate,
+                'submitted': 0, 'released': 0, 'transcribed': {}, 'outstanding': 0, 'awaiting': [],
+                'latencies': [], 'release': threading.Lock(), 'done': threading.Condition()
+            }
+
+    def submit(self, session_id: str, utterance, captured_at: float):
+        """
+        Queue an utterance for transcription; captured_at is the
+        time.perf_counter() value when its last audio was captured.
+        """
+        session = self.sessions[session_id]
+        with session['done']:
+            sequence = session['submitted']
+            session['submitted'] += 1
+            session['outstanding'] += 1
+        self.asr.put((session_id, sequence, utterance, captured_at))
+
+    def outstanding(self, session_id: str) -> int:
+        """Utterances of the session submitted but not yet through every stage."""
+        return self.sessions[session_id]['outstanding']
+
+    def wait_below(self, session_id: str, limit: int, timeout: Optional[float] = None) -> bool:
+        """Block until fewer than limit of the session's utterances are outstanding; False on timeout."""
+        session = self.sessions[session_id]
+        with session['done']:
+            return session['done'].wait_for(lambda: session['outstanding'] < limit, timeout)
+
+    def end_session(self, session_id: str, timeout: Optional[float] = None) -> List[float]:
+        """
+        Wait for the session's utterances to make it through every stage and
+        forget it. Returns each utterance's latency: seconds from capture to
+        its interaction being stored.
+        """
+        session = self.sessions[session_id]
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+        if self.guidance_deadline is not None:
+            # Once only utterances waiting on an upgrade are left, let the engine finish its analyses,
+            # then store what no upgrade reached with its provisional guidance
+            with session['done']:
+                session['done'].wait_for(lambda: session['outstanding'] == self._awaiting(session), remaining())
+            session['engine'].wait_for_upgrades(remaining())
+            with session['done']:
+                awaiting, session['awaiting'] = session['awaiting'], []
+            if awaiting:
+                request = reduce(self._merge, awaiting)
+                self.store.put((session_id, dict(request, guidance=awaiting[-1]['guidance'],
+                                                 context=copy.deepcopy(session['engine'].current_context))))
+        with session['done']:
+            if not session['done'].wait_for(lambda: not session['outstanding'], remaining()):
+                print(f"Session {session_id} ended with {session['outstanding']} utterances unprocessed")
+        with self._lock:
+            self.sessions.pop(session_id, None)
+        return session['latencies']
+
+    def _transcribe(self, item):
+        session_id, sequence, utterance, captured_at = item
+        transcript = self.analyzer.process_audio_stream(utterance.audio, self.sessions[session_id]['rate'])
+        if transcript:
+            # Scan for danger signs without waiting on guidance
+            self.alert_bus.publish_transcript(session_id, transcript, captured_at)
+        self._release(session_id, sequence, transcript, utterance, captured_at)
+
+    def _transcribe_failed(self, item):
+        session_id, sequence, utterance, captured_at = item
+        self._release(session_id, sequence, None, utterance, captured_at)
+
+    def _release(self, session_id: str, sequence: int, transcript, utterance, captured_at: float):
+        """Pass transcripts on to guidance in utterance order, whichever ASR worker finishes first."""
+        session = self.sessions[session_id]
+        with session['release']:
+            session['transcribed'][sequence] = (transcript, utterance, captured_at)
+            while session['released'] in session['transcribed']:
+                transcript, utterance, captured_at = session['transcribed'].pop(session['released'])
+                session['released'] += 1
+                if transcript:
+                    self.guidance.put((session_id, {
+                        'transcript': transcript, 'start': utterance.start, 'end': utterance.end,
+                        'captured': [captured_at]
+                    }))
+                else:
+                    self._finish(session_id, [captured_at])
+
+    @staticmethod
+    def _merge(older: Dict[str, Any], newer: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'transcript': f"{older['transcript']}\n{newer['transcript']}",
+            'start': older['start'], 'end': newer['end'],
+            'captured': older['captured'] + newer['captured']
+        }
+
+    def _guide(self, item):
+        session_id, request = item
+        session = self.sessions[session_id]
+        engine = session['engine']
+        if self.guidance_deadline is None:
+            guidance = engine.generate_guidance(request['transcript'])
+        else:
+            guidance = engine.generate_guidance(
+                request['transcript'], deadline=self.guidance_deadline,
+                on_upgrade=lambda upgraded: self._upgraded(session_id, upgraded))
+        if session['on_guidance']:
+            session['on_guidance'](guidance, request)
+        with session['done']:
+            if guidance.get('provisional'):
+                # Stored when the upgrade arrives
+                session['awaiting'].append(dict(request, guidance=guidance))
+                session['done'].notify_all()
+                return
+            # A full result in time also covers the utterances whose upgrade it superseded
+            awaiting, session['awaiting'] = session['awaiting'], []
+        request = reduce(self._merge, awaiting + [request])
+        # The engine keeps updating its context; store it as it was for this guidance
+        self.store.put((session_id, dict(request, guidance=guidance, context=copy.deepcopy(engine.current_context))))
+
+    def _upgraded(self, session_id: str, guidance: Dict[str, Any]):
+        """Full guidance for utterances that got a provisional result (called from the engine's thread)."""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        with session['done']:
+            awaiting, session['awaiting'] = session['awaiting'], []
+        if not awaiting:
+            return
+        request = reduce(self._merge, awaiting)
+        if session['on_guidance']:
+            session['on_guidance'](guidance, request)
+        self.store.put((session_id, dict(request, guidance=guidance,
+                                         context=copy.deepcopy(session['engine'].current_context))))
+
+    @staticmethod
+    def _awaiting(session: Dict[str, Any]) -> int:
+        """Utterances of the session whose storing waits on an upgrade."""
+        return sum(len(request['captured']) for request in session['awaiting'])
+
+    def _store(self, item):
+        session_id, request = item
+        session = self.sessions[session_id]
+        # Its audio is in the session recording
+        self.storage.store_interaction(
+            None, request['transcript'], request['guidance'],
+            context=request['context'], session_id=session_id,
+            audio_file=session['audio_file'], audio_start=request['start'], audio_end=request['end']
+        )
+        self._finish(session_id, request['captured'])
+
+    def _finish(self, session_id: str, captured: List[float]):
+        session = self.sessions.get(session_id)
+        if session is None:  # end_session gave up waiting for it
+            return
+        now = time.perf_counter()
+        with session['done']:
+            session['latencies'].extend(now - captured_at for captured_at in captured)
+            session['outstanding'] -= len(captured)
+            session['done'].notify_all()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Live metrics for each stage."""
+        return {stage.name: stage.snapshot() for stage in self.stages}
+
+    def report(self) -> str:
+        """One line per stage: queue depth now and at most, and wait and service time percentiles."""
+        lines = []
+        for name, stats in self.snapshot().items():
+            coalesced = f", {stats['coalesced']} coalesced" if 'coalesced' in stats else ""
+            blocked = f", blocked {stats['blocked_seconds']:.2f}s" if stats['blocked_puts'] else ""
+            lines.append(
+                f"  {name:<9} depth {stats['depth']:3d} (max {stats['max_depth']:3d}), "
+                f"{stats['busy']}/{stats['workers']} busy, {stats['processed']} done{coalesced}, "
+                f"{stats['errors']} errors; wait p50 {stats['wait']['p50'] * 1000:.0f} ms "
+                f"p95 {stats['wait']['p95'] * 1000:.0f} ms, "
+                f"service p50 {stats['service']['p50'] * 1000:.0f} ms p95 {stats['service']['p95'] * 1000:.0f} ms{blocked}")
+        return "Pipeline:\n" + "\n".join(lines)
+
+    def monitor(self, interval: float, callback: Callable[[str], None] = print):
+        """Pass report() to callback every interval seconds until close()."""
+        def run():
+            while not self._stop_monitor.wait(interval):
+                callback(self.report())
+        self._monitor = threading.Thread(target=run, name="pipeline-monitor", daemon=True)
+        self._monitor.start()
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """
+        Graceful shutdown: let every queued utterance through all stages in
+        turn (each stage drains before the next, which it feeds), then stop
+        the workers. Returns False if a stage did not drain within timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        drained = True
+        for stage in self.stages:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            drained = stage.drain(remaining) and drained
+        for stage in self.stages:
+            stage.close()
+        self._stop_monitor.set()
+        return drained
@@ -0,0 +1,142 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+UPLOAD_PATH = re.compile(r"^/uploads/([A-Za-z0-9_.-]+)(/complete)?$")
+
+
+class SyncReceiver(ThreadingHTTPServer):
+    """
+    Local stand-in for the central server's resumable upload endpoint:
+
+        POST /uploads                 {"upload_id", "size", "sha256"} -> {"offset"}
+        PUT  /uploads/<id>            body appended at Upload-Offset -> {"offset"} (409 if out of step)
+        POST /uploads/<id>/complete   verifies size and hash -> 200, or 422 and discards the upload
+
+    Partial uploads live in <directory>/partial, verified batches in
+    <directory>/complete. drop_every, if set, makes the receiver keep half of
+    every drop_every-th chunk and then cut the connection, to exercise resume.
+    """
+
+    def __init__(self, directory: Path, host: str = "127.0.0.1", port: int = 0, drop_every: int = 0):
+        super().__init__((host, port), SyncRequestHandler)
+        self.directory = Path(directory)
+        (self.directory / "partial").mkdir(parents=True, exist_ok=True)
+        (self.directory / "complete").mkdir(parents=True, exist_ok=True)
+        self.drop_every = drop_every
+        self.chunks = 0
+        self.dropped = 0
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def paths(self, upload_id: str):
+        partial = self.directory / "partial" / upload_id
+        return partial, partial.with_suffix(".json"), self.directory / "complete" / f"{upload_id}.tar.gz"
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name="sync-receiver", daemon=True)
+        thread.start()
+        return thread
+
+
+class SyncRequestHandler(BaseHTTPRequestHandler):
+    server: SyncReceiver
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        if self.path == "/uploads":
+            request = json.loads(self._body())
+            partial, info, complete = self.server.paths(request['upload_id'])
+            if complete.exists():
+                return self._reply(200, {'offset': complete.stat().st_size})
+            if not info.exists():
+                info.write_text(json.dumps({'size': request['size'], 'sha256': request['sha256']}))
+                partial.touch()
+            return self._reply(200, {'offset': partial.stat().st_size})
+
+        match = UPLOAD_PATH.match(self.path)
+        if not match or not match.group(2):
+            return self._reply(404, {'error': 'not found'})
+        partial, info, complete = self.server.paths(match.group(1))
+        if complete.exists():
+            return self._reply(200, {'status': 'complete'})
+        if not info.exists():
+            return self._reply(404, {'error': 'unknown upload'})
+        expected = json.loads(info.read_text())
+        digest = hashlib.sha256()
+        with open(partial, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        if partial.stat().st_size != expected['size'] or digest.hexdigest() != expected['sha256']:
+            partial.unlink()
+            info.unlink()
+            return self._reply(422, {'error': 'size or hash mismatch'})
+        os.replace(partial, complete)
+        info.unlink()
+        return self._reply(200, {'status': 'complete'})
+
+    def do_PUT(self):
+        match = UPLOAD_PATH.match(self.path)
+        if not match or match.group(2):
+            return self._reply(404, {'error': 'not found'})
+        partial, info, _ = self.server.paths(match.group(1))
+        if not info.exists():
+            return self._reply(404, {'error': 'unknown upload'})
+        chunk = self._body()
+        with self.server.lock:
+            offset = partial.stat().st_size
+            if int(self.headers.get('Upload-Offset', -1)) != offset:
+                return self._reply(409, {'offset': offset})
+            self.server.chunks += 1
+            drop = self.server.drop_every and self.server.chunks % self.server.drop_every == 0
+            if drop:
+                chunk = chunk[:len(chunk) // 2]
+            with open(partial, 'ab') as f:
+                f.write(chunk)
+            self.server.bytes_received += len(chunk)
+        if drop:
+            # Connection lost mid-chunk: the client never hears back
+            self.server.dropped += 1
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        self._reply(200, {'offset': offset + len(chunk)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the central sync server')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on')
+    parser.add_argument('--dir', type=str, default='data/sync/received', help='Where uploads are stored')
+    args = parser.parse_args()
+
+    receiver = SyncReceiver(Path(args.dir), port=args.port)
+    print(f"Receiving uploads at {receiver.url} into {args.dir}")
+    try:
+        receiver.serve_forever()
+    except KeyboardInterrupt:
+        receiver.server_close()
+
+if __name__ == "__main__":
+    main()
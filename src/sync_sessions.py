@@ -0,0 +1,24 @@
+import argparse
+import os
+from data_management.storage import DataStorage
+from data_management.sync import SyncEngine
+
+def main():
+    parser = argparse.ArgumentParser(description='Upload stored sessions that have not reached the central server yet')
+    parser.add_argument('--server', type=str, default=os.getenv("SYNC_SERVER_URL", "http://127.0.0.1:8765"),
+                        help='Server base URL (default: SYNC_SERVER_URL)')
+    parser.add_argument('--bandwidth', type=float, default=0, help='Upload cap in kB/s (0: no cap)')
+    parser.add_argument('--budget', type=float, default=None, help='Seconds to spend before stopping (resumes next run)')
+    args = parser.parse_args()
+
+    storage = DataStorage()
+    engine = SyncEngine(storage, args.server, max_bytes_per_second=args.bandwidth * 1000 or None)
+    done = engine.sync(args.budget)
+    for name, totals in engine.sessions.items():
+        print(f"  {name}: {totals['bytes'] / 1e6:.2f} MB packed, {totals['uploaded_bytes'] / 1e6:.2f} MB uploaded")
+    print(engine.report())
+    print("Everything is synced" if done else "Sync incomplete; run again to resume")
+    storage.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+import bisect
+import heapq
+import itertools
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from pydub import AudioSegment
+
+from data_management.session_recorder import WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM, read_wav_info
+from voice_processing.pcm import PcmConverter
+
+# Backpressure policies for a full ring buffer
+DROP_OLDEST = 'drop_oldest'  # never wait: new audio overwrites the oldest unread audio
+BLOCK = 'block'              # the producer waits for space (up to block_timeout, then the new audio is dropped)
+POLICIES = (DROP_OLDEST, BLOCK)
+
+
+class AudioRingBuffer:
+    """
+    Preallocated single-producer, single-consumer ring for captured audio.
+
+    The producer (PortAudio's callback thread, or a file source) and the
+    consumer never hold a lock while copying: each side only advances its
+    own byte counter, after its copy is done. Under DROP_OLDEST the producer
+    may lap the consumer; the consumer notices, skips to the oldest audio
+    still in the ring and counts an overrun. Events are only used to wake a
+    side that is waiting.
+
+    Counters: overruns / dropped_bytes (audio lost because the consumer fell
+    a full ring behind, or a BLOCK producer timed out), underruns (reads that
+    timed out waiting for audio) and max_fill (high-water mark, in bytes).
+    """
+
+    def __init__(self, capacity: int, policy: str = DROP_OLDEST, block_timeout: Optional[float] = None,
+                 frame_bytes: int = 1):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{policy}', expected one of {', '.join(POLICIES)}")
+        # Whole frames only, so skipping ahead after an overrun lands on a frame boundary
+        self.capacity = capacity - capacity % frame_bytes
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.frame_bytes = frame_bytes
+        self._buffer = bytearray(self.capacity)
+        self._written = 0   # bytes ever written; only the producer advances it
+        self._writing = 0   # end of the write in progress, published before copying
+        self._read = 0      # bytes ever consumed; only the consumer advances it
+        self._closed = False
+        self._readable = threading.Event()
+        self._writable = threading.Event()
+        self.overruns = 0
+        self.dropped_bytes = 0
+        self.underruns = 0
+        self.max_fill = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def available(self) -> int:
+        """Unread bytes still in the ring."""
+        return self._written - max(self._read, self._written - self.capacity)
+
+    def write(self, data) -> int:
+        """Append audio (producer side); returns the bytes accepted."""
+        size = len(data)
+        if size > self.capacity:
+            if self.policy == BLOCK:
+                return sum(self.write(data[start:start + self.capacity]) for start in range(0, size, self.capacity))
+            data, size = data[size - self.capacity:], self.capacity
+        if self.policy == BLOCK:
+            while self.capacity - (self._written - self._read) < size:
+                self._writable.clear()
+                if self.capacity - (self._written - self._read) >= size:
+                    break
+                if self._closed or not self._writable.wait(self.block_timeout):
+                    self.overruns += 1
+                    self.dropped_bytes += size
+                    return 0
+
+        start = self._written % self.capacity
+        self._writing = self._written + size
+        first = min(size, self.capacity - start)
+        self._buffer[start:start + first] = data[:first]
+        if first < size:
+            self._buffer[:size - first] = data[first:]
+        self._written += size
+        self.max_fill = max(self.max_fill, min(self._written - self._read, self.capacity))
+        self._readable.set()
+        return size
+
+    def read(self, size: int, timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        Take exactly size bytes (consumer side). Returns None if none arrive
+        within timeout (an underrun), and whatever is left - then None - once
+        the ring is closed and drained.
+        """
+        while True:
+            # Oldest byte not yet overwritten (or being overwritten) by the producer
+            oldest = max(self._writing, self._written) - self.capacity
+            if oldest > self._read:
+                self.overruns += 1
+                self.dropped_bytes += oldest - self._read
+                self._read = oldest
+            start, available = self._read, self._written - self._read
+            if available < size:
+                if self._closed:
+                    if not available:
+                        return None
+                    size = available
+                else:
+                    self._readable.clear()
+                    if self._written - self._read < size and not self._closed and not self._readable.wait(timeout):
+                        self.underruns += 1
+                        return None
+                    continue
+
+            offset = start % self.capacity
+            first = min(size, self.capacity - offset)
+            data = bytes(self._buffer[offset:offset + first])
+            if first < size:
+                data += self._buffer[:size - first]
+            if max(self._writing, self._written) - self.capacity > start:
+                continue  # lapped by the producer while copying: the copy is torn, skip ahead and retry
+            self._read = start + size
+            self._writable.set()
+            return data
+
+    def close(self):
+        """No more audio is coming (producer side); wakes both sides."""
+        self._closed = True
+        self._readable.set()
+        self._writable.set()
+
+    def frames(self, frame_bytes: int, timeout: Optional[float] = None) -> Iterator[bytes]:
+        """Yield frame_bytes-sized pieces until the ring is closed and drained."""
+        while True:
+            data = self.read(frame_bytes, timeout)
+            if data is not None:
+                yield data
+            elif self._closed and not self.available():
+                return
+
+
+class AudioSource:
+    """
+    Where VoiceInputProcessor's audio comes from. A source fills a ring
+    buffer from its own thread between start(ring) and stop(), closes the
+    ring when it runs out of audio, and remembers when each piece was
+    captured: capture_time(seconds) maps a position in the stream to the
+    time.perf_counter() value at which that audio arrived.
+
+    block_timeout is how long a write into a BLOCK-policy ring may wait
+    for space (None: as long as it takes).
+    """
+
+    rate = 16000
+    channels = 1
+    sample_width = 4
+    is_float = True
+    block_timeout: Optional[float] = None
+
+    def __init__(self):
+        self._marks: List[int] = []         # frames delivered after each write
+        self._mark_times: List[float] = []  # ... and when
+
+    def _mark(self, frames: int):
+        self._marks.append(frames)
+        self._mark_times.append(time.perf_counter())
+
+    def capture_time(self, seconds: float) -> Optional[float]:
+        """When the audio at this stream position arrived (None if it has not yet)."""
+        index = bisect.bisect_left(self._marks, round(seconds * self.rate))
+        return self._mark_times[index] if index < len(self._mark_times) else None
+
+    def start(self, ring: AudioRingBuffer):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+
+def decode_float32(path: Path):
+    """
+    Rate, channels and a function returning the file's float32 samples as an
+    iterator of blocks: WAV files (PCM or float) are read incrementally on
+    each call, other formats are decoded with pydub once, here.
+    """
+    path = Path(path)
+    info = read_wav_info(path) if path.suffix == '.wav' else None
+    if info is None or info.format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        segment = AudioSegment.from_file(path)
+        samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+        samples /= float(1 << (8 * segment.sample_width - 1))
+        return segment.frame_rate, segment.channels, lambda: iter((samples,))
+    return info.rate, info.channels, lambda: _wav_chunks(path, info)
+
+
+def load_samples(path: Path, rate: int = 16000) -> np.ndarray:
+    """A recording (WAV, or anything pydub decodes) as float32 mono samples at rate."""
+    rate_in, channels, blocks = decode_float32(path)
+    converter = PcmConverter(rate_in, channels, rate_out=rate, channels_out=1, int16_out=False)
+    return np.concatenate([np.frombuffer(converter.convert(block), dtype=np.float32).copy() for block in blocks()]
+                          or [np.zeros(0, dtype=np.float32)])
+
+
+def _wav_chunks(path: Path, info, block_frames: int = 16384) -> Iterator[np.ndarray]:
+    dtype = {(WAVE_FORMAT_IEEE_FLOAT, 4): '<f4', (WAVE_FORMAT_IEEE_FLOAT, 8): '<f8', (WAVE_FORMAT_PCM, 1): 'u1',
+             (WAVE_FORMAT_PCM, 2): '<i2', (WAVE_FORMAT_PCM, 4): '<i4'}[(info.format_tag, info.sample_width)]
+    frame_size = info.sample_width * info.channels
+    with open(path, 'rb') as f:
+        f.seek(info.data_offset)
+        remaining = info.data_size - info.data_size % frame_size
+        while remaining:
+            data = f.read(min(block_frames * frame_size, remaining))
+            if not data:
+                return
+            data = data[:len(data) - len(data) % frame_size]
+            remaining -= len(data)
+            samples = np.frombuffer(data, dtype=dtype)
+            if info.format_tag == WAVE_FORMAT_PCM:
+                scale = float(1 << (8 * info.sample_width - 1))
+                samples = (samples.astype(np.float32) - (scale if info.sample_width == 1 else 0)) / scale
+            yield samples.astype('<f4', copy=False)
+
+
+def _rechunk(blocks: Iterator[np.ndarray], size: int) -> Iterator[np.ndarray]:
+    """Regroup sample blocks into pieces of exactly size samples (the last may be shorter)."""
+    carry = np.empty(0, dtype=np.float32)
+    for block in blocks:
+        if len(carry):
+            block = np.concatenate((carry, block))
+        end = len(block) - len(block) % size
+        for start in range(0, end, size):
+            yield block[start:start + size]
+        carry = block[end:]
+    if len(carry):
+        yield carry
+
+
+class FileSource(AudioSource):
+    """
+    Plays an audio file into a ring buffer as if it were being captured, so
+    the capture path can be exercised without a microphone. Audio is
+    delivered as float32 in chunk_frames pieces, each once its last frame
+    would have been recorded at speed times real time (0: as fast as the
+    ring accepts it), give or take jitter seconds (standard deviation) of
+    driver scheduling delay. WAV files are read incrementally; other
+    formats (mp3 from synthetic/generate_audio.py) are decoded with pydub
+    first.
+    """
+
+    def __init__(self, path: Path, speed: float = 1.0, chunk_frames: int = 1024, jitter: float = 0.0, seed=None):
+        super().__init__()
+        self.path = Path(path)
+        self.speed = speed
+        self.chunk_frames = chunk_frames
+        self.jitter = jitter
+        self._random = np.random.default_rng(seed)
+        self.rate, self.channels, self._blocks = decode_float32(self.path)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _chunks(self) -> Iterator[bytes]:
+        """The file as float32 chunks."""
+        for chunk in _rechunk(self._blocks(), self.chunk_frames * self.channels):
+            yield chunk.tobytes()
+
+    def _run(self, ring: AudioRingBuffer):
+        started = time.perf_counter()
+        frames = 0
+        for chunk in self._chunks():
+            if self._stop.is_set():
+                break
+            frames += len(chunk) // (self.sample_width * self.channels)
+            if self.speed:
+                delay = started + frames / self.rate / self.speed - time.perf_counter()
+                if self.jitter:
+                    delay += abs(self._random.normal(0.0, self.jitter))
+                if delay > 0:
+                    time.sleep(delay)
+            ring.write(chunk)
+            self._mark(frames)
+        ring.close()
+
+    def start(self, ring: AudioRingBuffer):
+        """Start feeding the ring from a background thread; the ring is closed at the end of the file."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(ring,), name="file-source", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class ReplaySession(AudioSource):
+    """One session of a SourceMultiplexer; pass it to VoiceInputProcessor like any other source."""
+
+    block_timeout = 0.0  # the multiplexer's one thread must never wait on a single session
+
+    def __init__(self, multiplexer: 'SourceMultiplexer', samples: np.ndarray, rate: int, channels: int,
+                 delay: float, name: str):
+        super().__init__()
+        self.multiplexer = multiplexer
+        self.samples = samples
+        self.rate, self.channels = rate, channels
+        self.delay = delay
+        self.name = name
+        self.ring: Optional[AudioRingBuffer] = None
+        self.started: Optional[float] = None
+        self.position = 0  # samples delivered
+        self.deferred = 0  # writes postponed because the ring was full
+        self.done = threading.Event()
+
+    def start(self, ring: AudioRingBuffer):
+        self.ring = ring
+        self.position = 0
+        self.done.clear()
+        self.started = time.perf_counter() + self.delay
+        self.multiplexer._schedule(self, self.started)
+
+    def stop(self):
+        self.multiplexer._cancel(self)
+
+
+class SourceMultiplexer:
+    """
+    Replays many recordings at once as concurrent sessions, for load
+    testing: add() returns a ReplaySession source per simulated visit, all
+    paced by a single scheduler thread with the same realistic timing as
+    FileSource (chunk_frames pieces at speed times real time, plus jitter).
+    Each distinct file is decoded once and shared by every session that
+    replays it; delay staggers a session's start. At speed 0, and for BLOCK
+    rings, a session whose ring is full is retried shortly instead of
+    overwriting unread audio, so each session runs as fast as its consumer.
+    """
+
+    def __init__(self, speed: float = 1.0, chunk_frames: int = 1024, jitter: float = 0.0, seed=None):
+        self.speed = speed
+        self.chunk_frames = chunk_frames
+        self.jitter = jitter
+        self._random = np.random.default_rng(seed)
+        self._decoded: Dict[Path, tuple] = {}
+        self._queue: List[tuple] = []  # (due, sequence, session) heap
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+        self.sessions: List[ReplaySession] = []
+
+    def add(self, path: Path, delay: float = 0.0) -> ReplaySession:
+        """A new session replaying path, starting delay seconds after it is started."""
+        path = Path(path)
+        if path not in self._decoded:
+            rate, channels, blocks = decode_float32(path)
+            blocks = list(blocks())
+            self._decoded[path] = (np.concatenate(blocks) if len(blocks) > 1 else blocks[0], rate, channels)
+        samples, rate, channels = self._decoded[path]
+        session = ReplaySession(self, samples, rate, channels, delay, f"{path.stem}#{len(self.sessions)}")
+        self.sessions.append(session)
+        return session
+
+    def _schedule(self, session: ReplaySession, due: float):
+        with self._lock:
+            heapq.heappush(self._queue, (due, next(self._sequence), session))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="source-multiplexer", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def _cancel(self, session: ReplaySession):
+        with self._lock:
+            self._queue = [entry for entry in self._queue if entry[2] is not session]
+            heapq.heapify(self._queue)
+        if session.ring is not None:
+            session.ring.close()
+        session.done.set()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if self._queue:
+                        wait = self._queue[0][0] - time.perf_counter()
+                        if wait <= 0:
+                            break
+                        self._wake.wait(wait)
+                    else:
+                        self._wake.wait()
+                if self._closed:
+                    return
+                _, _, session = heapq.heappop(self._queue)
+            due = self._deliver(session)
+            if due is not None:
+                with self._lock:
+                    heapq.heappush(self._queue, (due, next(self._sequence), session))
+
+    def _deliver(self, session: ReplaySession) -> Optional[float]:
+        """Write the session's next chunk; returns when the one after is due (None at the end)."""
+        ring = session.ring
+        step = self.chunk_frames * session.channels
+        chunk = session.samples[session.position:session.position + step]
+        if (not self.speed or ring.policy == BLOCK) and ring.capacity - ring.available() < chunk.nbytes:
+            session.deferred += 1
+            return time.perf_counter() + 0.001
+        ring.write(chunk.data.cast('B'))
+        session.position += len(chunk)
+        session._mark(session.position // session.channels)
+        if session.position >= len(session.samples):
+            ring.close()
+            session.done.set()
+            return None
+        if not self.speed:
+            return time.perf_counter()
+        frames = min(session.position + step, len(session.samples)) // session.channels
+        due = session.started + frames / session.rate / self.speed
+        if self.jitter:
+            due += abs(self._random.normal(0.0, self.jitter))
+        return due
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until every started session has delivered all its audio."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for session in self.sessions:
+            remaining = None if deadline is None else max(deadline - time.perf_counter(), 0.0)
+            if not session.done.wait(remaining):
+                return False
+        return True
+
+    def close(self):
+        """Stop the scheduler; sessions still playing are cut short."""
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join()
+        for session in self.sessions:
+            if session.ring is not None:
+                session.ring.close()
+            session.done.set()
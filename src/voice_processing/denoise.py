@@ -0,0 +1,202 @@
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from data_management.session_recorder import SessionRecorder
+from voice_processing.audio_capture import load_samples
+from voice_processing.pcm import float_to_int16
+from voice_processing.vad import Utterance, VoiceActivityDetector
+
+
+class SpectralGate:
+    """
+    Spectral-gating noise suppression for float32 mono audio.
+
+    The audio is taken apart into overlapping frames (frame_ms, half
+    overlapping, square-root Hann windows so that untouched frames add back
+    up exactly) and every frequency bin of every frame is scaled by a gain:
+    1 where its power is more than threshold_db above the noise spectrum,
+    falling to reduction_db of attenuation a few dB below that. Gains are
+    held for hold frames and blurred across neighbouring bins, which keeps
+    the isolated bins that survive gating from turning into "musical"
+    warbling. All frames of a call are processed at once.
+
+    The noise spectrum is learned only from audio that the voice activity
+    detector found to be silence: process(..., silence=True) for the live
+    path, or the gaps between VAD segments for a whole recording (denoise).
+    Until there is one, audio passes through unchanged.
+
+    process() is streaming: output is time-aligned with the input (sample i
+    out is sample i in), but each sample only comes out once the frame after
+    it has arrived, latency seconds later. flush() returns the rest.
+    """
+
+    def __init__(self, rate: int = 16000, frame_ms: float = 32.0, threshold_db: float = 6.0,
+                 reduction_db: float = 12.0, softness_db: float = 3.0, hold: int = 3, noise_rate: float = 0.05):
+        self.rate = rate
+        self.frame = 2 * (int(rate * frame_ms / 1000) // 2)
+        self.hop = self.frame // 2
+        self.window = np.sqrt(np.hanning(self.frame + 1)[:-1]).astype(np.float32)  # periodic: halves sum to 1
+        self.threshold_db = threshold_db
+        self.floor = 10 ** (-reduction_db / 20)
+        self.softness_db = softness_db
+        self.hold = max(1, hold)
+        self.noise_rate = noise_rate
+        self.noise: Optional[np.ndarray] = None
+        self.reset()
+
+    @property
+    def latency(self) -> float:
+        """Seconds from a sample arriving to its denoised sample being returned."""
+        return (self.frame - self.hop) / self.rate
+
+    def reset(self, keep_noise: bool = True):
+        """Start a new stream; the noise spectrum is kept unless keep_noise is False."""
+        if not keep_noise:
+            self.noise = None
+        # Leading zeros so the first samples are covered by two frames like every other sample
+        self._pending = np.zeros(self.frame - self.hop, dtype=np.float32)
+        self._overlap = np.zeros(self.hop, dtype=np.float32)
+        self._gains = np.ones((self.hold - 1, self.frame // 2 + 1), dtype=np.float32)
+        self._skip = self.frame - self.hop  # output of the leading zeros
+        self._received = 0
+        self._returned = 0
+        self.stats = {'seconds': 0.0, 'noise_frames': 0, 'attenuation_db': 0.0}
+        self._energy = [0.0, 0.0]  # spectral energy in and out, for attenuation_db
+
+    def learn(self, power: np.ndarray):
+        """Move the noise spectrum towards the mean of these (frames, bins) noise power spectra."""
+        if not len(power):
+            return
+        target = power.mean(axis=0)
+        if self.noise is None:
+            self.noise = target.astype(np.float32)
+        else:
+            self.noise += (1.0 - (1.0 - self.noise_rate) ** len(power)) * (target - self.noise)
+        self.stats['noise_frames'] += len(power)
+
+    def spectra(self, samples: np.ndarray) -> np.ndarray:
+        """Spectra of the whole frames in samples (frames starting every hop)."""
+        count = (len(samples) - self.frame) // self.hop + 1
+        if count <= 0:
+            return np.zeros((0, self.frame // 2 + 1), dtype=np.complex64)
+        return np.fft.rfft(sliding_window_view(samples, self.frame)[::self.hop][:count] * self.window, axis=1)
+
+    def gains(self, power: np.ndarray) -> np.ndarray:
+        """Per-bin gains for (frames, bins) power spectra, continuing the hold from the previous call."""
+        if self.noise is None:
+            return np.ones_like(power, dtype=np.float32)
+        snr_db = 10 * np.log10(power / (self.noise + 1e-12) + 1e-12)
+        # Soft knee from threshold - softness (fully attenuated) to threshold + softness (untouched)
+        open_ = np.clip((snr_db - self.threshold_db + self.softness_db) / (2 * self.softness_db), 0.0, 1.0)
+        raw = (self.floor + (1 - self.floor) * open_).astype(np.float32)
+        # Hold: a bin stays open for hold frames after it was last above the threshold
+        history = np.concatenate((self._gains, raw))
+        held = sliding_window_view(history, self.hold, axis=0).max(axis=2) if self.hold > 1 else history
+        self._gains = history[len(history) - (self.hold - 1):]
+        # Blur across neighbouring bins
+        smoothed = held.copy()
+        smoothed[:, 1:-1] = 0.25 * held[:, :-2] + 0.5 * held[:, 1:-1] + 0.25 * held[:, 2:]
+        return smoothed
+
+    def process(self, audio, silence: bool = False) -> np.ndarray:
+        """
+        Denoise the next chunk (float32 bytes or array); returns the denoised
+        samples that are ready. With silence, the chunk's frames are also
+        learned as noise (the caller's VAD judged this audio not to be speech).
+        """
+        samples = np.frombuffer(audio, dtype=np.float32) if isinstance(audio, (bytes, bytearray, memoryview)) \
+            else np.asarray(audio, dtype=np.float32)
+        self._received += len(samples)
+        self.stats['seconds'] += len(samples) / self.rate
+        buffer = np.concatenate((self._pending, samples))
+        spectra = self.spectra(buffer)
+        count = len(spectra)
+        self._pending = buffer[count * self.hop:]
+        if not count:
+            return np.zeros(0, dtype=np.float32)
+        power = spectra.real ** 2 + spectra.imag ** 2
+        if silence:
+            self.learn(power)
+        gains = self.gains(power)
+        self._energy[0] += float(power.sum())
+        self._energy[1] += float((power * gains ** 2).sum())
+        self.stats['attenuation_db'] = 10 * np.log10((self._energy[0] + 1e-12) / (self._energy[1] + 1e-12))
+        frames = np.fft.irfft(spectra * gains, self.frame, axis=1).astype(np.float32) * self.window
+        # Half-overlapping frames: each hop of output is one frame's first half plus the previous frame's second
+        output = frames[:, :self.hop].copy()
+        output[0] += self._overlap
+        output[1:] += frames[:-1, self.hop:]
+        self._overlap = frames[-1, self.hop:].copy()
+        output = output.ravel()
+        skip, self._skip = min(self._skip, len(output)), self._skip - min(self._skip, len(output))
+        output = output[skip:]
+        self._returned += len(output)
+        return output
+
+    def flush(self) -> np.ndarray:
+        """End of stream: the remaining denoised samples."""
+        remaining = self._received - self._returned
+        if remaining <= 0:
+            return np.zeros(0, dtype=np.float32)
+        received, seconds = self._received, self.stats['seconds']
+        output = self.process(np.zeros(self.frame, dtype=np.float32))[:remaining]
+        self._received = self._returned = received
+        self.stats['seconds'] = seconds
+        return output
+
+    def report(self) -> str:
+        """Totals for the current stream."""
+        stats = self.stats
+        learned = f"{stats['noise_frames'] * self.hop / self.rate:.1f}s of noise learned" if self.noise is not None \
+            else "no noise learned yet (passing audio through)"
+        return (f"Noise suppression: {stats['seconds']:.1f}s processed, {learned}, "
+                f"{stats['attenuation_db']:.1f} dB removed overall, {self.latency * 1000:.0f} ms latency")
+
+    def denoise(self, samples: np.ndarray, segments: Optional[Sequence[Utterance]] = None) -> np.ndarray:
+        """
+        Denoise a whole recording, with the noise spectrum learned from the
+        audio between its VAD segments (found here unless given).
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if segments is None:
+            segments = VoiceActivityDetector(rate=self.rate).segments(samples, prime=True)
+        self.reset(keep_noise=False)
+        self.learn(self.silence_power(samples, segments))
+        return np.concatenate((self.process(samples), self.flush()))
+
+    def silence_power(self, samples: np.ndarray, segments: Sequence[Utterance]) -> np.ndarray:
+        """Power spectra of the frames that lie wholly outside every segment."""
+        covered = np.zeros(len(samples) + 1, dtype=np.int64)
+        for segment in segments:
+            covered[int(segment.start * self.rate)] += 1
+            covered[min(int(segment.end * self.rate), len(samples))] -= 1
+        # Running count of speech samples, so a frame's share is a difference of two entries
+        speech = np.concatenate(([0], np.cumsum(np.cumsum(covered)[:-1] > 0)))
+        spectra = self.spectra(samples)
+        starts = np.arange(len(spectra)) * self.hop
+        spectra = spectra[speech[starts + self.frame] == speech[starts]]
+        return spectra.real ** 2 + spectra.imag ** 2
+
+def denoise_file(path: Path, out_path: Path, rate: int = 16000) -> Path:
+    """Write a denoised 16-bit mono WAV at rate of a recording (WAV, or anything pydub decodes)."""
+    samples = SpectralGate(rate).denoise(load_samples(path, rate))
+    pcm16 = float_to_int16(samples, np.empty(len(samples), dtype='<i2'), np.empty_like(samples))
+    recorder = SessionRecorder(Path(out_path), rate=rate, channels=1, sample_width=2, is_float=False)
+    recorder.write(pcm16.tobytes())
+    recorder.close()
+    return Path(out_path)
+
+
+@contextmanager
+def denoised_copy(path: Path, enabled: bool = True) -> Iterator[Path]:
+    """The file to send to ASR: a temporary denoised WAV of path, or path itself when not enabled."""
+    if not enabled:
+        yield Path(path)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        yield denoise_file(path, Path(directory) / f"{Path(path).stem}_denoised.wav")
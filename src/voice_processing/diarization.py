@@ -0,0 +1,316 @@
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from voice_processing.audio_capture import load_samples
+from voice_processing.vad import Utterance, VoiceActivityDetector
+
+BHW = "BHW"
+PATIENT = "Pasiente"
+
+FRAME_SECONDS = 0.025
+HOP_SECONDS = 0.010
+MEL_BANDS = 40
+CEPSTRA = 20  # c1..c19 are kept; c0 is only loudness
+PITCH_RANGE = (70.0, 400.0)
+PITCH_WEIGHT = 3.0  # pitch counts as this many cepstral dimensions
+
+# Written by enroll_bhw.py
+BHW_PROFILE = Path("data/bhw_profile.npy")
+
+
+class SpeakerTurn(NamedTuple):
+    """A VAD segment attributed to a speaker; start and end are seconds from the start of the recording."""
+    start: float
+    end: float
+    speaker: str
+
+
+def _mel_filterbank(rate: int, size: int, bands: int = MEL_BANDS, low: float = 80.0,
+                    high: Optional[float] = None) -> np.ndarray:
+    """(size // 2 + 1, bands) triangular filters evenly spaced on the mel scale."""
+    high = min(high or 7600.0, rate / 2)
+    mel = lambda hz: 2595 * np.log10(1 + hz / 700)
+    edges = 700 * (10 ** (np.linspace(mel(low), mel(high), bands + 2) / 2595) - 1)
+    bins = np.fft.rfftfreq(size, 1 / rate)[:, None]
+    rising = (bins - edges[:-2]) / (edges[1:-1] - edges[:-2])
+    falling = (edges[2:] - bins) / (edges[2:] - edges[1:-1])
+    return np.maximum(0, np.minimum(rising, falling)).astype(np.float32)
+
+
+def _dct_matrix(bands: int, count: int) -> np.ndarray:
+    n = np.arange(bands)
+    return np.cos(np.pi / bands * (n[:, None] + 0.5) * np.arange(count)).astype(np.float32)
+
+
+class SpeakerEmbedder:
+    """
+    Fixed-length voice descriptors for speech segments, computed on the CPU
+    with NumPy: the mean and spread of the MFCCs (vocal tract shape and
+    timbre) plus the median pitch, over the louder frames of the segment.
+    They only need to tell apart the few voices within one visit, so
+    nothing is trained; embeddings are compared after standardizing them
+    across the visit (see normalize).
+    """
+
+    def __init__(self, rate: int = 16000):
+        self.rate = rate
+        self.frame = int(FRAME_SECONDS * rate)
+        self.hop = int(HOP_SECONDS * rate)
+        self.size = 1 << (self.frame - 1).bit_length()
+        self.window = np.hamming(self.frame).astype(np.float32)
+        self.mel = _mel_filterbank(rate, self.size)
+        self.dct = _dct_matrix(MEL_BANDS, CEPSTRA)
+        self.lags = (int(rate / PITCH_RANGE[1]), int(rate / PITCH_RANGE[0]))
+
+    @property
+    def dimensions(self) -> int:
+        return 2 * (CEPSTRA - 1) + 1
+
+    def power(self, samples: np.ndarray) -> np.ndarray:
+        """(frames, bins) power spectra, or an empty array if samples are shorter than a frame."""
+        samples = np.ascontiguousarray(samples, dtype=np.float32)
+        count = max(0, (len(samples) - self.frame) // self.hop + 1)
+        frames = np.lib.stride_tricks.as_strided(
+            samples, (count, self.frame), (samples.strides[0] * self.hop, samples.strides[0])) * self.window
+        spectrum = np.fft.rfft(frames, self.size, axis=1)
+        return spectrum.real ** 2 + spectrum.imag ** 2
+
+    def embed(self, samples: np.ndarray, noise: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """
+        Embedding of float32 mono samples, or None if they are shorter than a
+        few frames. With a noise power spectrum (see power), it is subtracted
+        first, so quiet and loud lines of one speaker in the same room still
+        look alike.
+        """
+        power = self.power(samples)
+        if len(power) < 5:
+            return None
+        if noise is not None:
+            power = np.maximum(power - noise, 0.05 * power)
+        energy = 10 * np.log10(power.sum(axis=1) + 1e-10)
+        # Padding, pauses between words and breath say little about the voice
+        loud = energy > energy.max() - 30
+        cepstra = (np.log(power[loud] @ self.mel + 1e-10) @ self.dct)[:, 1:]
+        # Pitch from the autocorrelation peak of voiced frames
+        autocorrelation = np.fft.irfft(power[loud], self.size, axis=1)
+        low, high = self.lags
+        peaks = low + np.argmax(autocorrelation[:, low:high], axis=1)
+        strength = autocorrelation[np.arange(len(peaks)), peaks] / (autocorrelation[:, 0] + 1e-10)
+        voiced = peaks[strength > 0.4]
+        pitch = np.log(self.rate / np.median(voiced)) if len(voiced) else np.nan
+        return np.concatenate([cepstra.mean(axis=0), cepstra.std(axis=0), [pitch]]).astype(np.float32)
+
+
+def normalize(embeddings: np.ndarray, reference: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Standardize each dimension across the visit's segments and scale to unit
+    length, so cosine similarity weighs what differs between these voices
+    rather than what is common to the room and microphone. reference (e.g.
+    an enrolled profile) is mapped with the same statistics.
+    """
+    values = embeddings if reference is None else reference[None, :]
+    mean, std = np.nanmean(embeddings, axis=0), np.nanstd(embeddings, axis=0) + 1e-6
+    scaled = np.nan_to_num((values - mean) / std)  # no pitch found: treat as average
+    scaled[:, -1] *= np.sqrt(PITCH_WEIGHT)
+    return scaled / (np.linalg.norm(scaled, axis=1, keepdims=True) + 1e-10)
+
+
+def cluster(embeddings: np.ndarray, num_speakers: Optional[int] = None, threshold: float = 1.15,
+            max_speakers: int = 4) -> np.ndarray:
+    """
+    Average-linkage agglomerative clustering of unit-length embeddings by
+    cosine distance. Merges until num_speakers clusters remain, or, when the
+    count is not known, until the closest pair is further apart than
+    threshold (but never leaves more than max_speakers). Returns a cluster
+    index per embedding, numbered in order of first appearance.
+    """
+    count = len(embeddings)
+    if count == 0:
+        return np.zeros(0, dtype=int)
+    target = min(num_speakers or 1, count)
+    distance = 1 - embeddings @ embeddings.T
+    np.fill_diagonal(distance, np.inf)
+    sizes = np.ones(count)
+    labels = np.arange(count)
+    for clusters in range(count, target, -1):
+        a, b = divmod(int(np.argmin(distance)), count)
+        if num_speakers is None and clusters <= max_speakers and distance[a, b] > threshold:
+            break
+        # Average linkage: the merged cluster's distance to each other is the size-weighted mean
+        merged = (sizes[a] * distance[a] + sizes[b] * distance[b]) / (sizes[a] + sizes[b])
+        distance[a], distance[:, a] = merged, merged
+        distance[a, a] = np.inf
+        distance[b], distance[:, b] = np.inf, np.inf
+        sizes[a] += sizes[b]
+        labels[labels == b] = a
+    _, first, numbered = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    return order[numbered]
+
+
+class Diarizer:
+    """
+    Who spoke when, locally: the voice activity detector cuts the recording
+    into segments, each long enough segment gets a SpeakerEmbedder
+    embedding, and the embeddings are clustered into speakers. Segments too
+    short to embed reliably are given the speaker of the nearest cluster
+    centre instead of taking part in the clustering.
+
+    The BHW is the speaker closest to an enrolled voice profile when one is
+    given (see enroll), and otherwise whoever speaks first, since the BHW
+    opens the visit. The other speaker is the patient; further voices
+    (a relative, a midwife) are numbered.
+    """
+
+    def __init__(self, rate: int = 16000, num_speakers: Optional[int] = 2, threshold: float = 1.15,
+                 min_segment: float = 1.0, profile: Optional[np.ndarray] = None):
+        self.rate = rate
+        self.num_speakers = num_speakers
+        self.threshold = threshold
+        self.min_segment = min_segment
+        self.profile = profile
+        self.embedder = SpeakerEmbedder(rate)
+        self.vad = VoiceActivityDetector(rate=rate)
+
+    def segments(self, samples: np.ndarray) -> List[Utterance]:
+        """VAD segments of a whole recording, with the noise spectrum learned first so opening lines are not merged."""
+        return self.vad.segments(samples, prime=True)
+
+    def diarize(self, samples: np.ndarray, segments: Optional[Sequence[Utterance]] = None) -> List[SpeakerTurn]:
+        """Speaker turns for float32 mono samples at self.rate (VAD segments unless given)."""
+        segments = self.segments(samples) if segments is None else segments
+        if not segments:
+            return []
+        noise = self.noise(samples, segments)
+        embeddings = np.full((len(segments), self.embedder.dimensions), np.nan, dtype=np.float32)
+        embedded = np.zeros(len(segments), dtype=bool)
+        for index, segment in enumerate(segments):
+            audio = samples[int(segment.start * self.rate):int(segment.end * self.rate)]
+            embedding = self.embedder.embed(audio, noise)
+            if embedding is not None:
+                embeddings[index] = embedding
+                embedded[index] = True
+        durations = np.array([segment.end - segment.start for segment in segments])
+        anchors = embedded & (durations >= self.min_segment)
+        if anchors.sum() < 2:
+            anchors = embedded
+        if not anchors.any():
+            return [SpeakerTurn(segment.start, segment.end, BHW) for segment in segments]
+        vectors = normalize(embeddings[anchors])
+        labels = np.zeros(len(segments), dtype=int)
+        labels[anchors] = cluster(vectors, self.num_speakers, self.threshold)
+        centres = np.array([vectors[labels[anchors] == label].mean(axis=0) for label in range(labels.max() + 1)])
+        rest = ~anchors & embedded
+        if rest.any():
+            # Standardized with the anchors' statistics, then the nearest centre
+            stats = embeddings[anchors]
+            others = np.array([normalize(stats, reference)[0] for reference in embeddings[rest]])
+            labels[rest] = np.argmax(others @ centres.T, axis=1)
+        # Unembeddable scraps stay with the previous speaker
+        for index in np.flatnonzero(~embedded):
+            labels[index] = labels[index - 1] if index else labels[np.argmax(embedded)]
+        names = self._names(centres, normalize(embeddings[anchors], self.profile)[0]
+                            if self.profile is not None else None, labels)
+        return [SpeakerTurn(segment.start, segment.end, names[label]) for segment, label in zip(segments, labels)]
+
+    def noise(self, samples: np.ndarray, segments: Sequence[Utterance]) -> Optional[np.ndarray]:
+        """Mean power spectrum of the audio between segments, or None if there is too little of it."""
+        gaps, position = [], 0
+        for segment in list(segments) + [Utterance(len(samples) / self.rate, 0, b"")]:
+            start = int(segment.start * self.rate)
+            if start - position >= self.embedder.frame:
+                gaps.append(self.embedder.power(samples[position:start]))
+            position = max(position, int(segment.end * self.rate))
+        power = np.concatenate(gaps) if gaps else np.zeros((0, self.embedder.size // 2 + 1))
+        return power.mean(axis=0) if len(power) >= 10 else None
+
+    def _names(self, centres: np.ndarray, profile: Optional[np.ndarray], labels: np.ndarray) -> List[str]:
+        """Role names per cluster: the BHW (by profile, else first to speak), the patient, then the others."""
+        bhw = int(np.argmax(centres @ profile)) if profile is not None else int(labels[0])
+        names, others = [None] * len(centres), 0
+        for label in range(len(centres)):
+            if label == bhw:
+                names[label] = BHW
+            else:
+                others += 1
+                names[label] = PATIENT if others == 1 else f"Speaker {others + 1}"
+        return names
+
+    def enroll(self, samples: np.ndarray) -> np.ndarray:
+        """A voice profile from a recording of the BHW alone: the mean embedding of their speech segments."""
+        segments = self.segments(samples)
+        noise = self.noise(samples, segments)
+        embeddings = [self.embedder.embed(samples[int(segment.start * self.rate):int(segment.end * self.rate)], noise)
+                      for segment in segments]
+        embeddings = [embedding for embedding in embeddings if embedding is not None]
+        if not embeddings:
+            raise ValueError("No speech found to enroll")
+        return np.nanmean(embeddings, axis=0)
+
+
+def diarize_file(path: Path, asr_segments: Iterable, profile: Optional[np.ndarray] = None,
+                 num_speakers: Optional[int] = 2) -> str:
+    """[MM:SS] Speaker: Text transcript of a recording from its timed ASR segments."""
+    diarizer = Diarizer(num_speakers=num_speakers, profile=profile)
+    turns = diarizer.diarize(load_samples(path, diarizer.rate))
+    return format_transcript(label_transcript(asr_segments, turns))
+
+
+def save_bhw_profile(profile: np.ndarray, path: Path = BHW_PROFILE):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(path, profile)
+
+
+def load_bhw_profile(path: Path = BHW_PROFILE) -> Optional[np.ndarray]:
+    """The enrolled BHW voice profile, or None (BHW identified as the first speaker) if none was saved."""
+    path = Path(path)
+    return np.load(path) if path.exists() else None
+
+
+def segment_field(segment, name: str):
+    """Field of an ASR segment, whether the client returned objects or dicts."""
+    return segment[name] if isinstance(segment, dict) else getattr(segment, name)
+
+
+def label_transcript(asr_segments: Iterable, turns: Sequence[SpeakerTurn]) -> List[Tuple[float, str, str]]:
+    """
+    Attribute timed ASR segments (with start, end and text) to the speaker
+    whose turns overlap them most, or whose turn is nearest if none do, and
+    join consecutive segments by the same speaker. Returns (start, speaker,
+    text) lines.
+    """
+    starts = np.array([turn.start for turn in turns])
+    ends = np.array([turn.end for turn in turns])
+    lines = []
+    for segment in asr_segments:
+        start, end = float(segment_field(segment, 'start')), float(segment_field(segment, 'end'))
+        text = str(segment_field(segment, 'text')).strip()
+        if not text:
+            continue
+        if turns:
+            overlap = np.minimum(ends, end) - np.maximum(starts, start)
+            if overlap.max() > 0:
+                totals = {}
+                for turn, seconds in zip(turns, overlap):
+                    if seconds > 0:
+                        totals[turn.speaker] = totals.get(turn.speaker, 0) + seconds
+                speaker = max(totals, key=totals.get)
+            else:
+                gap = np.maximum(starts - end, start - ends)
+                speaker = turns[int(np.argmin(gap))].speaker
+        else:
+            speaker = BHW
+        if lines and lines[-1][1] == speaker:
+            lines[-1] = (lines[-1][0], speaker, f"{lines[-1][2]} {text}")
+        else:
+            lines.append((start, speaker, text))
+    return lines
+
+
+def format_transcript(lines: Iterable[Tuple[float, str, str]]) -> str:
+    """[MM:SS] Speaker: Text lines, the format the synthetic dialogues and the analysis prompts use."""
+    return "\n".join(f"[{int(start) // 60:02d}:{int(start) % 60:02d}] {speaker}: {text}"
+                     for start, speaker, text in lines)
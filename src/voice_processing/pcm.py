@@ -0,0 +1,282 @@
+from math import gcd
+from typing import Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from data_management.session_recorder import HEADER, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM
+
+INT16_SCALE = 32768.0
+
+
+class AudioBuffer:
+    """
+    Reusable sample storage: a preallocated NumPy array that grows (by
+    doubling) only when asked to hold more than ever before, so steady-state
+    processing of same-sized chunks allocates nothing. view(frames) returns
+    the first frames as an array, and data(frames) as a memoryview of bytes;
+    both alias the buffer and are only valid until it is next written.
+    """
+
+    def __init__(self, dtype=np.float32, channels: int = 1, frames: int = 4096):
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.array = np.zeros((frames, channels), dtype=self.dtype)
+        self.reallocations = 0
+        # (array view, byte memoryview) per length asked for; a chunked stream uses one or two
+        self._views = {}
+
+    @property
+    def capacity(self) -> int:
+        return len(self.array)
+
+    def reserve(self, frames: int) -> np.ndarray:
+        """Room for at least frames; returns the (frames, channels) view."""
+        if frames > len(self.array):
+            grown = np.zeros((max(frames, 2 * len(self.array)), self.channels), dtype=self.dtype)
+            grown[:len(self.array)] = self.array
+            self.array = grown
+            self.reallocations += 1
+            self._views.clear()
+        return self._cached(frames)[0]
+
+    def _cached(self, frames: int):
+        views = self._views.get(frames)
+        if views is None:
+            if len(self._views) > 16:
+                self._views.clear()
+            view = self.array[:frames]
+            views = self._views[frames] = (view, view.data.cast('B'))
+        return views
+
+    def view(self, frames: int) -> np.ndarray:
+        return self._cached(frames)[0]
+
+    def data(self, frames: int) -> memoryview:
+        return self._cached(frames)[1]
+
+
+def as_samples(audio, dtype=np.float32, channels: int = 1) -> np.ndarray:
+    """Zero-copy (frames, channels) view of bytes, a memoryview or an array holding dtype samples."""
+    if isinstance(audio, np.ndarray):
+        return audio.reshape(-1, channels) if audio.ndim == 1 else audio
+    return np.frombuffer(audio, dtype=dtype).reshape(-1, channels)
+
+
+def float_to_int16(samples: np.ndarray, out: np.ndarray, scratch: np.ndarray) -> np.ndarray:
+    """
+    Convert float samples in [-1, 1] to 16-bit PCM (clipped, rounded to
+    nearest) into out, using scratch (float32, same shape) as work space.
+    No temporaries are allocated.
+    """
+    np.multiply(samples, INT16_SCALE, out=scratch)
+    np.rint(scratch, out=scratch)
+    # np.clip(out=...) still allocates a temporary; minimum/maximum do not
+    np.minimum(scratch, 32767.0, out=scratch)
+    np.maximum(scratch, -32768.0, out=scratch)
+    np.copyto(out, scratch, casting='unsafe')
+    return out
+
+
+def int16_to_float(samples: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Convert 16-bit PCM to float32 in [-1, 1) into out, without temporaries."""
+    np.copyto(out, samples, casting='unsafe')
+    out *= np.float32(1.0 / INT16_SCALE)
+    return out
+
+
+def mix_channels(samples: np.ndarray, out: np.ndarray, matrix: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Mix (frames, channels_in) samples into (frames, channels_out) out. Without
+    a matrix, channels are averaged down to mono or copied up from mono.
+    """
+    channels_in, channels_out = samples.shape[1], out.shape[1]
+    if matrix is not None:
+        return np.matmul(samples, matrix, out=out)
+    if channels_in == channels_out:
+        np.copyto(out, samples, casting='unsafe')
+    elif channels_out == 1:
+        np.add.reduce(samples, axis=1, out=out[:, 0])
+        out *= out.dtype.type(1.0 / channels_in)
+    elif channels_in == 1:
+        np.copyto(out, samples, casting='unsafe')
+    else:
+        raise ValueError(f"No default mix from {channels_in} to {channels_out} channels; pass a matrix")
+    return out
+
+
+def pack_wav_header(buffer, rate: int, channels: int, sample_width: int, is_float: bool, data_bytes: int) -> memoryview:
+    """
+    Write a WAV header for data_bytes of audio into buffer (at least
+    HEADER.size bytes, e.g. a reused bytearray) and return a view of it;
+    send it followed by the sample memoryview to frame a WAV without joining
+    the two.
+    """
+    block_align = channels * sample_width
+    HEADER.pack_into(
+        buffer, 0,
+        b"RIFF", HEADER.size - 8 + data_bytes, b"WAVE",
+        b"fmt ", 18, WAVE_FORMAT_IEEE_FLOAT if is_float else WAVE_FORMAT_PCM, channels, rate,
+        rate * block_align, block_align, sample_width * 8, 0,
+        b"fact", 4, data_bytes // block_align,
+        b"data", data_bytes,
+    )
+    return memoryview(buffer)[:HEADER.size]
+
+
+class Resampler:
+    """
+    Streaming polyphase resampler for a rational ratio rate_out/rate_in.
+
+    A Kaiser-windowed sinc low-pass (cut off below the lower of the two
+    Nyquist rates, so downsampling does not alias) is split into one
+    short filter per output phase. Each phase is applied only to the input
+    windows whose outputs are kept, so nothing discarded is computed, and
+    nothing is allocated per call once the buffers have grown to the chunk
+    size. Output lags input by delay seconds.
+    """
+
+    def __init__(self, rate_in: int, rate_out: int, channels: int = 1, taps_per_phase: int = 24,
+                 beta: float = 8.0, cutoff: float = 0.9):
+        divisor = gcd(rate_in, rate_out)
+        self.rate_in, self.rate_out = rate_in, rate_out
+        self.up, self.down = rate_out // divisor, rate_in // divisor
+        self.channels = channels
+        # Downsampling needs a proportionally longer filter for the same transition band
+        self.taps = int(np.ceil(taps_per_phase * max(1.0, self.down / self.up)))
+        length = self.taps * self.up
+        # Cut-off relative to the upsampled rate
+        fc = cutoff * 0.5 / max(self.up, self.down)
+        # Centred on a multiple of down, so the delay is a whole number of output samples and
+        # can be trimmed exactly; the few taps past the symmetric window are zero
+        half = (length - 1) // 2 // self.down * self.down
+        n = np.arange(length) - half
+        window = np.zeros(length)
+        window[:2 * half + 1] = np.kaiser(2 * half + 1, beta)
+        prototype = 2 * fc * np.sinc(2 * fc * n) * window * self.up
+        # phases[p, k] = prototype[p + k * up], reversed so a window of ascending input lines up
+        self.phases = np.ascontiguousarray(prototype.reshape(self.taps, self.up).T[:, ::-1], dtype=np.float32)
+        self.delay = half / (rate_in * self.up)
+        self.phases_t = np.ascontiguousarray(self.phases.T)
+        self._history = AudioBuffer(np.float32, channels)
+        self._block = AudioBuffer(np.float32, self.taps)  # (rows, taps) copies of the input windows
+        self._windows, self._windows_of = [], None
+        self.reset()
+
+    def reset(self):
+        """Start a new stream."""
+        self._next_output = 0            # index of the next output sample
+        self._first = -(self.taps - 1)   # input index at the start of the history (zeros before the stream)
+        self._filled = self.taps - 1
+        self._history.reserve(self._filled)[:] = 0
+
+    def process(self, samples, out: AudioBuffer) -> np.ndarray:
+        """Resample (frames, channels) float32 samples; returns the view of out holding the result."""
+        samples = as_samples(samples, np.float32, self.channels)
+        frames = len(samples)
+        last = self._first + self._filled + frames - 1  # index of the newest input sample
+        end = ((last + 1) * self.up - 1) // self.down + 1  # outputs whose inputs have all arrived
+        count = end - self._next_output
+        result = out.reserve(count)
+        history = self._history.reserve(self._filled + frames)
+        history[self._filled:] = samples
+        if self._windows_of is not self._history.array:
+            # Built once per history allocation; as_strided views are not free to make
+            self._windows = [sliding_window_view(self._history.array[:, channel], self.taps)
+                             for channel in range(self.channels)]
+            self._windows_of = self._history.array
+        # Overlapping windows are copied into a contiguous block first so the products run in BLAS
+        # rather than NumPy's strided loop - several times faster even with the copy
+        if self.down == 1 and count:
+            # Each input sample gives one output per phase, in phase order: one matrix product
+            rows = count // self.up
+            start = self._next_output // self.up - (self.taps - 1) - self._first
+            block = self._block.reserve(rows)
+            interleaved = result.reshape(rows, self.up, self.channels)
+            for channel, windows in enumerate(self._windows):
+                np.copyto(block, windows[start:start + rows])
+                np.matmul(block, self.phases_t, out=interleaved[:, :, channel])
+        else:
+            for residue in range(min(self.up, count)):
+                n = self._next_output + residue
+                phase = (n * self.down) % self.up
+                row = (n * self.down) // self.up - (self.taps - 1) - self._first
+                outputs = (count - residue + self.up - 1) // self.up
+                block = self._block.reserve(outputs)
+                for channel, windows in enumerate(self._windows):
+                    np.copyto(block, windows[row:row + (outputs - 1) * self.down + 1:self.down])
+                    np.matmul(block, self.phases[phase], out=result[residue::self.up, channel])
+        self._next_output = end
+        self._filled += frames
+        # Keep only the input that later outputs still need
+        drop = (end * self.down) // self.up - (self.taps - 1) - self._first
+        if drop > 0:
+            array = self._history.array
+            array[:self._filled - drop] = array[drop:self._filled]
+            self._filled -= drop
+            self._first += drop
+        return result
+
+
+class PcmConverter:
+    """
+    One reusable conversion chain for captured audio: float32 or 16-bit
+    input -> channel mix -> resample -> float32 or 16-bit output. convert()
+    returns a memoryview over the converter's own output buffer, valid until
+    the next call, so a stream of equal-sized chunks is converted with no
+    per-chunk allocation once the first chunk has sized the buffers.
+    """
+
+    def __init__(self, rate_in: int = 16000, channels_in: int = 1, int16_in: bool = False,
+                 rate_out: Optional[int] = None, channels_out: Optional[int] = None, int16_out: bool = True,
+                 matrix: Optional[np.ndarray] = None):
+        self.rate_in, self.rate_out = rate_in, rate_out or rate_in
+        self.channels_in, self.channels_out = channels_in, channels_out or channels_in
+        self.int16_in, self.int16_out = int16_in, int16_out
+        self.matrix = None if matrix is None else np.asarray(matrix, dtype=np.float32)
+        self.resampler = Resampler(self.rate_in, self.rate_out, self.channels_out) \
+            if self.rate_out != self.rate_in else None
+        self._float = AudioBuffer(np.float32, self.channels_in)
+        self._mixed = AudioBuffer(np.float32, self.channels_out)
+        self._resampled = AudioBuffer(np.float32, self.channels_out)
+        self._scratch = AudioBuffer(np.float32, self.channels_out)
+        self._out = AudioBuffer(np.int16 if int16_out else np.float32, self.channels_out)
+        self._header = bytearray(HEADER.size)
+
+    @property
+    def sample_width(self) -> int:
+        return 2 if self.int16_out else 4
+
+    @property
+    def delay(self) -> float:
+        """Seconds by which output lags input (the resampler's filter delay)."""
+        return self.resampler.delay if self.resampler is not None else 0.0
+
+    @property
+    def reallocations(self) -> int:
+        buffers = (self._float, self._mixed, self._resampled, self._scratch, self._out)
+        if self.resampler is not None:
+            buffers += (self.resampler._history,)
+        return sum(buffer.reallocations for buffer in buffers)
+
+    def convert(self, audio) -> memoryview:
+        samples = as_samples(audio, np.int16 if self.int16_in else np.float32, self.channels_in)
+        frames = len(samples)
+        if self.int16_in:
+            samples = int16_to_float(samples, self._float.reserve(frames))
+        if self.channels_out != self.channels_in or self.matrix is not None:
+            samples = mix_channels(samples, self._mixed.reserve(frames), self.matrix)
+        if self.resampler is not None:
+            # Float output is resampled straight into the output buffer
+            samples = self.resampler.process(samples, self._resampled if self.int16_out else self._out)
+        frames = len(samples)
+        if self.int16_out:
+            float_to_int16(samples, self._out.reserve(frames), self._scratch.reserve(frames))
+        elif samples.base is not self._out.array:
+            np.copyto(self._out.reserve(frames), samples)
+        return self._out.data(frames)
+
+    def wav_header(self, data_bytes: int) -> memoryview:
+        """Header for data_bytes of this converter's output, written into a reused buffer."""
+        return pack_wav_header(self._header, self.rate_out, self.channels_out, self.sample_width,
+                               not self.int16_out, data_bytes)
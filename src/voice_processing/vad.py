@@ -0,0 +1,236 @@
+from collections import deque
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+
+class Utterance(NamedTuple):
+    """A stretch of speech; start and end are seconds from the start of the stream."""
+    start: float
+    end: float
+    audio: bytes  # float32 mono, padding included
+
+
+def frame_features(frames: np.ndarray, rate: int, band=(100.0, 4000.0)):
+    """
+    Per-frame zero-crossing rate (crossings per sample) and power spectrum
+    over the speech band for a (frames, samples) float array.
+    """
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frames.shape[1] - 1)
+    size = frames.shape[1]
+    low, high = int(band[0] * size / rate), int(band[1] * size / rate) + 1
+    power = np.abs(np.fft.rfft(frames * np.hanning(size).astype(np.float32), axis=1)[:, low:high]) ** 2
+    return zcr, power
+
+
+def spectral_flatness(power: np.ndarray) -> np.ndarray:
+    """Geometric over arithmetic mean per row: near 0 for harmonic spectra, about 0.56 for white noise."""
+    power = power + 1e-12
+    return np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+
+
+class VoiceActivityDetector:
+    """
+    Streaming voice activity detection and utterance segmentation.
+
+    Audio (float32 mono, as captured) is cut into frame_ms frames, and each
+    block of frames is classified at once from three features: energy in
+    the speech band relative to an adaptive noise spectrum (SNR), spectral
+    flatness of that noise-whitened spectrum and zero-crossing rate. A frame
+    starts or continues speech when its SNR reaches start_db and it is
+    either tonal (flatness below max_flatness, i.e. voiced) or noisy the way
+    fricatives are (zero-crossing rate above fricative_zcr); speech only
+    stops once the SNR drops below stop_db (hysteresis). An utterance ends
+    after hangover seconds without speech, so pauses between words do not
+    split it, and is returned with padding seconds of audio on either side.
+    Utterances with less than min_speech seconds of speech (clicks, knocks)
+    are dropped, and speech running longer than max_utterance is split.
+
+    The noise spectrum follows noise-like frames, falling quickly and rising
+    slowly. If a forced split finds that even the quietest part of the
+    "utterance" was well above it (a fan or generator switched on), it is
+    raised to match at once.
+    """
+
+    def __init__(self, rate: int = 16000, frame_ms: float = 20.0, start_db: float = 4.0, stop_db: float = 2.0,
+                 max_flatness: float = 0.3, fricative_zcr: float = 0.3, hangover: float = 0.3,
+                 padding: float = 0.1, min_speech: float = 0.15, max_utterance: float = 20.0,
+                 min_floor_db: float = -65.0, floor_fall: float = 0.3, floor_rise: float = 0.02):
+        self.rate = rate
+        self.frame = int(rate * frame_ms / 1000)
+        self.start_db = start_db
+        self.stop_db = stop_db
+        self.max_flatness = max_flatness
+        self.fricative_zcr = fricative_zcr
+        self.hangover_frames = max(1, round(hangover * rate / self.frame))
+        # Trailing padding must already have arrived when the hangover closes an utterance
+        self.padding = min(int(padding * rate), self.hangover_frames * self.frame)
+        self.min_speech_frames = round(min_speech * rate / self.frame)
+        self.max_frames = round(max_utterance * rate / self.frame)
+        self.min_floor_db = min_floor_db
+        self.floor_fall = floor_fall
+        self.floor_rise = floor_rise
+        self.block_frames = max(1, round(0.5 * rate / self.frame))
+        # Per-bin power of white noise at min_floor_db, so digital silence cannot make the floor vanish
+        self._min_noise_power = 10 ** (min_floor_db / 10) * float(np.sum(np.hanning(self.frame) ** 2))
+        self.reset()
+
+    def reset(self):
+        """Start a new stream."""
+        self.noise_spectrum: Optional[np.ndarray] = None
+        self.stats = {'seconds': 0.0, 'speech_seconds': 0.0, 'utterances': 0, 'discarded': 0, 'forced_splits': 0}
+        self._speaking = False
+        self._pending = np.empty(0, dtype=np.float32)  # samples short of a whole frame
+        self._frames = 0                               # frames classified so far
+        self._samples = 0                              # samples received so far
+        self._history = deque()                        # (first sample, block) still needed for padding/utterances
+        self._open: Optional[int] = None               # first frame of the utterance in progress
+        self._last_end = 0                             # frame after its last speech frame
+        self._speech_frames = 0
+        self._snrs: List[np.ndarray] = []              # frame SNRs of the utterance in progress
+
+    def process(self, audio) -> List[Utterance]:
+        """Feed captured audio (float32 bytes or array); returns the utterances it completed."""
+        samples = np.frombuffer(audio, dtype=np.float32) if isinstance(audio, (bytes, bytearray, memoryview)) \
+            else np.asarray(audio, dtype=np.float32)
+        if not len(samples):
+            return []
+        self._history.append((self._samples, samples))
+        self._samples += len(samples)
+        self.stats['seconds'] += len(samples) / self.rate
+
+        if len(self._pending):
+            samples = np.concatenate((self._pending, samples))
+        count = len(samples) // self.frame
+        self._pending = samples[count * self.frame:].copy()
+        utterances: List[Utterance] = []
+        frames = samples[:count * self.frame].reshape(count, self.frame)
+        # Classify in blocks of up to half a second so the noise floor keeps up within long inputs
+        for start in range(0, count, self.block_frames):
+            zcr, power = frame_features(frames[start:start + self.block_frames], self.rate)
+            if self.noise_spectrum is None:
+                quietest = int(power.sum(axis=1).argmin())
+                self.noise_spectrum = np.maximum(power[quietest], self._min_noise_power)
+            # Relative to the noise spectrum, background noise of any colour looks white and speech does not
+            relative = power / self.noise_spectrum
+            snr = 10.0 * np.log10(relative.mean(axis=1) + 1e-10)
+            flatness = spectral_flatness(relative)
+            speech = self._classify(snr, zcr, flatness)
+            self._segment(speech, snr, utterances)
+            # Learn from noise-like frames even mid-utterance, so a louder background cannot hold speech open
+            self._track_noise(power[(snr < self.stop_db) | ~speech | (flatness >= self.max_flatness) & (zcr <= self.fricative_zcr)])
+        self._trim_history()
+        return utterances
+
+    def flush(self) -> List[Utterance]:
+        """End of stream: close the utterance in progress."""
+        utterances: List[Utterance] = []
+        if self._open is not None:
+            self._close(utterances)
+        self._trim_history()
+        return utterances
+
+    def segments(self, audio, prime: bool = False) -> List[Utterance]:
+        """
+        All utterances in a complete recording, as a fresh stream. With prime,
+        a first pass learns the noise spectrum, so the opening seconds are
+        not misjudged while a live detector would still be adapting.
+        """
+        self.reset()
+        if prime:
+            self.process(audio)
+            noise = self.noise_spectrum
+            self.reset()
+            self.noise_spectrum = noise
+        return self.process(audio) + self.flush()
+
+    @property
+    def speaking(self) -> bool:
+        """An utterance is open: the latest audio is speech or within its hangover."""
+        return self._open is not None
+
+    def _classify(self, snr: np.ndarray, zcr: np.ndarray, flatness: np.ndarray) -> np.ndarray:
+        """Speech/non-speech per frame, with hysteresis carried over from the previous block."""
+        events = np.full(len(snr), -1, dtype=np.int8)
+        events[snr < self.stop_db] = 0
+        events[(snr >= self.start_db) & ((flatness < self.max_flatness) | (zcr > self.fricative_zcr))] = 1
+        # Each frame takes the most recent start/stop decision at or before it
+        last = np.where(events >= 0, np.arange(len(events)), -1)
+        np.maximum.accumulate(last, out=last)
+        speech = np.where(last >= 0, events[last] == 1, self._speaking)
+        self._speaking = bool(speech[-1])
+        return speech
+
+    def _segment(self, speech: np.ndarray, snr: np.ndarray, utterances: List[Utterance]):
+        """Turn runs of speech frames into utterances."""
+        first = self._frames
+        self._frames += len(speech)
+        if self._open is not None:
+            self._snrs.append(snr)
+        edges = np.flatnonzero(np.diff(speech, prepend=False, append=False))
+        for start, end in zip((edges[::2] + first).tolist(), (edges[1::2] + first).tolist()):
+            if self._open is not None and start - self._last_end > self.hangover_frames:
+                self._close(utterances)
+            if self._open is None:
+                self._open = start
+                self._snrs = [snr[start - first:]]
+            while end - self._open > self.max_frames:
+                # Speech running on too long: cut it here and carry on in a new utterance
+                split = self._open + self.max_frames
+                self._speech_frames += split - max(start, self._open)
+                self._last_end = split
+                self.stats['forced_splits'] += 1
+                self._close(utterances, forced=True)
+                self._open = split
+                self._snrs = [snr[split - first:]]
+            self._speech_frames += end - max(start, self._open)
+            self._last_end = end
+        if self._open is not None and self._frames - self._last_end > self.hangover_frames:
+            self._close(utterances)
+
+    def _close(self, utterances: List[Utterance], forced: bool = False):
+        open_frame, self._open = self._open, None
+        speech_frames, self._speech_frames = self._speech_frames, 0
+        snrs, self._snrs = self._snrs, []
+        if forced:
+            quiet = float(np.percentile(np.concatenate(snrs)[:self.max_frames], 10))
+            if quiet >= self.start_db:
+                self.noise_spectrum *= 10 ** (quiet / 10)
+                self._speaking = False
+        if speech_frames < self.min_speech_frames:
+            self.stats['discarded'] += 1
+            return
+        start = max(open_frame * self.frame - self.padding, 0)
+        end = min(self._last_end * self.frame + self.padding, self._samples)
+        utterances.append(Utterance(start / self.rate, end / self.rate, self._audio(start, end).tobytes()))
+        self.stats['utterances'] += 1
+        self.stats['speech_seconds'] += (end - start) / self.rate
+
+    def _track_noise(self, power: np.ndarray):
+        """Move the noise spectrum towards this block's non-speech frames."""
+        if not len(power):
+            return
+        target = power.mean(axis=0)
+        rate = self.floor_fall if target.sum() < self.noise_spectrum.sum() else self.floor_rise
+        self.noise_spectrum += (1.0 - (1.0 - rate) ** len(power)) * (target - self.noise_spectrum)
+        np.maximum(self.noise_spectrum, self._min_noise_power, out=self.noise_spectrum)
+
+    def _audio(self, start: int, end: int) -> np.ndarray:
+        """Samples [start, end) from the history."""
+        parts = [block[max(start - first, 0):end - first] for first, block in self._history
+                 if first < end and first + len(block) > start]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+
+    def _trim_history(self):
+        """Forget audio that no utterance can still need."""
+        keep = (self._open * self.frame if self._open is not None else self._frames * self.frame) - self.padding
+        while self._history and self._history[0][0] + len(self._history[0][1]) <= keep:
+            self._history.popleft()
+
+    def report(self) -> str:
+        """Totals for the current stream."""
+        stats = self.stats
+        fraction = stats['speech_seconds'] / stats['seconds'] if stats['seconds'] else 0.0
+        return (f"VAD: {stats['utterances']} utterances, {stats['speech_seconds']:.1f}s of {stats['seconds']:.1f}s "
+                f"forwarded ({fraction:.0%}), {stats['discarded']} too short, {stats['forced_splits']} forced splits")
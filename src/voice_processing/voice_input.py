@@ -1,51 +1,153 @@
-import pyaudio
-import wave
-import threading
-import queue
+from typing import Any, Dict, Iterator, Optional
 
-class VoiceInputProcessor:
-    def __init__(self):
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None  # only needed for the microphone; replayed sources work without PortAudio
+
+from voice_processing.audio_capture import AudioRingBuffer, AudioSource, DROP_OLDEST
+
+
+class MicrophoneSource(AudioSource):
+    """
+    Live capture from the default input device, in PortAudio callback mode:
+    the callback only copies each buffer into the ring and returns. Under
+    the BLOCK policy it waits at most one buffer's duration for space, since
+    waiting longer would stall PortAudio itself.
+    """
+
+    def __init__(self, rate: int = 16000, channels: int = 1, chunk: int = 1024):
+        super().__init__()
+        if pyaudio is None:
+            raise RuntimeError("pyaudio is required for microphone capture")
         self.format = pyaudio.paFloat32
-        self.channels = 1
-        self.rate = 16000
-        self.chunk = 1024
+        self.rate = rate
+        self.channels = channels
+        self.chunk = chunk
+        self.sample_width = pyaudio.get_sample_size(self.format)
+        self.block_timeout = chunk / rate
         self.audio = pyaudio.PyAudio()
         self.stream = None
-        self.recording = False
-        self.audio_queue = queue.Queue()
+        self.ring: Optional[AudioRingBuffer] = None
+        self.frames = 0
+        self.device_overflows = 0
 
-    def start_recording(self):
-        """Start recording audio from the microphone."""
-        self.recording = True
+    def start(self, ring: AudioRingBuffer):
+        self.ring = ring
         self.stream = self.audio.open(
             format=self.format,
             channels=self.channels,
             rate=self.rate,
             input=True,
-            frames_per_buffer=self.chunk
+            frames_per_buffer=self.chunk,
+            stream_callback=self._callback
         )
 
-    def stop_recording(self):
-        """Stop recording audio."""
-        self.recording = False
+    def _callback(self, in_data, frame_count, time_info, status):
+        """PortAudio callback: copy the buffer into the ring and return at once."""
+        if status & pyaudio.paInputOverflow:
+            self.device_overflows += 1
+        self.ring.write(in_data)
+        self.frames += frame_count
+        self._mark(self.frames)
+        return None, pyaudio.paContinue
+
+    def stop(self):
         if self.stream:
             self.stream.stop_stream()
             self.stream.close()
+            self.stream = None
+
+    def terminate(self):
+        self.audio.terminate()
 
-    def listen(self):
-        """Start listening for audio input."""
+
+class VoiceInputProcessor:
+    """
+    Captures audio from a source - the microphone by default, or e.g. an
+    audio_capture.FileSource or SourceMultiplexer session to replay
+    recordings - into a preallocated ring, so a slow consumer no longer
+    makes capture overrun. listen() and frames() read from the ring. When
+    the ring fills up, policy decides: DROP_OLDEST overwrites unread audio,
+    BLOCK makes the source wait (as long as the source allows) for space
+    before dropping the new audio.
+    """
+
+    def __init__(self, source: Optional[AudioSource] = None, ring_seconds: float = 10.0, policy: str = DROP_OLDEST):
+        self.source = source or MicrophoneSource()
+        self.channels = self.source.channels
+        self.rate = self.source.rate
+        self.chunk = 1024
+        self.recording = False
+        self.ring_seconds = ring_seconds
+        self.policy = policy
+        self.ring: Optional[AudioRingBuffer] = None
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.channels * self.source.sample_width
+
+    @property
+    def finished(self) -> bool:
+        """The source has ended (e.g. a replayed file) and everything it captured has been read."""
+        return self.ring is not None and self.ring.closed and not self.ring.available()
+
+    def start_recording(self):
+        """Start recording audio from the source."""
+        self.recording = True
+        self.ring = AudioRingBuffer(
+            int(self.ring_seconds * self.rate) * self.frame_bytes, self.policy,
+            block_timeout=self.source.block_timeout, frame_bytes=self.frame_bytes,
+        )
+        self.source.start(self.ring)
+
+    def recording_params(self):
+        """SessionRecorder parameters matching the captured stream."""
+        return {
+            'rate': self.rate,
+            'channels': self.channels,
+            'sample_width': self.source.sample_width,
+            'is_float': self.source.is_float,
+        }
+
+    def capture_time(self, seconds: float) -> Optional[float]:
+        """time.perf_counter() value at which the audio at this stream position was captured."""
+        return self.source.capture_time(seconds)
+
+    def stop_recording(self):
+        """Stop recording audio."""
+        self.recording = False
+        self.source.stop()
+        if self.ring is not None:
+            self.ring.close()
+
+    def listen(self, timeout: Optional[float] = 1.0):
+        """Return the next chunk of captured audio, or None if none arrived within timeout."""
         if not self.recording:
             self.start_recording()
-            
-        try:
-            # Read audio data
-            data = self.stream.read(self.chunk)
-            return data
-        except Exception as e:
-            print(f"Error reading audio: {e}")
-            return None
+        return self.ring.read(self.chunk * self.frame_bytes, timeout)
+
+    def frames(self, frame_size: Optional[int] = None, timeout: Optional[float] = 1.0) -> Iterator[bytes]:
+        """Yield captured audio frame_size frames (default: one chunk) at a time until recording stops."""
+        if not self.recording:
+            self.start_recording()
+        return self.ring.frames((frame_size or self.chunk) * self.frame_bytes, timeout)
+
+    def capture_stats(self) -> Dict[str, Any]:
+        """Overrun, underrun and fill counters for the current ring."""
+        ring = self.ring
+        if ring is None:
+            return {}
+        bytes_per_second = self.rate * self.frame_bytes
+        return {
+            'policy': ring.policy, 'overruns': ring.overruns, 'underruns': ring.underruns,
+            'dropped_seconds': ring.dropped_bytes / bytes_per_second,
+            'max_fill_seconds': ring.max_fill / bytes_per_second,
+            'device_overflows': getattr(self.source, 'device_overflows', 0),
+        }
 
     def stop(self):
         """Clean up resources."""
         self.stop_recording()
-        self.audio.terminate() 
\ No newline at end of file
+        if isinstance(self.source, MicrophoneSource):
+            self.source.terminate()